@@ -46,15 +46,20 @@ pub async fn handle_ingest(
 
     info!("Ingesting file '{}' for User: {}", filename, user_id);
     let client = reqwest::Client::new();
+    let doc_id = Uuid::new_v4();
 
-    // 1. EXTRACT
+    // 1. EXTRACT (with user_id the ingestion service links passages that
+    // near-duplicate this user's earlier uploads to the original passage)
     let ingest_url = env::var("INGESTION_SERVICE_URL").unwrap_or("http://ingestion-service:8001".to_string());
     let part = reqwest::multipart::Part::bytes(file_bytes)
         .file_name(filename.clone())
         .mime_str(&content_type)
         .map_err(|_| warp::reject::not_found())?;
     
-    let multipart_form = reqwest::multipart::Form::new().part("file", part);
+    let multipart_form = reqwest::multipart::Form::new()
+        .part("file", part)
+        .text("user_id", user_id.clone())
+        .text("document_id", doc_id.to_string());
     let ingest_res = client.post(format!("{}/extract", ingest_url))
         .multipart(multipart_form)
         .send().await.map_err(|_| warp::reject::not_found())?;
@@ -64,19 +69,25 @@ pub async fn handle_ingest(
     let total_chars = extraction_data["total_chars"].as_u64().unwrap_or(0);
 
     // 2. SAVE DB
-    let doc_id = Uuid::new_v4();
     let _ = sqlx::query("INSERT INTO documents (id, filename, content_type, s3_key, upload_time, user_id, metadata) VALUES ($1, $2, $3, $4, NOW(), $5, $6)")
-        .bind(doc_id).bind(&filename).bind(&content_type).bind("local").bind(&user_id).bind(json!({ "total_chars": total_chars as i64 }))
+        .bind(doc_id).bind(&filename).bind(&content_type).bind("local").bind(&user_id).bind(json!({ "total_chars": total_chars as i64, "dedup": extraction_data["dedup"] }))
         .execute(&db_pool).await;
 
     // 3. EMBED & INDEX
     let mut texts_to_embed = Vec::new();
     let mut metadatas = Vec::new();
+    let mut duplicates = 0;
 
     for (i, p) in passages.iter().enumerate() {
         let text = p["text"].as_str().unwrap_or("").to_string();
         let page = p["page"].as_i64();
-        
+
+        // Already embedded and indexed as the passage it duplicates
+        if !p["metadata"]["duplicate_of"].is_null() {
+            duplicates += 1;
+            continue;
+        }
+
         if !text.trim().is_empty() {
             texts_to_embed.push(text.clone());
             metadatas.push(json!({
@@ -89,23 +100,64 @@ pub async fn handle_ingest(
         }
     }
 
+    let mut indexed = true;
     if !texts_to_embed.is_empty() {
         let embed_url = env::var("EMBEDDING_SERVICE_URL").unwrap_or("http://embedding-service:8002".to_string());
         let vector_url = env::var("VECTOR_DB_SERVICE_URL").unwrap_or("http://vector-db-service:8003".to_string());
 
         for (chunk_texts, chunk_metas) in texts_to_embed.chunks(50).zip(metadatas.chunks(50)) {
-            let embed_req = json!({ "texts": chunk_texts });
-            if let Ok(resp) = client.post(format!("{}/embed", embed_url)).json(&embed_req).send().await {
-                if let Ok(embed_data) = resp.json::<Value>().await {
-                    if let Some(embeddings) = embed_data["embeddings"].as_array() {
-                        let add_req = json!({ "vectors": embeddings, "metadata": chunk_metas });
-                        let _ = client.post(format!("{}/index/add", vector_url)).json(&add_req).send().await;
-                    }
-                }
+            if let Err(e) = embed_and_index(&client, &embed_url, &vector_url, chunk_texts, chunk_metas).await {
+                error!("Indexing part of '{}' failed: {}", filename, e);
+                indexed = false;
             }
         }
     }
 
-    let response = IngestResponse { document_id: doc_id, filename, passages_count: passages.len() };
+    // 4. DEDUP: this document's passages only become link targets for
+    // later uploads once all of them are indexed
+    if !extraction_data["dedup"].is_null() {
+        let dedup_doc_id = extraction_data["dedup"]["document_id"].as_str().unwrap_or_default().to_string();
+        let action = if indexed { "commit" } else { "abort" };
+        let dedup_req = json!({ "user_id": user_id, "document_id": dedup_doc_id });
+        match client.post(format!("{}/dedup/{}", ingest_url, action)).json(&dedup_req).send().await {
+            Ok(resp) if resp.status().is_success() => {}
+            Ok(resp) => error!("Dedup {} for '{}' failed: {}", action, filename, resp.status()),
+            Err(e) => error!("Dedup {} for '{}' failed: {}", action, filename, e),
+        }
+    }
+
+    info!("Skipped {} near-duplicate passages of '{}'", duplicates, filename);
+    let response = IngestResponse { document_id: doc_id, filename, passages_count: passages.len(), duplicate_passages: duplicates };
     Ok(warp::reply::json(&response))
-}
\ No newline at end of file
+}
+
+// --- HELPER: EMBED ONE BATCH AND ADD IT TO THE INDEX ---
+async fn embed_and_index(
+    client: &reqwest::Client,
+    embed_url: &str,
+    vector_url: &str,
+    texts: &[String],
+    metadatas: &[Value],
+) -> Result<(), String> {
+    let resp = client.post(format!("{}/embed", embed_url))
+        .json(&json!({ "texts": texts }))
+        .send().await.map_err(|e| e.to_string())?;
+    if !resp.status().is_success() {
+        return Err(format!("Embedding API Error: {}", resp.status()));
+    }
+    let embed_data: Value = resp.json().await.map_err(|e| e.to_string())?;
+    let embeddings = embed_data["embeddings"].as_array().ok_or("Embedding response has no embeddings")?;
+    if embeddings.len() != texts.len() {
+        return Err(format!("Got {} embeddings for {} passages", embeddings.len(), texts.len()));
+    }
+
+    let resp = client.post(format!("{}/index/add", vector_url))
+        .json(&json!({ "vectors": embeddings, "metadata": metadatas }))
+        .send().await.map_err(|e| e.to_string())?;
+    if resp.status().is_success() {
+        Ok(())
+    } else {
+        let error_text = resp.text().await.unwrap_or_default();
+        Err(format!("Vector DB API Error: {}", error_text))
+    }
+}
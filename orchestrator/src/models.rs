@@ -88,6 +88,7 @@ pub struct IngestResponse {
     pub document_id: Uuid,
     pub filename: String,
     pub passages_count: usize,
+    pub duplicate_passages: usize,
 }
 
 #[derive(Debug, Deserialize)]
@@ -0,0 +1,135 @@
+"""
+Benchmark: /embed encode throughput with and without length-bucketed
+micro-batches, on PassageChunker output mixed with short search queries.
+
+Batches mirror production traffic: the orchestrator embeds each
+document's passages 50 at a time, and the dynamic batcher coalesces those
+with concurrent single-query requests.
+
+    python benchmarks/length_bucketing.py                   # synthetic corpus
+    python benchmarks/length_bucketing.py --corpus docs/    # *.txt files
+    python benchmarks/length_bucketing.py --padding-only    # no model needed
+"""
+from typing import List
+from pathlib import Path
+from types import SimpleNamespace
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT.parent / "ingestion" / "src"))
+
+from batching import token_lengths, plan_batches, padded_tokens
+from chunker import PassageChunker
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or an at which not have has "
+    "revenue contract invoice policy customer report quarterly migration network storage identity "
+    "approval deadline budget forecast incident outage release deployment compliance audit vendor "
+    "employee onboarding benefits security password account settings schedule meeting agenda summary"
+).split()
+
+
+def synthetic_document(rng: random.Random, chars: int) -> str:
+    sentences = []
+    total = 0
+    while total < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 28))).capitalize() + "."
+        sentences.append(sentence)
+        total += len(sentence) + 1
+        if rng.random() < 0.15:
+            sentences.append("\n\n")
+    return " ".join(sentences)
+
+
+def load_documents(corpus: str, count: int, seed: int) -> List[str]:
+    if corpus:
+        return [p.read_text(encoding="utf-8", errors="ignore") for p in sorted(Path(corpus).glob("**/*.txt"))]
+    rng = random.Random(seed)
+    # Median ~6k chars (2 pages) with a long tail of large reports
+    return [synthetic_document(rng, int(min(200_000, max(200, rng.lognormvariate(8.7, 1.2))))) for _ in range(count)]
+
+
+def build_batches(documents: List[str], queries_per_batch: int, seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    chunker = PassageChunker(chunk_size=1024, overlap=50)
+    batches = []
+    for document in documents:
+        passages = [p["text"] for p in chunker.chunk(document, {"format": "txt"})]
+        for start in range(0, len(passages), 50):
+            queries = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 16)))
+                for _ in range(np.random.default_rng(rng.randrange(1 << 30)).poisson(queries_per_batch))
+            ]
+            batch = passages[start:start + 50] + queries
+            rng.shuffle(batch)
+            batches.append(batch)
+    return batches
+
+
+def run(model, batches: List[List[str]], sort_by_length: bool, budget: int, max_batch_size: int, encode: bool):
+    tokens = padded = 0
+    started = time.perf_counter()
+    for texts in batches:
+        lengths = token_lengths(model, texts)
+        order, micro = plan_batches(lengths, budget, max_batch_size, sort_by_length)
+        tokens += int(lengths.sum())
+        padded += padded_tokens(lengths[order], micro)
+        if encode:
+            for start, end in micro:
+                model.encode([texts[i] for i in order[start:end]], batch_size=end - start,
+                             normalize_embeddings=True, show_progress_bar=False)
+    return tokens, padded, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="", help="directory of .txt documents (default: synthetic)")
+    parser.add_argument("--documents", type=int, default=200, help="synthetic documents to generate")
+    parser.add_argument("--queries-per-batch", type=float, default=8, help="mean short queries coalesced per batch")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384)
+    parser.add_argument("--max-batch-size", type=int, default=128)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", help="torch | onnx | onnx-int8")
+    parser.add_argument("--onnx-cache-dir", default=os.getenv("EMBED_ONNX_CACHE_DIR", "/tmp/embedding-onnx-cache"))
+    parser.add_argument("--padding-only", action="store_true", help="report padding with a chars/4 token estimate, no model")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    batches = build_batches(load_documents(args.corpus, args.documents, args.seed), args.queries_per_batch, args.seed)
+    print(f"{len(batches)} batches, {sum(len(b) for b in batches)} texts")
+
+    if args.padding_only:
+        model = SimpleNamespace(max_seq_length=256, tokenizer=None)
+    else:
+        from backends import load_backend
+        model, info = load_backend(args.backend, args.model, args.onnx_cache_dir)
+        print(f"backend: {info['backend']}")
+        model.encode(["warm up"] * 8, batch_size=8, show_progress_bar=False)
+
+    results = {}
+    for label, sort_by_length in (("request order", False), ("length-bucketed", True)):
+        tokens, padded, seconds = run(model, batches, sort_by_length, args.max_batch_tokens,
+                                      args.max_batch_size, encode=not args.padding_only)
+        results[label] = (tokens, padded, seconds)
+        line = f"{label:>16}: {tokens} tokens, {padded} padded ({tokens / padded:.1%} useful)"
+        if not args.padding_only:
+            line += f", {seconds:.2f}s, {tokens / seconds:,.0f} tokens/sec"
+        print(line)
+
+    before, after = results["request order"], results["length-bucketed"]
+    print(f"padded tokens reduced {1 - after[1] / before[1]:.1%}")
+    if not args.padding_only:
+        print(f"throughput {before[2] / after[2]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
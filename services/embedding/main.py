@@ -2,11 +2,30 @@
 Embedding Service
 Generates vector embeddings for text passages
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Dict, Optional, AsyncIterator, Tuple, Union
+import asyncio
+import json
 import logging
+import os
+import sys
+import time
 import numpy as np
+from pathlib import Path
+
+_import_started = time.monotonic()
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from wire import VECTOR_BATCH_MEDIA_TYPE, DTYPE_CODES, encode_vector_batch, quantize_int8
+from batching import token_lengths, token_budget, micro_batches, plan_batches, padded_tokens
+from scheduler import DynamicBatcher, QueueFull
+from cache import EmbeddingCache, cache_key
+from backends import BACKENDS, load_backend
+from registry import DimensionMismatch, ModelRegistry, ResidentModel, UnknownModel
 
 # Setup logging
 logging.basicConfig(
@@ -17,82 +36,505 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Embedding Service", version="1.0.0")
 
-# Load model (lazy loading to speed up startup)
-_model = None
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
-def get_model():
-    global _model
-    if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-            logger.info("Loading embedding model: all-MiniLM-L6-v2")
-            _model = SentenceTransformer('all-MiniLM-L6-v2')
-            logger.info("Model loaded successfully")
-        except ImportError:
-            logger.error("sentence-transformers not installed")
-            raise HTTPException(status_code=500, detail="sentence-transformers not available")
-    return _model
+# Micro-batching: padded-token budget per encode call (lowered further
+# when free memory is short) and a hard cap on texts per call
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "16384"))
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "128"))
+EMBED_MEMORY_FRACTION = float(os.getenv("EMBED_MEMORY_FRACTION", "0.25"))
+
+# Group texts of similar token length into the same micro-batch to cut
+# padding (results are returned in request order either way)
+EMBED_SORT_BY_LENGTH = os.getenv("EMBED_SORT_BY_LENGTH", "true").lower() == "true"
+
+# Cross-request batching: concurrent requests are coalesced for up to
+# this long, or until this many texts are waiting
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_TEXTS = int(os.getenv("EMBED_BATCH_MAX_TEXTS", "64"))
+
+# Admission control: requests are rejected with 429 once this many texts
+# are waiting for the model (0 disables the limit)
+EMBED_MAX_QUEUE_TEXTS = int(os.getenv("EMBED_MAX_QUEUE_TEXTS", "4096"))
+
+# torch / ONNX Runtime intra-op threads for inference (0 keeps the default)
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "0"))
+
+# Inference backend: torch | onnx | onnx-int8. ONNX exports are cached in
+# EMBED_ONNX_CACHE_DIR and must match torch to EMBED_PARITY_MIN_COSINE
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_ONNX_CACHE_DIR = os.getenv("EMBED_ONNX_CACHE_DIR", "/app/onnx-cache")
+EMBED_PARITY_MIN_COSINE = float(os.getenv("EMBED_PARITY_MIN_COSINE", "0.99"))
+if EMBED_BACKEND not in BACKENDS:
+    raise ValueError(f"EMBED_BACKEND must be one of {BACKENDS}, got '{EMBED_BACKEND}'")
+
+# Embedding cache: in-memory LRU entries, plus an optional on-disk arena
+# (disabled unless EMBED_CACHE_DIR is set) that survives restarts
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000"))
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "")
+EMBED_CACHE_DISK_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_DISK_MAX_ENTRIES", "1000000"))
+
+# Load and warm the model at startup instead of on the first request;
+# /ready stays 503 until that has finished
+EMBED_EAGER_WARMUP = os.getenv("EMBED_EAGER_WARMUP", "false").lower() == "true"
+
+# Model registry: the default model, other models /embed may ask for, and
+# the parameter memory all resident models may use (0 = unlimited)
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_MODELS = {name.strip() for name in os.getenv("EMBED_MODELS", "").split(",") if name.strip()}
+EMBED_MODEL_MEMORY_MB = int(os.getenv("EMBED_MODEL_MEMORY_MB", "2048"))
+
+# Startup instrumentation: seconds per phase
+_startup = {
+    "mode": "eager" if EMBED_EAGER_WARMUP else "lazy",
+    "ready": not EMBED_EAGER_WARMUP,
+    "error": None,
+    "phases": {}
+}
+_warmup_task = None
+_model_tasks = set()  # background /models/load tasks
+
+def load_model(name: str):
+    """Registry loader: (model, backend info) for name on EMBED_BACKEND"""
+    try:
+        if EMBED_TORCH_THREADS > 0:
+            import torch
+            torch.set_num_threads(EMBED_TORCH_THREADS)
+        logger.info(f"Loading embedding model: {name} ({EMBED_BACKEND})")
+        started = time.monotonic()
+        model, info = load_backend(
+            EMBED_BACKEND,
+            name,
+            EMBED_ONNX_CACHE_DIR,
+            min_cosine=EMBED_PARITY_MIN_COSINE,
+            threads=EMBED_TORCH_THREADS
+        )
+        elapsed = time.monotonic() - started
+        _startup["phases"].setdefault("model_load", elapsed)
+        logger.info(f"Model {name} loaded successfully on {info['backend']} in {elapsed:.2f}s")
+        return model, info
+    except ImportError as e:
+        logger.error(f"Embedding backend dependencies not installed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{EMBED_BACKEND} backend not available")
+
+# Models load lazily (or at startup with EMBED_EAGER_WARMUP)
+_registry = ModelRegistry(
+    load_model,
+    EMBED_MODEL,
+    memory_budget_bytes=EMBED_MODEL_MEMORY_MB * 1024 * 1024,
+    allowed_models=EMBED_MODELS
+)
+
+def get_model(name: Optional[str] = None):
+    """Model object for name (default model if None), loading it if needed"""
+    return _registry.get(name or _registry.default_model).model
+
+def cache_model_id(name: str) -> str:
+    # Backends produce slightly different vectors, so they never share cache entries
+    return f"{name}@{EMBED_BACKEND}"
 
 class EmbedRequest(BaseModel):
     texts: List[str]
     normalize: bool = True
+    model: Optional[str] = None
+    dimensions: Optional[int] = None  # keep only the first n components
+    dtype: str = "float32"  # JSON output: float32 | int8
+
+class LoadModelRequest(BaseModel):
+    model: str
+    make_default: bool = False
+    allow_dimension_change: bool = False  # only when the vector store will be re-indexed
 
 class EmbedResponse(BaseModel):
-    embeddings: List[List[float]]
+    embeddings: Union[List[List[int]], List[List[float]]]
     model: str
     dimensions: int
+    dtype: str = "float32"
 
 class ModelInfo(BaseModel):
     model: str
     dimensions: int
     max_seq_length: int
+    backend: str
+    parity: Optional[Dict[str, float]] = None
+
+def negotiate_vector_batch(accept: str) -> Optional[str]:
+    """
+    Return the requested binary dtype if the Accept header asks for
+    application/x-vector-batch (e.g. "application/x-vector-batch; dtype=float16"),
+    or None to answer with JSON.
+    """
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if media_type != VECTOR_BATCH_MEDIA_TYPE:
+            continue
+        dtype = "float32"
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dtype":
+                dtype = value.strip()
+        if dtype not in DTYPE_CODES:
+            raise HTTPException(status_code=406, detail=f"Unsupported dtype '{dtype}', expected one of {list(DTYPE_CODES)}")
+        return dtype
+    return None
+
+def reduce_dimensions(embeddings: np.ndarray, dimensions: Optional[int], normalize: bool) -> np.ndarray:
+    """
+    Matryoshka truncation: keep the leading components, re-normalized when
+    normalize is set. Only Matryoshka-trained models keep their quality
+    under truncation; for others it trades accuracy for size.
+    """
+    if dimensions is None or dimensions >= embeddings.shape[1]:
+        return embeddings
+    reduced = np.array(embeddings[:, :dimensions], dtype=np.float32)
+    if normalize:
+        reduced /= np.clip(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12, None)
+    return reduced
+
+def json_embeddings(embeddings: np.ndarray, dtype: str) -> list:
+    return quantize_int8(embeddings).tolist() if dtype == "int8" else embeddings.tolist()
+
+def validate_output(request: EmbedRequest, binary_dtype: Optional[str]):
+    if request.dimensions is not None and request.dimensions < 1:
+        raise HTTPException(status_code=400, detail="dimensions must be at least 1")
+    if binary_dtype is None and request.dtype not in ("float32", "int8"):
+        raise HTTPException(status_code=400, detail="JSON dtype must be float32 or int8 (float16 needs the binary format)")
+    if "int8" in (binary_dtype, request.dtype) and not request.normalize:
+        raise HTTPException(status_code=400, detail="int8 output requires normalize=true")
+
+def plan_micro_batches(model, texts: List[str]) -> List[Tuple[int, int]]:
+    """[start, end) micro-batches of texts, in order, sized by token length and free memory"""
+    lengths = token_lengths(model, texts)
+    budget = token_budget(EMBED_MAX_BATCH_TOKENS, EMBED_MEMORY_FRACTION)
+    return list(micro_batches(lengths, budget, EMBED_MAX_BATCH_SIZE))
+
+def encode_batch(model, texts: List[str], normalize: bool) -> np.ndarray:
+    return model.encode(
+        texts,
+        batch_size=len(texts),
+        normalize_embeddings=normalize,
+        show_progress_bar=False
+    )
+
+_padding = {"tokens": 0, "padded_tokens": 0}
+
+def encode_texts(texts: List[str], normalize: bool, model_name: str) -> np.ndarray:
+    """
+    Encode a (possibly coalesced) batch; runs on the batcher's worker
+    thread. Texts are bucketed by token length and scattered back into
+    request order.
+    """
+    model = get_model(model_name)
+    lengths = token_lengths(model, texts)
+    budget = token_budget(EMBED_MAX_BATCH_TOKENS, EMBED_MEMORY_FRACTION)
+    order, batches = plan_batches(lengths, budget, EMBED_MAX_BATCH_SIZE, EMBED_SORT_BY_LENGTH)
+    _padding["tokens"] += int(lengths.sum())
+    _padding["padded_tokens"] += padded_tokens(lengths[order], batches)
+
+    embeddings = None
+    for start, end in batches:
+        rows = order[start:end]
+        part = encode_batch(model, [texts[i] for i in rows], normalize)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), part.shape[1]), dtype=part.dtype)
+        embeddings[rows] = part
+    return embeddings
+
+def padding_metrics():
+    tokens, padded = _padding["tokens"], _padding["padded_tokens"]
+    return {
+        "sort_by_length": EMBED_SORT_BY_LENGTH,
+        "tokens": tokens,
+        "padded_tokens": padded,
+        "efficiency": tokens / padded if padded else 1.0,
+    }
+
+_batcher = DynamicBatcher(
+    encode_texts,
+    max_batch_texts=EMBED_BATCH_MAX_TEXTS,
+    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+    max_queue_texts=EMBED_MAX_QUEUE_TEXTS
+)
+
+_cache = EmbeddingCache(
+    max_entries=EMBED_CACHE_MAX_ENTRIES,
+    disk_dir=EMBED_CACHE_DIR or None,
+    disk_max_entries=EMBED_CACHE_DISK_MAX_ENTRIES
+)
+
+async def embed_cached(texts: List[str], normalize: bool, model_name: str) -> np.ndarray:
+    """
+    Serve what the cache has and send only the misses (each distinct text
+    once) to the batcher; rows come back in request order
+    """
+    model_id = cache_model_id(model_name)
+    keys = [cache_key(model_id, normalize, text) for text in texts]
+    cached = _cache.get_many(model_id, keys)
+
+    missing: Dict[bytes, List[int]] = {}
+    for i, vector in enumerate(cached):
+        if vector is None:
+            missing.setdefault(keys[i], []).append(i)
+    if not missing:
+        return np.stack(cached)
+
+    # Load outside the inference thread so other models keep encoding
+    await _registry.ensure_loaded(model_name)
+    miss_keys = list(missing)
+    encoded = await _batcher.submit([texts[missing[key][0]] for key in miss_keys], normalize, model_name)
+    _cache.put_many(model_id, miss_keys, encoded)
+    if len(missing) == len(texts):
+        return encoded
+
+    embeddings = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+    for i, vector in enumerate(cached):
+        if vector is not None:
+            embeddings[i] = vector
+    for key, row in zip(miss_keys, encoded):
+        embeddings[missing[key]] = row
+    return embeddings
+
+async def stream_ndjson(texts: List[str], normalize: bool, resident: ResidentModel,
+                        dimensions: Optional[int], dtype: str) -> AsyncIterator[bytes]:
+    """
+    One JSON line per micro-batch, then a summary line. The texts were
+    reserved against the queue limit by the caller; each micro-batch runs
+    on the inference thread, interleaved with coalesced batches. Streams
+    keep request order (no length sorting) so each line is a contiguous
+    offset range.
+    """
+    remaining = len(texts)
+    model = resident.model
+    model_id = cache_model_id(resident.name)
+    try:
+        batches = await _batcher.run(plan_micro_batches, model, texts)
+        output_dimensions = 0
+        for start, end in batches:
+            embeddings = await _batcher.run(encode_batch, model, texts[start:end], normalize)
+            _batcher.release(end - start)
+            remaining -= end - start
+            # Streamed results are written through so later requests hit
+            _cache.put_many(model_id, [cache_key(model_id, normalize, text) for text in texts[start:end]], embeddings)
+            embeddings = reduce_dimensions(embeddings, dimensions, normalize)
+            output_dimensions = embeddings.shape[1]
+            yield (json.dumps({"offset": start, "embeddings": json_embeddings(embeddings, dtype)}) + "\n").encode("utf-8")
+        summary = {"done": True, "count": len(texts), "model": resident.name, "dimensions": output_dimensions, "dtype": dtype}
+        yield (json.dumps(summary) + "\n").encode("utf-8")
+    finally:
+        _batcher.release(remaining)
+
+def overloaded(e: QueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Embedding queue is full ({e.queued_texts} texts waiting), retry later",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def warm_up(model):
+    """
+    Run dummy encodes at the shortest and longest sequence lengths so
+    kernels are initialized and buffers allocated before real traffic;
+    runs on the inference thread
+    """
+    started = time.monotonic()
+    encode_batch(model, ["warm up"] * 8, True)
+    encode_batch(model, ["warm up " * model.max_seq_length] * 8, True)
+    _startup["phases"]["warmup_encode"] = time.monotonic() - started
+
+async def run_warmup(started: float):
+    try:
+        resident = await _registry.ensure_loaded(_registry.default_model)
+        await _batcher.run(warm_up, resident.model)
+    except Exception as e:
+        _startup["error"] = str(getattr(e, "detail", e))
+        logger.error(f"Warm-up failed: {_startup['error']}")
+        return
+    _startup["phases"]["total"] = time.monotonic() - started
+    _startup["ready"] = True
+    logger.info(f"Embedding service ready: {json.dumps(_startup['phases'])}")
+
+@app.on_event("startup")
+async def startup():
+    global _warmup_task
+    started = time.monotonic()
+    _startup["phases"]["imports"] = started - _import_started
+    _batcher.start()
+    if EMBED_EAGER_WARMUP:
+        # In the background so /health answers while the model loads
+        _warmup_task = asyncio.create_task(run_warmup(_import_started))
+
+@app.on_event("shutdown")
+async def shutdown():
+    await _batcher.stop()
+    _registry.shutdown()
+    _cache.flush()
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "embedding"}
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until eager warm-up has finished (always ready in
+    lazy mode, where the first request loads the model)
+    """
+    body = {"status": "ready" if _startup["ready"] else "starting", "service": "embedding", **_startup}
+    return JSONResponse(status_code=200 if _startup["ready"] else 503, content=body)
+
+@app.get("/metrics")
+async def metrics():
+    """Batching queue depth, throughput, padding, cache hit/miss counters and startup timings"""
+    return {
+        "batcher": _batcher.metrics(),
+        "padding": padding_metrics(),
+        "cache": _cache.stats(),
+        "models": _registry.stats(),
+        "startup": _startup
+    }
+
+def resolve_model(name: Optional[str]) -> str:
+    try:
+        return _registry.resolve(name)
+    except UnknownModel as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/model-info", response_model=ModelInfo)
-async def model_info():
-    """Get embedding model information"""
-    model = get_model()
+async def model_info(model: Optional[str] = None):
+    """Get embedding model information (the default model unless ?model= is given)"""
+    resident = await _registry.ensure_loaded(resolve_model(model))
     return ModelInfo(
-        model="all-MiniLM-L6-v2",
-        dimensions=384,
-        max_seq_length=model.max_seq_length
+        model=resident.name,
+        dimensions=resident.dimensions,
+        max_seq_length=resident.model.max_seq_length,
+        backend=resident.info["backend"],
+        parity=resident.info["parity"]
     )
 
-@app.post("/embed", response_model=EmbedResponse)
-async def embed_texts(request: EmbedRequest):
+@app.get("/models")
+async def list_models():
+    """Resident models, loads in progress and the memory budget"""
+    return _registry.stats()
+
+async def load_in_background(name: str, make_default: bool, allow_dimension_change: bool):
+    try:
+        if make_default:
+            await _registry.swap_default(name, allow_dimension_change)
+        else:
+            await _registry.ensure_loaded(name)
+    except Exception as e:
+        logger.error(f"Background load of {name} failed: {str(getattr(e, 'detail', e))}")
+
+@app.post("/models/load", status_code=202)
+async def load_model_endpoint(request: LoadModelRequest):
+    """
+    Load a model in the background and optionally make it the default
+    once it is ready. Requests keep using the current default until the
+    swap; requests already running finish on the model they started with.
+
+    Only models in EMBED_MODELS can be loaded. A default whose dimensions
+    differ from the current one is refused (409 when both are resident,
+    otherwise after the load, reported as swap_error on /models) unless
+    allow_dimension_change is set for a re-index.
     """
-    Generate embeddings for a batch of texts
+    name = resolve_model(request.model)
+    if request.make_default:
+        current, entry = _registry.resident(_registry.default_model), _registry.resident(name)
+        if current is not None and entry is not None:
+            try:
+                _registry.check_dimensions(current, entry, request.allow_dimension_change)
+            except DimensionMismatch as e:
+                raise HTTPException(status_code=409, detail=str(e))
+    task = asyncio.create_task(load_in_background(name, request.make_default, request.allow_dimension_change))
+    _model_tasks.add(task)
+    task.add_done_callback(_model_tasks.discard)
+    return {"status": "loading", "model": request.model, "make_default": request.make_default}
+
+@app.post(
+    "/embed",
+    response_model=EmbedResponse,
+    responses={200: {"content": {
+        VECTOR_BATCH_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}}
+    }}}
+)
+async def embed_texts(request: EmbedRequest, http_request: Request):
     """
+    Generate embeddings for a batch of texts.
+
+    JSON by default; with "Accept: application/x-vector-batch" (optionally
+    "; dtype=float16" or "; dtype=int8") the embeddings come back as a raw
+    little-endian buffer with a shape header instead of nested float lists. With
+    "Accept: application/x-ndjson" results stream as one JSON line per
+    micro-batch ({"offset": i, "embeddings": [...]}) followed by a
+    {"done": true, ...} line, so early vectors arrive before the last
+    ones are computed.
+
+    There is no limit on the number of texts: they are encoded in
+    micro-batches sized by token length and available memory. "model"
+    picks one of the service's models (EMBED_MODEL by default). Texts
+    already embedded with the same model and normalize flag are served
+    from the cache; only the misses reach the model.
+
+    Compact output: "dimensions" truncates each vector to its leading
+    components (Matryoshka-style, re-normalized), and "dtype": "int8"
+    returns JSON integer codes round(x * 127) of the normalized vector.
+    Cached entries are always full-size float32.
+
+    Inference runs on a dedicated thread, never on the event loop. When
+    more than EMBED_MAX_QUEUE_TEXTS texts are already waiting the request
+    is rejected with 429 and a Retry-After hint (in seconds).
+    """
+    accept = http_request.headers.get("accept", "")
+    binary_dtype = negotiate_vector_batch(accept)
+    
     if not request.texts:
         raise HTTPException(status_code=400, detail="No texts provided")
+    validate_output(request, binary_dtype)
     
-    if len(request.texts) > 100:
-        raise HTTPException(status_code=400, detail="Maximum 100 texts per request")
+    model_name = resolve_model(request.model)
+    logger.info(f"Embedding {len(request.texts)} texts with {model_name}")
     
-    logger.info(f"Embedding {len(request.texts)} texts")
+    if binary_dtype is None and NDJSON_MEDIA_TYPE in accept:
+        resident = await _registry.ensure_loaded(model_name)
+        try:
+            _batcher.reserve(len(request.texts))
+        except QueueFull as e:
+            raise overloaded(e)
+        return StreamingResponse(
+            stream_ndjson(request.texts, request.normalize, resident, request.dimensions, request.dtype),
+            media_type=NDJSON_MEDIA_TYPE
+        )
     
     try:
-        model = get_model()
-        embeddings = model.encode(
-            request.texts,
-            normalize_embeddings=request.normalize,
-            show_progress_bar=False
-        )
+        embeddings = await embed_cached(request.texts, request.normalize, model_name)
+        embeddings = reduce_dimensions(embeddings, request.dimensions, request.normalize)
+        
+        if binary_dtype is not None:
+            logger.info(f"Generated {len(embeddings)} embeddings ({binary_dtype} binary)")
+            return Response(
+                content=encode_vector_batch(embeddings, binary_dtype),
+                media_type=VECTOR_BATCH_MEDIA_TYPE,
+                headers={"X-Embedding-Model": model_name}
+            )
         
         # Convert to list for JSON serialization
-        embeddings_list = embeddings.tolist()
+        embeddings_list = json_embeddings(embeddings, request.dtype)
         
         logger.info(f"Generated {len(embeddings_list)} embeddings")
         
         return EmbedResponse(
             embeddings=embeddings_list,
-            model="all-MiniLM-L6-v2",
-            dimensions=len(embeddings_list[0]) if embeddings_list else 0
+            model=model_name,
+            dimensions=len(embeddings_list[0]) if embeddings_list else 0,
+            dtype=request.dtype
         )
     
+    except QueueFull as e:
+        logger.warning(f"Rejected {len(request.texts)} texts: {str(e)}")
+        raise overloaded(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Embedding error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
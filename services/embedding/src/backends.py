@@ -0,0 +1,219 @@
+"""
+Inference backends for the embedding model: PyTorch (sentence-transformers),
+ONNX Runtime FP32 and dynamically INT8-quantized ONNX
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model-int8.onnx"}
+EXPORT_META = "export.json"
+
+# Fixed probe set for the parity check: short, long, punctuated and
+# non-English text so truncation and padding paths are exercised
+PARITY_SENTENCES = [
+    "The quarterly report is due on Friday.",
+    "Reset your password from the account settings page.",
+    "Invoice #4471 was paid in full on 2023-11-02, no further action is required.",
+    "Der Vertrag verlängert sich automatisch um ein weiteres Jahr.",
+    "ok",
+    " ".join(["The migration plan covers storage, networking and identity."] * 40),
+]
+
+
+def load_torch(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+class OnnxEncoder:
+    """
+    Drop-in for the parts of SentenceTransformer the service uses
+    (encode, tokenizer, max_seq_length), running the exported transformer
+    in ONNX Runtime and applying the pooling/normalization recorded at
+    export time.
+    """
+
+    def __init__(self, directory: Path, filename: str, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(directory / EXPORT_META, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.max_seq_length = meta["max_seq_length"]
+        self.pooling = meta["pooling"]
+        self.normalize_output = meta["normalize"]
+        self.dimensions = meta.get("dimensions")
+        self.memory_bytes = (directory / filename).stat().st_size
+        self.tokenizer = AutoTokenizer.from_pretrained(str(directory))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(directory / filename), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.dimensions
+
+    def encode(self, sentences: List[str], batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        parts = []
+        for start in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self._input_names}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded["attention_mask"][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize_output or normalize_embeddings:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            parts.append(pooled.astype(np.float32))
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def export_onnx(reference, directory: Path):
+    """Export the transformer of a SentenceTransformer plus its tokenizer"""
+    import torch
+    from sentence_transformers.models import Normalize, Pooling
+
+    transformer = reference[0]
+    pooling = next((m for m in reference if isinstance(m, Pooling)), None)
+    if pooling is not None and pooling.pooling_mode_cls_token:
+        pooling_mode = "cls"
+    elif pooling is None or pooling.pooling_mode_mean_tokens:
+        pooling_mode = "mean"
+    else:
+        raise ValueError("Only mean and CLS pooling can be exported to ONNX")
+
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+    try:
+        auto_model = transformer.auto_model.eval()
+        dummy = transformer.tokenizer(["export"], return_tensors="pt")
+        input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        with torch.no_grad():
+            torch.onnx.export(
+                auto_model,
+                tuple(dummy[name] for name in input_names),
+                str(staging / ONNX_FILES["onnx"]),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        transformer.tokenizer.save_pretrained(str(staging))
+        write_meta(staging, {
+            "max_seq_length": reference.max_seq_length,
+            "dimensions": reference.get_sentence_embedding_dimension(),
+            "pooling": pooling_mode,
+            "normalize": any(isinstance(m, Normalize) for m in reference),
+            "parity": {}
+        })
+        if directory.exists():
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def quantize_int8(directory: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    target = directory / ONNX_FILES["onnx-int8"]
+    staging = target.with_suffix(".tmp")
+    quantize_dynamic(str(directory / ONNX_FILES["onnx"]), str(staging), weight_type=QuantType.QInt8)
+    os.replace(staging, target)
+
+
+def parity_report(reference, candidate) -> Dict[str, float]:
+    """Cosine agreement between reference and candidate embeddings"""
+    kwargs = {"batch_size": len(PARITY_SENTENCES), "normalize_embeddings": True, "show_progress_bar": False}
+    expected = np.asarray(reference.encode(PARITY_SENTENCES, **kwargs), dtype=np.float32)
+    actual = np.asarray(candidate.encode(PARITY_SENTENCES, **kwargs), dtype=np.float32)
+    cosine = (expected * actual).sum(axis=1)
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+    }
+
+
+def read_meta(directory: Path) -> Dict[str, Any]:
+    path = directory / EXPORT_META
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(directory: Path, meta: Dict[str, Any]):
+    tmp = directory / (EXPORT_META + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, directory / EXPORT_META)
+
+
+def load_backend(backend: str, model_name: str, cache_dir: str, min_cosine: float = 0.99,
+                 threads: int = 0) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Load model_name on the requested backend; returns (model, info).
+
+    ONNX backends are exported (and quantized) into cache_dir on first use
+    and checked against the PyTorch model on PARITY_SENTENCES; the report
+    is stored with the export so later starts skip loading PyTorch. If
+    the minimum cosine similarity is below min_cosine the PyTorch model
+    is used instead.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {list(BACKENDS)}")
+    if backend == "torch":
+        return load_torch(model_name), {"backend": "torch", "requested_backend": backend, "parity": None}
+
+    directory = Path(cache_dir) / model_name.replace("/", "__")
+    meta = read_meta(directory)
+    reference = None
+    if backend not in meta.get("parity", {}) or not (directory / ONNX_FILES[backend]).exists():
+        reference = load_torch(model_name)
+        if not meta or not (directory / ONNX_FILES["onnx"]).exists():
+            logger.info(f"Exporting {model_name} to ONNX in {directory}")
+            export_onnx(reference, directory)
+        if backend == "onnx-int8" and not (directory / ONNX_FILES[backend]).exists():
+            logger.info(f"Quantizing {model_name} to dynamic INT8")
+            quantize_int8(directory)
+
+    candidate = OnnxEncoder(directory, ONNX_FILES[backend], threads)
+    if reference is not None:
+        meta = read_meta(directory)
+        meta.setdefault("parity", {})[backend] = parity_report(reference, candidate)
+        write_meta(directory, meta)
+    report = meta["parity"][backend]
+    logger.info(f"{backend} parity vs torch: min cosine {report['min_cosine']:.5f}, max abs diff {report['max_abs_diff']:.5f}")
+
+    if report["min_cosine"] < min_cosine:
+        logger.error(f"{backend} parity below {min_cosine}, falling back to torch")
+        model = reference if reference is not None else load_torch(model_name)
+        return model, {"backend": "torch", "requested_backend": backend, "parity": report}
+    return candidate, {"backend": backend, "requested_backend": backend, "parity": report}
@@ -0,0 +1,106 @@
+"""
+Micro-batch planning for model.encode
+"""
+from typing import List, Iterator, Tuple, Optional
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rough transient activation memory per padded token for a MiniLM-sized
+# encoder (hidden states, FFN intermediates and attention rows)
+BYTES_PER_TOKEN = 16 * 1024
+
+
+def token_lengths(model, texts: List[str]) -> np.ndarray:
+    """Token counts per text (after truncation to the model's max length)"""
+    max_length = getattr(model, "max_seq_length", 512)
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        # ~4 characters per token for English text, plus [CLS]/[SEP]
+        return np.minimum(np.fromiter((len(t) // 4 + 2 for t in texts), dtype=np.int64, count=len(texts)), max_length)
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=True,
+        truncation=True,
+        max_length=max_length,
+        return_attention_mask=False,
+        return_token_type_ids=False
+    )
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+
+def available_memory_bytes() -> Optional[int]:
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def token_budget(max_batch_tokens: int, memory_fraction: float = 0.25) -> int:
+    """
+    Padded tokens per micro-batch: the configured cap, lowered when free
+    memory can't hold that many tokens' activations
+    """
+    available = available_memory_bytes()
+    if available is None:
+        return max_batch_tokens
+    by_memory = int(available * memory_fraction / BYTES_PER_TOKEN)
+    return max(1, min(max_batch_tokens, by_memory))
+
+
+def length_order(lengths: np.ndarray) -> np.ndarray:
+    """Indices ordering texts longest-first; stable, so ties keep request order"""
+    return np.argsort(-lengths, kind="stable")
+
+
+def plan_batches(
+    lengths: np.ndarray, budget: int, max_batch_size: int, sort_by_length: bool = True
+) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """
+    (order, batches): texts order[start:end] form one micro-batch.
+
+    With sort_by_length, texts are ordered longest-first and cut into
+    buckets whenever the length drops to half of the bucket's longest
+    text, then micro-batched within each bucket, so a few long passages
+    don't pad many short queries (at most ~log2(max_seq_length) buckets).
+    """
+    if not sort_by_length:
+        return np.arange(len(lengths)), list(micro_batches(lengths, budget, max_batch_size))
+    order = length_order(lengths)
+    ordered = lengths[order]
+    batches = []
+    start = 0
+    while start < len(ordered):
+        end = start + int(np.searchsorted(-ordered[start:], -(ordered[start] // 2), side="left"))
+        end = max(end, start + 1)
+        batches.extend((start + s, start + e) for s, e in micro_batches(ordered[start:end], budget, max_batch_size))
+        start = end
+    return order, batches
+
+
+def padded_tokens(ordered_lengths: np.ndarray, batches: List[Tuple[int, int]]) -> int:
+    """Tokens actually fed to the model, padding included"""
+    return sum((end - start) * int(ordered_lengths[start:end].max()) for start, end in batches)
+
+
+def micro_batches(lengths: np.ndarray, budget: int, max_batch_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Split [0, len(lengths)) into consecutive [start, end) ranges whose
+    padded size (rows * longest row) stays within budget tokens
+    """
+    start = 0
+    n = len(lengths)
+    while start < n:
+        end = start
+        longest = 0
+        while end < n and end - start < max_batch_size:
+            candidate = max(longest, int(lengths[end]))
+            if end > start and candidate * (end - start + 1) > budget:
+                break
+            longest = candidate
+            end += 1
+        yield start, end
+        start = end
@@ -0,0 +1,198 @@
+"""
+Content-addressed embedding cache (in-memory LRU + optional disk arena)
+"""
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+
+
+def cache_key(model_name: str, normalize: bool, text: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=KEY_BYTES)
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x01" if normalize else b"\x00")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+
+class DiskArena:
+    """
+    Fixed-capacity ring of vectors in a memory-mapped file, with a
+    parallel memory-mapped array of the key stored in each slot. The
+    key -> slot index is rebuilt from the key array at startup. When full,
+    the oldest slot is overwritten.
+    """
+
+    def __init__(self, directory: str, dim: Optional[int], capacity: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.directory / "arena.json"
+        meta = {}
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        # dim=None opens whatever the arena was created with
+        dim = dim or meta.get("dim")
+        self.dim = dim
+        self.capacity = capacity
+        if meta.get("dim") != dim or meta.get("capacity") != capacity:
+            if meta:
+                logger.warning("Embedding cache arena layout changed, starting a new arena")
+            for name in ("vectors.f32", "keys.bin"):
+                path = self.directory / name
+                if path.exists():
+                    path.unlink()
+            meta = {"dim": dim, "capacity": capacity, "next_slot": 0}
+        self._meta_path = meta_path
+        self._next_slot = meta.get("next_slot", 0)
+
+        self._vectors = _open_memmap(self.directory / "vectors.f32", np.float32, (capacity, dim))
+        self._keys = _open_memmap(self.directory / "keys.bin", np.uint8, (capacity, KEY_BYTES))
+        self._index: Dict[bytes, int] = {}
+        empty = bytes(KEY_BYTES)
+        for slot in np.flatnonzero(self._keys.any(axis=1)):
+            key = self._keys[slot].tobytes()
+            if key != empty:
+                self._index[key] = int(slot)
+        self._write_meta()
+        logger.info(f"Embedding cache arena opened with {len(self._index)} entries")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        return np.array(self._vectors[slot])
+
+    def put(self, key: bytes, vector: np.ndarray):
+        if key in self._index:
+            return
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.capacity
+        old_key = self._keys[slot].tobytes()
+        self._index.pop(old_key, None)
+        # Clear the key before writing the vector so a crash mid-write can
+        # never pair a key with the wrong vector
+        self._keys[slot] = 0
+        self._vectors[slot] = vector
+        self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+        self._index[key] = slot
+
+    def flush(self):
+        self._vectors.flush()
+        self._keys.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp = self._meta_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity, "next_slot": self._next_slot}, f)
+        os.replace(tmp, self._meta_path)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache keyed by cache_key(model, normalize, text): a bounded
+    in-memory LRU (shared by all models) in front of optional DiskArenas,
+    one per model id since models differ in dimensions. Disk hits are
+    promoted to memory; puts write through to both tiers.
+    """
+
+    def __init__(self, max_entries: int = 100_000,
+                 disk_dir: Optional[str] = None, disk_max_entries: int = 1_000_000):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._arenas: Dict[str, DiskArena] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _arena(self, model_id: str, dim: Optional[int] = None) -> Optional[DiskArena]:
+        """Open the model's arena; without dim only if it already exists"""
+        if not self.disk_dir:
+            return None
+        arena = self._arenas.get(model_id)
+        if arena is None:
+            directory = Path(self.disk_dir) / re.sub(r"[^A-Za-z0-9._-]", "_", model_id)
+            if dim is None and not (directory / "arena.json").exists():
+                return None
+            arena = self._arenas[model_id] = DiskArena(str(directory), dim, self.disk_max_entries)
+        return arena
+
+    def get_many(self, model_id: str, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            disk = self._arena(model_id)
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                elif disk is not None and (vector := disk.get(key)) is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                else:
+                    self.misses += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, model_id: str, keys: List[bytes], vectors: np.ndarray):
+        if len(keys) == 0:
+            return
+        with self._lock:
+            disk = self._arena(model_id, dim=vectors.shape[1])
+            if disk is not None and disk.dim != vectors.shape[1]:
+                # The model behind this id changed shape: start its arena over
+                self._arenas.pop(model_id)
+                disk = self._arena(model_id, dim=vectors.shape[1])
+            for key, vector in zip(keys, vectors):
+                vector = np.array(vector, dtype=np.float32)
+                self._remember(key, vector)
+                if disk is not None:
+                    disk.put(key, vector)
+
+    def flush(self):
+        with self._lock:
+            for arena in self._arenas.values():
+                arena.flush()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.max_entries,
+            "disk_entries": sum(len(arena) for arena in self._arenas.values()),
+            "disk_enabled": bool(self.disk_dir),
+        }
+
+
+def _open_memmap(path: Path, dtype, shape) -> np.memmap:
+    mode = "r+" if path.exists() else "w+"
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
@@ -0,0 +1,208 @@
+"""
+Registry of resident embedding models with LRU unloading
+"""
+from typing import Callable, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModel(ValueError):
+    """Raised for model names that are not allowed on this service"""
+
+
+class DimensionMismatch(ValueError):
+    """Raised when a default swap would change the embedding dimensions"""
+
+
+class ResidentModel:
+    __slots__ = ("name", "model", "info", "dimensions", "memory_bytes", "loaded_at", "load_seconds")
+
+    def __init__(self, name: str, model, info: Dict[str, Any], load_seconds: float):
+        self.name = name
+        self.model = model
+        self.info = info
+        self.dimensions = model_dimensions(model)
+        self.memory_bytes = model_memory_bytes(model)
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+
+
+def model_dimensions(model) -> int:
+    dimensions = model.get_sentence_embedding_dimension() if hasattr(model, "get_sentence_embedding_dimension") else None
+    if not dimensions:
+        dimensions = np.asarray(model.encode(["dimension probe"], show_progress_bar=False)).shape[1]
+    return int(dimensions)
+
+
+def model_memory_bytes(model) -> int:
+    """Parameter bytes for torch models, model file size for ONNX"""
+    parameters = getattr(model, "parameters", None)
+    if callable(parameters):
+        return sum(p.numel() * p.element_size() for p in parameters())
+    return int(getattr(model, "memory_bytes", 0))
+
+
+class ModelRegistry:
+    """
+    Models keyed by name, loaded on first use by load_fn(name) -> (model,
+    info) and kept resident until their parameter memory pushes the total
+    past memory_budget_bytes (0 = unlimited); then the least recently used
+    ones are unloaded. The default model and the model just loaded are
+    never unloaded.
+
+    Loads run on a dedicated loader thread, so a new model can be brought
+    up while the inference thread keeps serving the resident ones, and
+    concurrent requests for the same model share one load. Switching the
+    default is a single assignment after the load completes; requests
+    already holding a model keep their reference until they finish.
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], Tuple[Any, Dict[str, Any]]],
+        default_model: str,
+        memory_budget_bytes: int = 0,
+        allowed_models: Optional[set] = None,
+    ):
+        self.load_fn = load_fn
+        self.default_model = default_model
+        self.memory_budget_bytes = memory_budget_bytes
+        self.allowed_models = set(allowed_models or ()) | {default_model}
+        self._resident: "OrderedDict[str, ResidentModel]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self.loads = 0
+        self.unloads = 0
+        self.swap_error: Optional[str] = None
+
+    def resolve(self, name: Optional[str]) -> str:
+        name = name or self.default_model
+        if name not in self.allowed_models:
+            raise UnknownModel(f"Model '{name}' is not available, expected one of {sorted(self.allowed_models)}")
+        return name
+
+    def resident(self, name: str) -> Optional[ResidentModel]:
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None:
+                self._resident.move_to_end(name)
+            return entry
+
+    def get(self, name: str) -> ResidentModel:
+        """Resident model by name, loading it on the calling thread if needed"""
+        entry = self.resident(name)
+        return entry if entry is not None else self.load(name)
+
+    def load(self, name: str) -> ResidentModel:
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None:
+                return entry
+            future = self._loading.get(name)
+            owner = future is None
+            if owner:
+                future = self._loading[name] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            started = time.monotonic()
+            model, info = self.load_fn(name)
+            entry = ResidentModel(name, model, info, time.monotonic() - started)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._resident[name] = entry
+            del self._loading[name]
+            self.loads += 1
+            self._evict(keep=name)
+        future.set_result(entry)
+        logger.info(f"Model {name} resident ({entry.dimensions} dims, {entry.memory_bytes / 1e6:.0f} MB)")
+        return entry
+
+    async def ensure_loaded(self, name: str) -> ResidentModel:
+        entry = self.resident(name)
+        if entry is not None:
+            return entry
+        return await asyncio.get_running_loop().run_in_executor(self._loader, self.load, name)
+
+    def check_dimensions(self, current: ResidentModel, entry: ResidentModel, allow_dimension_change: bool):
+        """
+        Vectors already indexed were embedded by the current default, so a
+        default with other dimensions would break every add and search
+        against them. Refused unless the caller is re-indexing.
+        """
+        if entry.dimensions != current.dimensions and not allow_dimension_change:
+            raise DimensionMismatch(
+                f"Model '{entry.name}' has {entry.dimensions} dimensions but the default '{current.name}' "
+                f"has {current.dimensions}; re-index and set allow_dimension_change to switch"
+            )
+
+    async def swap_default(self, name: str, allow_dimension_change: bool = False) -> ResidentModel:
+        """Load name in the background, then make it the default if its dimensions match"""
+        current = await self.ensure_loaded(self.default_model)
+        entry = await self.ensure_loaded(name)
+        try:
+            self.check_dimensions(current, entry, allow_dimension_change)
+        except DimensionMismatch as e:
+            self.swap_error = str(e)
+            raise
+        previous, self.default_model = self.default_model, name
+        self.swap_error = None
+        logger.info(f"Default embedding model switched from {previous} to {name}")
+        return entry
+
+    def _evict(self, keep: str):
+        if not self.memory_budget_bytes:
+            return
+        total = sum(e.memory_bytes for e in self._resident.values())
+        for name in list(self._resident):
+            if total <= self.memory_budget_bytes:
+                break
+            if name in (keep, self.default_model):
+                continue
+            entry = self._resident.pop(name)
+            total -= entry.memory_bytes
+            self.unloads += 1
+            logger.info(f"Unloaded model {name} to stay within the memory budget")
+
+    def shutdown(self):
+        self._loader.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = [
+                {
+                    "model": e.name,
+                    "backend": e.info.get("backend"),
+                    "dimensions": e.dimensions,
+                    "memory_bytes": e.memory_bytes,
+                    "load_seconds": e.load_seconds,
+                    "loaded_at": e.loaded_at,
+                }
+                for e in self._resident.values()
+            ]
+            loading = list(self._loading)
+        return {
+            "default_model": self.default_model,
+            "allowed_models": sorted(self.allowed_models),
+            "resident": resident,
+            "loading": loading,
+            "memory_bytes": sum(r["memory_bytes"] for r in resident),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "swap_error": self.swap_error,
+        }
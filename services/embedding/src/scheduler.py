@@ -0,0 +1,185 @@
+"""
+Cross-request dynamic batching for the embedding model
+"""
+from typing import List, Callable, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import math
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when admitting a request would exceed the inference queue limit"""
+
+    def __init__(self, queued_texts: int, retry_after: int):
+        super().__init__(f"Inference queue is full ({queued_texts} texts waiting)")
+        self.queued_texts = queued_texts
+        self.retry_after = retry_after
+
+
+class _Pending:
+    __slots__ = ("texts", "normalize", "model", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str], normalize: bool, model: str, future: asyncio.Future):
+        self.texts = texts
+        self.normalize = normalize
+        self.model = model
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class DynamicBatcher:
+    """
+    Coalesces concurrent /embed requests into shared encode calls.
+
+    The first queued request opens a batch window; the batch is closed
+    after max_wait_ms or once max_batch_texts texts have joined, then
+    encoded on a single worker thread (one encode at a time, never on the
+    event loop) and the rows are handed back to each request. Requests
+    are grouped by model and normalize flag since encode takes one of each.
+
+    Other inference work (model loading, streamed micro-batches) goes
+    through run() so it shares the same thread. Admission is bounded by
+    max_queue_texts (0 = unbounded): past it, reserve() raises QueueFull
+    with a retry hint derived from recent encode throughput. A request is
+    always admitted when nothing is queued, however large.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str], bool, str], np.ndarray],
+        max_batch_texts: int = 64,
+        max_wait_ms: float = 5.0,
+        max_queue_texts: int = 0,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_texts = max_batch_texts
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_texts = max_queue_texts
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+
+        self.queued_texts = 0
+        self.rejected_requests = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.batched_texts = 0
+        self.total_wait = 0.0
+        self.total_encode = 0.0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained"""
+        if self.total_encode <= 0 or self.batched_texts == 0:
+            return 1
+        texts_per_second = self.batched_texts / self.total_encode
+        return max(1, math.ceil(self.queued_texts / texts_per_second))
+
+    def reserve(self, n_texts: int):
+        """Count n_texts against the queue limit or raise QueueFull"""
+        if self.max_queue_texts and self.queued_texts and self.queued_texts + n_texts > self.max_queue_texts:
+            self.rejected_requests += 1
+            raise QueueFull(self.queued_texts, self.retry_after())
+        self.queued_texts += n_texts
+
+    def release(self, n_texts: int):
+        self.queued_texts -= n_texts
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) on the inference thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def submit(self, texts: List[str], normalize: bool, model: str) -> np.ndarray:
+        if self._queue is None:
+            self.start()
+        self.reserve(len(texts))
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Pending(texts, normalize, model, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            batch_texts = len(first.texts)
+            deadline = time.monotonic() + self.max_wait
+            while batch_texts < self.max_batch_texts:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                batch_texts += len(item.texts)
+            # Texts stay counted against the queue limit until encoded
+            try:
+                groups: Dict[Tuple[str, bool], List[_Pending]] = {}
+                for pending in batch:
+                    if not pending.future.cancelled():
+                        groups.setdefault((pending.model, pending.normalize), []).append(pending)
+                for (model, normalize), group in groups.items():
+                    await self._encode_group(group, normalize, model)
+            finally:
+                self.release(batch_texts)
+
+    async def _encode_group(self, group: List[_Pending], normalize: bool, model: str):
+        texts = [text for pending in group for text in pending.texts]
+        started = time.monotonic()
+        try:
+            embeddings = await self.run(self.encode_fn, texts, normalize, model)
+        except Exception as e:
+            for pending in group:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        finished = time.monotonic()
+
+        self.batches += 1
+        self.batched_requests += len(group)
+        self.batched_texts += len(texts)
+        self.total_encode += finished - started
+        offset = 0
+        for pending in group:
+            self.total_wait += started - pending.enqueued_at
+            rows = embeddings[offset:offset + len(pending.texts)]
+            offset += len(pending.texts)
+            if not pending.future.done():
+                pending.future.set_result(rows)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth_requests": self._queue.qsize() if self._queue is not None else 0,
+            "queue_depth_texts": self.queued_texts,
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "batched_texts": self.batched_texts,
+            "avg_requests_per_batch": self.batched_requests / self.batches if self.batches else 0.0,
+            "avg_texts_per_batch": self.batched_texts / self.batches if self.batches else 0.0,
+            "avg_queue_wait_ms": 1000 * self.total_wait / self.batched_requests if self.batched_requests else 0.0,
+            "avg_encode_ms": 1000 * self.total_encode / self.batches if self.batches else 0.0,
+            "max_batch_texts": self.max_batch_texts,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue_texts": self.max_queue_texts,
+            "rejected_requests": self.rejected_requests,
+        }
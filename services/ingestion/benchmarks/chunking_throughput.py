@@ -0,0 +1,108 @@
+"""
+Benchmark: PassageChunker throughput on large documents, fixed
+1024-character windows against token-budgeted, sentence-aligned passages.
+
+Besides chunking speed it reports how much text each mode loses to
+truncation at embed time: passages longer than the model's
+max_seq_length are cut by the embedding model, so those tokens are
+paid for in extraction and chunking but never embedded.
+
+    python benchmarks/chunking_throughput.py
+    python benchmarks/chunking_throughput.py --tokenizer /models/tokenizer.json
+    python benchmarks/chunking_throughput.py --corpus docs/ --max-tokens 256
+"""
+from typing import List
+from pathlib import Path
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from chunker import PassageChunker, load_tokenizer
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or an at which not have has "
+    "revenue contract invoice policy customer report quarterly migration network storage identity "
+    "approval deadline budget forecast incident outage release deployment compliance audit vendor "
+    "employee onboarding benefits security password account settings schedule meeting agenda summary"
+).split()
+
+
+def synthetic_document(rng: random.Random, chars: int) -> str:
+    """Paragraphs of 1-8 sentences of 6-40 words"""
+    paragraphs = []
+    total = 0
+    while total < chars:
+        sentences = [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 40))).capitalize() + rng.choice(".....?!")
+            for _ in range(rng.randint(1, 8))
+        ]
+        paragraphs.append(" ".join(sentences))
+        total += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+
+def load_documents(corpus: str, count: int, chars: int, seed: int) -> List[str]:
+    if corpus:
+        return [p.read_text(encoding="utf-8", errors="ignore") for p in sorted(Path(corpus).glob("**/*.txt"))]
+    rng = random.Random(seed)
+    return [synthetic_document(rng, chars) for _ in range(count)]
+
+
+def run(chunker: PassageChunker, documents: List[str], feed_chars: int):
+    passages = []
+    started = time.perf_counter()
+    for document in documents:
+        if feed_chars:
+            stream = chunker.stream({"format": "txt"})
+            for start in range(0, len(document), feed_chars):
+                passages.extend(stream.feed(document[start:start + feed_chars]))
+            passages.extend(stream.close(log=False))
+        else:
+            passages.extend(chunker.chunk(document, {"format": "txt"}))
+    return passages, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="", help="directory of .txt documents (default: synthetic)")
+    parser.add_argument("--documents", type=int, default=20, help="synthetic documents to generate")
+    parser.add_argument("--chars", type=int, default=500_000, help="characters per synthetic document")
+    parser.add_argument("--tokenizer", default=os.getenv("CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--max-tokens", type=int, default=256, help="embedding model max_seq_length")
+    parser.add_argument("--overlap-tokens", type=int, default=32)
+    parser.add_argument("--feed-chars", type=int, default=64 * 1024, help="block size for the streaming runs")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    documents = load_documents(args.corpus, args.documents, args.chars, args.seed)
+    total_chars = sum(len(d) for d in documents)
+    print(f"{len(documents)} documents, {total_chars / 1e6:.1f}M chars")
+
+    tokenizer = load_tokenizer(args.tokenizer)
+    special = len(tokenizer.encode("").ids)
+    modes = [
+        ("chars 1024/50", PassageChunker(chunk_size=1024, overlap=50), 0),
+        (f"tokens {args.max_tokens}/{args.overlap_tokens}",
+         PassageChunker(chunk_size=args.max_tokens, overlap=args.overlap_tokens, tokenizer=tokenizer), 0),
+        (f"tokens, streamed",
+         PassageChunker(chunk_size=args.max_tokens, overlap=args.overlap_tokens, tokenizer=tokenizer), args.feed_chars),
+    ]
+    for label, chunker, feed_chars in modes:
+        passages, seconds = run(chunker, documents, feed_chars)
+        lengths = [len(e.ids) + special for e in tokenizer.encode_batch([p["text"] for p in passages], add_special_tokens=False)]
+        truncated = sum(1 for n in lengths if n > args.max_tokens)
+        lost = sum(max(0, n - args.max_tokens) for n in lengths)
+        print(f"{label:>18}: {seconds:.2f}s, {total_chars / seconds / 1e6:.2f}M chars/sec, {len(passages)} passages, "
+              f"{sum(lengths) / len(passages):.0f} tokens avg, {truncated / len(passages):.1%} truncated "
+              f"({lost / sum(lengths):.1%} of tokens never embedded)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark: PDF text extraction, serial PDFExtractor.extract against
+page-range shards run on the ExtractionPool.
+
+Both paths must produce identical text and metadata["pages"]; the
+benchmark checks that before reporting times.
+
+    python benchmarks/pdf_sharding.py                        # synthetic 600-page PDF
+    python benchmarks/pdf_sharding.py --pdf report.pdf
+    python benchmarks/pdf_sharding.py --workers 8 --shard-pages 16
+"""
+from typing import List
+from pathlib import Path
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from extractors import PDFExtractor
+from workers import ExtractionPool
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or an at which not have has "
+    "revenue contract invoice policy customer report quarterly migration network storage identity "
+    "approval deadline budget forecast incident outage release deployment compliance audit vendor"
+).split()
+
+
+def synthetic_pdf(pages: int, lines_per_page: int, seed: int) -> bytes:
+    """Minimal text-only PDF (Helvetica, one content stream per page)"""
+    rng = random.Random(seed)
+    objects: List[bytes] = []
+    page_ids = []
+    font_id = 3
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for number in range(1, pages + 1):
+        lines = [f"Page {number}"] + [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))) for _ in range(lines_per_page)
+        ]
+        body = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects) + 2
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (font_id, content_id)
+        )
+        page_ids.append(len(objects) + 2)
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)] + objects
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+async def run_sharded(content: bytes, workers: int, shard_pages: int, repeats: int):
+    pool = ExtractionPool(max_workers=workers, job_timeout=3600, memory_limit_mb=0)
+    try:
+        # Start the workers (spawn + imports) outside the timed runs
+        await asyncio.gather(*(pool.run("pdf_page_count", content) for _ in range(workers)))
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = await pool.extract_pdf(content, shard_pages)
+            timings.append(time.perf_counter() - started)
+        return result, min(timings)
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default="", help="PDF to extract (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=600, help="synthetic page count")
+    parser.add_argument("--lines-per-page", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard-pages", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    content = Path(args.pdf).read_bytes() if args.pdf else synthetic_pdf(args.pages, args.lines_per_page, args.seed)
+    extractor = PDFExtractor()
+    pages = extractor.page_count(content)
+    print(f"{pages} pages, {len(content) / 1e6:.1f} MB")
+
+    timings = []
+    for _ in range(args.repeats):
+        started = time.perf_counter()
+        serial = extractor.extract(content)
+        timings.append(time.perf_counter() - started)
+    serial_seconds = min(timings)
+    print(f"{'serial':>8}: {serial_seconds:.2f}s, {pages / serial_seconds:,.1f} pages/sec")
+
+    sharded, sharded_seconds = asyncio.run(run_sharded(content, args.workers, args.shard_pages, args.repeats))
+    shards = -(-pages // args.shard_pages) if pages > args.shard_pages else 1
+    print(f"{'sharded':>8}: {sharded_seconds:.2f}s, {pages / sharded_seconds:,.1f} pages/sec "
+          f"({shards} shards of {args.shard_pages} pages on {args.workers} workers)")
+
+    if sharded != serial:
+        sys.exit("sharded output differs from serial extraction")
+    print(f"identical output, speedup {serial_seconds / sharded_seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
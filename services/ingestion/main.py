@@ -2,29 +2,27 @@
 Document Ingestion Service
 Extracts text and metadata from various document formats (Robust Version)
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from starlette.background import BackgroundTask
+from typing import List, Optional, Dict, Any, AsyncIterator
 import logging
+import json
 import sys
-import io
 import os
-import requests
-import base64
-import json
+import asyncio
+import shutil
+import tempfile
 from pathlib import Path
 
-# --- IMPORTS ---
-import camelot
-import pandas as pd
-import pytesseract
-from PIL import Image
-
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
-from extractors import PDFExtractor, DOCXExtractor, PPTXExtractor, CSVExtractor
-from chunker import PassageChunker
+from chunker import PassageChunker, load_tokenizer
+from dedup import Deduplicator, DedupSession
+from groq_client import GroqClient
+from workers import ExtractionPool, ExtractionTimeout
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +30,39 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Document Ingestion Service", version="1.7.0")
 
+# Shared Groq client: pooled keep-alive connections, timeouts, bounded
+# concurrency and retry with backoff (GROQ_API_BASE can point at a stub)
+groq = GroqClient(
+    api_key=os.getenv("GROQ_API_KEY"),
+    base_url=os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1"),
+    max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "8")),
+    max_retries=int(os.getenv("GROQ_MAX_RETRIES", "3")),
+    connect_timeout=float(os.getenv("GROQ_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("GROQ_READ_TIMEOUT", "60")),
+)
+
+# Parsing, OCR and table extraction run in worker processes: each worker
+# is recycled after EXTRACT_MAX_TASKS_PER_CHILD jobs and capped at
+# EXTRACT_MEMORY_LIMIT_MB (0 = no cap); jobs past
+# EXTRACT_JOB_TIMEOUT_SECONDS are killed
+extraction_pool = ExtractionPool(
+    max_workers=int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_tasks_per_child=int(os.getenv("EXTRACT_MAX_TASKS_PER_CHILD", "50")),
+    job_timeout=float(os.getenv("EXTRACT_JOB_TIMEOUT_SECONDS", "300")),
+    memory_limit_mb=int(os.getenv("EXTRACT_MEMORY_LIMIT_MB", "4096")),
+)
+# PDFs longer than this many pages are extracted as parallel page ranges
+# (0 = always one job)
+PDF_SHARD_PAGES = int(os.getenv("EXTRACT_PDF_SHARD_PAGES", "32"))
+
+# Uploads are copied to a temp file in EXTRACT_SPOOL_DIR chunk by chunk
+# and extractors read from that path, so a request never holds the whole
+# file in memory (default: the system temp dir)
+SPOOL_DIR = os.getenv("EXTRACT_SPOOL_DIR") or None
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 # --- ROBUST EXTRACTOR CLASSES ---
 
 class ImageExtractor:
@@ -39,13 +70,12 @@ class ImageExtractor:
     Uses Tesseract to read text, then Llama 3.3 (Text) to clean/format it.
     This avoids Vision API dependency issues.
     """
-    def extract(self, content: bytes, filename: str) -> tuple[str, dict]:
+    async def extract(self, path: Path, filename: str) -> tuple[str, dict]:
         text_output = ""
         
         # 1. Run Tesseract OCR (Reliable text extraction)
         try:
-            image = Image.open(io.BytesIO(content))
-            raw_ocr_text = pytesseract.image_to_string(image)
+            raw_ocr_text = await extraction_pool.run("ocr", str(path))
             logger.info(f"Raw OCR Output length: {len(raw_ocr_text)}")
         except Exception as e:
             logger.error(f"OCR Failed: {e}")
@@ -55,7 +85,7 @@ class ImageExtractor:
             return "[No text found in image]", {"format": "image"}
 
         # 2. Use Llama 3.3 to Structure the Data
-        cleaned_text = self.clean_ocr_with_llm(raw_ocr_text)
+        cleaned_text = await self.clean_ocr_with_llm(raw_ocr_text)
         
         if cleaned_text:
             text_output = f"--- SMART OCR ANALYSIS ---\n{cleaned_text}\n\n--- RAW SCAN ---\n{raw_ocr_text}"
@@ -69,19 +99,12 @@ class ImageExtractor:
         }
         return text_output, metadata
 
-    def clean_ocr_with_llm(self, messy_text: str) -> str:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key: 
+    async def clean_ocr_with_llm(self, messy_text: str) -> str:
+        if not groq.configured: 
             logger.warning("GROQ_API_KEY missing, skipping cleanup")
             return ""
 
         try:
-            url = "https://api.groq.com/openai/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
             # Using the stable Text model
             payload = {
                 "model": "llama-3.3-70b-versatile", 
@@ -99,68 +122,68 @@ class ImageExtractor:
                 "max_tokens": 1000
             }
 
-            response = requests.post(url, headers=headers, json=payload)
-            if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
-            else:
-                logger.error(f"LLM Cleanup Error: {response.text}")
-                return ""
+            response = await groq.chat(payload)
+            return response['choices'][0]['message']['content']
         except Exception as e:
             logger.error(f"LLM Cleanup Failed: {e}")
             return ""
 
 class AudioExtractor:
-    def extract(self, content: bytes, filename: str) -> tuple[str, dict]:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key: raise Exception("GROQ_API_KEY not found in environment")
+    async def extract(self, path: Path, filename: str) -> tuple[str, dict]:
+        if not groq.configured: raise Exception("GROQ_API_KEY not found in environment")
         
         try:
-            url = "https://api.groq.com/openai/v1/audio/transcriptions"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            # Filename is required for Groq to know file type
-            files = {"file": (filename, content)} 
-            data = {"model": "whisper-large-v3"}
-            
             logger.info(f"Sending audio {filename} to Whisper...")
-            response = requests.post(url, headers=headers, files=files, data=data)
+            response = await groq.transcribe(filename, path, model="whisper-large-v3")
             
-            if response.status_code != 200:
-                raise Exception(f"Groq API Error: {response.status_code} - {response.text}")
-            
-            return response.json().get("text", ""), {"format": "audio", "model": "whisper"}
+            return response.get("text", ""), {"format": "audio", "model": "whisper"}
         except Exception as e:
             raise Exception(f"Transcription failed: {str(e)}")
 
-class PDFTableExtractor:
-    def extract_tables_to_text(self, pdf_bytes: bytes) -> str:
-        try:
-            temp_path = Path("/tmp") / f"temp_{os.getpid()}.pdf"
-            with open(temp_path, "wb") as f: f.write(pdf_bytes)
-            tables = camelot.read_pdf(str(temp_path), flavor='lattice', pages='all')
-            structured_text = []
-            if tables.n > 0:
-                for i, table in enumerate(tables):
-                    df: pd.DataFrame = table.df
-                    table_markdown = df.to_markdown(index=False)
-                    structured_text.append(f"\n--- TABLE {i+1} START ---\n{table_markdown}\n--- TABLE {i+1} END ---\n")
-                return "\n".join(structured_text)
-            return ""
-        except Exception as e:
-            logger.error(f"Camelot Table Extraction Failed: {e}")
-            return ""
-        finally:
-            if temp_path.exists(): os.remove(temp_path)
-
 # Initialize extractors
-pdf_extractor = PDFExtractor()
-docx_extractor = DOCXExtractor()
-pptx_extractor = PPTXExtractor()
-csv_extractor = CSVExtractor()
 image_extractor = ImageExtractor()
 audio_extractor = AudioExtractor() 
-table_extractor = PDFTableExtractor()
 
-chunker = PassageChunker(chunk_size=1024, overlap=50)
+# CHUNK_MODE=chars: fixed 1024-char windows. CHUNK_MODE=tokens: passages of
+# at most CHUNK_MAX_TOKENS embedding-model tokens (the model's
+# max_seq_length, so nothing is truncated at embed time) cut at sentence
+# and paragraph boundaries, using CHUNK_TOKENIZER (model id or
+# tokenizer.json path)
+CHUNK_MODE = os.getenv("CHUNK_MODE", "chars")
+
+def build_chunker() -> PassageChunker:
+    if CHUNK_MODE == "tokens":
+        name = os.getenv("CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2")
+        try:
+            return PassageChunker(
+                chunk_size=int(os.getenv("CHUNK_MAX_TOKENS", "256")),
+                overlap=int(os.getenv("CHUNK_OVERLAP_TOKENS", "32")),
+                tokenizer=load_tokenizer(name)
+            )
+        except Exception as e:
+            logger.error(f"Could not load tokenizer {name} ({e}), falling back to character chunking")
+    return PassageChunker(chunk_size=1024, overlap=50)
+
+chunker = build_chunker()
+
+# Near-duplicate passages of a user_id's earlier uploads (SimHash within
+# DEDUP_MAX_DISTANCE of 64 bits) are linked to the original with
+# metadata["duplicate_of"] (DEDUP_MODE=link, the orchestrator skips
+# embedding them), dropped (skip) or left alone (off). Fingerprints are
+# kept per user_id and staged per document until the caller confirms it
+# was indexed (POST /dedup/commit) or gave up (/dedup/abort, or
+# DEDUP_PENDING_TTL_SECONDS); commits are appended to DEDUP_STATE_DIR if set
+DEDUP_MODE = os.getenv("DEDUP_MODE", "link")
+
+deduplicator = None
+if DEDUP_MODE != "off":
+    deduplicator = Deduplicator(
+        mode=DEDUP_MODE,
+        max_distance=int(os.getenv("DEDUP_MAX_DISTANCE", "3")),
+        min_features=int(os.getenv("DEDUP_MIN_SHINGLES", "8")),
+        state_dir=os.getenv("DEDUP_STATE_DIR") or None,
+        pending_ttl=float(os.getenv("DEDUP_PENDING_TTL_SECONDS", "3600"))
+    )
 
 class Passage(BaseModel):
     passage_id: int
@@ -175,49 +198,278 @@ class ExtractionResponse(BaseModel):
     content_type: str
     total_chars: int
     passages: List[Passage]
+    dedup: Optional[Dict[str, Any]] = None
+
+class DedupDocument(BaseModel):
+    user_id: str
+    document_id: str
+
+@app.on_event("shutdown")
+async def shutdown():
+    await groq.close()
+    extraction_pool.shutdown()
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "ingestion"}
 
-@app.post("/extract", response_model=ExtractionResponse)
-async def extract_document(file: UploadFile = File(...)):
+@app.get("/metrics")
+async def metrics():
+    """Groq request counters, extraction pool queue depth and dedup savings"""
+    return {
+        "groq": groq.stats(),
+        "extraction": extraction_pool.metrics(),
+        "dedup": deduplicator.stats() if deduplicator is not None else None
+    }
+
+@app.post("/dedup/commit")
+async def commit_dedup(request: DedupDocument):
+    """
+    Confirm that a document's passages were embedded and indexed: its
+    staged fingerprints become visible to later uploads of the same user
+    """
+    if deduplicator is None:
+        return {"status": "disabled"}
+    session = deduplicator.claim(request.user_id, request.document_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"No pending dedup state for document {request.document_id}")
+    persisted = True
+    try:
+        await asyncio.to_thread(deduplicator.persist, session)
+    except OSError as e:
+        # The document is indexed either way: keep its fingerprints for this run
+        persisted = False
+        logger.error(f"Could not persist dedup state for document {request.document_id}: {str(e)}")
+    return {"status": "committed", "fingerprints": deduplicator.install(session), "persisted": persisted}
+
+@app.post("/dedup/abort")
+async def abort_dedup(request: DedupDocument):
+    """Discard the staged fingerprints of a document that was not (fully) indexed"""
+    if deduplicator is None:
+        return {"status": "disabled"}
+    if not deduplicator.abort(request.user_id, request.document_id):
+        raise HTTPException(status_code=404, detail=f"No pending dedup state for document {request.document_id}")
+    return {"status": "aborted"}
+
+def _spool(source, suffix: str) -> Path:
+    fd, name = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(source, out, SPOOL_CHUNK_BYTES)
+    return Path(name)
+
+async def spool_upload(file: UploadFile) -> Path:
+    """Copy the upload to a temp file off the event loop; caller deletes it"""
+    await file.seek(0)
+    return await asyncio.to_thread(_spool, file.file, Path(file.filename or "").suffix)
+
+def document_kind(file: UploadFile) -> str:
+    filename, content_type = file.filename or "", file.content_type or ""
+    if content_type == "application/pdf" or filename.endswith(".pdf"):
+        return "pdf"
+    if filename.endswith((".docx", ".doc")):
+        return "docx"
+    if filename.endswith(".pptx"):
+        return "pptx"
+    if filename.endswith(".csv"):
+        return "csv"
+    if content_type.startswith("image/") or filename.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+        return "image"
+    if content_type.startswith("audio/") or filename.lower().endswith((".mp3", ".wav", ".m4a", ".ogg")):
+        return "audio"
+    if content_type == "text/plain" or filename.endswith(".txt"):
+        return "txt"
+    raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+
+async def extract_text(path: Path, filename: str, kind: str) -> tuple[str, dict]:
+    source = str(path)
+    if kind == "pdf":
+        (base_text, metadata), table_text = await asyncio.gather(
+            extraction_pool.extract_pdf(source, PDF_SHARD_PAGES),
+            extraction_pool.run("tables", source)
+        )
+        text = f"{base_text}\n\n{table_text}"
+        metadata["has_tables"] = bool(table_text)
+    elif kind in ("docx", "pptx", "csv"):
+        text, metadata = await extraction_pool.run(kind, source)
+    elif kind == "image":
+        text, metadata = await image_extractor.extract(path, filename)
+    elif kind == "audio":
+        text, metadata = await audio_extractor.extract(path, filename)
+    else:
+        text = await asyncio.to_thread(path.read_text, encoding="utf-8")
+        metadata = {"format": "txt"}
+    return text, metadata
+
+def extraction_error(e: Exception, filename: str) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ExtractionTimeout):
+        logger.error(f"Error: {str(e)}")
+        return HTTPException(status_code=504, detail=f"Extraction failed: {str(e)}")
+    if isinstance(e, MemoryError):
+        logger.error(f"Error: extraction of {filename} exceeded the worker memory limit")
+        return HTTPException(status_code=413, detail="Extraction failed: document exceeds the worker memory limit")
+    logger.error(f"Error: {str(e)}")
+    import traceback
+    traceback.print_exc()
+    return HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
+
+async def dedup_session(user_id: Optional[str], document_id: Optional[str], filename: str) -> Optional[DedupSession]:
+    """Dedup is per tenant, so only for uploads that name their user_id"""
+    if deduplicator is None or not user_id:
+        return None
+    if not deduplicator.loaded(user_id):
+        # The tenant's fingerprint log can be large: read it off the event loop
+        deduplicator.adopt(user_id, await asyncio.to_thread(deduplicator.load, user_id))
+    return deduplicator.session(user_id, document_id, filename)
+
+def ndjson_line(payload: Dict[str, Any]) -> bytes:
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
+async def stream_passages(path: Path, filename: str, content_type: str, kind: str,
+                          session: Optional[DedupSession] = None) -> AsyncIterator[bytes]:
+    """
+    One JSON line per passage as soon as it is chunked, then a summary
+    line. PDF pages are chunked as each page range comes back from the
+    workers and plain text as it is read, so only the current range (or
+    read block) is held in memory; other formats are extracted whole
+    first. Passages match the non-streaming response.
+    """
+    keep = session.filter if session is not None else (lambda passages: passages)
+    chunked = 0
+    emitted = 0
     try:
-        content = await file.read()
-        text = ""
-        metadata = {}
-
-        if file.content_type == "application/pdf" or file.filename.endswith(".pdf"):
-            base_text, metadata = pdf_extractor.extract(content)
-            table_text = table_extractor.extract_tables_to_text(content)
-            text = f"{base_text}\n\n{table_text}"
-            metadata["has_tables"] = bool(table_text)
-        elif file.filename.endswith((".docx", ".doc")):
-            text, metadata = docx_extractor.extract(content)
-        elif file.filename.endswith(".csv"):
-            text, metadata = csv_extractor.extract(content)
-        elif file.content_type.startswith("image/") or file.filename.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
-            text, metadata = image_extractor.extract(content, file.filename)
-        elif file.content_type.startswith("audio/") or file.filename.lower().endswith((".mp3", ".wav", ".m4a", ".ogg")):
-            text, metadata = audio_extractor.extract(content, file.filename)
-        elif file.content_type == "text/plain" or file.filename.endswith(".txt"):
-            text = content.decode("utf-8")
+        if kind == "pdf":
+            source = str(path)
+            tables = asyncio.ensure_future(extraction_pool.run("tables", source))
+            stream = chunker.stream({"format": "pdf"})
+            total_pages = 0
+            try:
+                async for pages in extraction_pool.iter_pdf_pages(source, PDF_SHARD_PAGES):
+                    for page in pages:
+                        passages = stream.add_page(page)
+                        chunked += len(passages)
+                        for passage in keep(passages):
+                            emitted += 1
+                            yield ndjson_line(passage)
+                    total_pages += len(pages)
+                if not total_pages:
+                    # pdfplumber unavailable: the extractor's placeholder text
+                    base_text, _ = await extraction_pool.run("pdf", source)
+                    stream.feed(base_text)
+                table_text = await tables
+            finally:
+                tables.cancel()
+            remaining = stream.feed(f"\n\n{table_text}")
+            metadata = {"format": "pdf", "total_pages": total_pages, "has_tables": bool(table_text)}
+        elif kind == "txt":
+            stream = chunker.stream({"format": "txt"})
+            remaining = []
+            with open(path, "r", encoding="utf-8") as f:
+                while block := await asyncio.to_thread(f.read, SPOOL_CHUNK_BYTES):
+                    passages = stream.feed(block)
+                    chunked += len(passages)
+                    for passage in keep(passages):
+                        emitted += 1
+                        yield ndjson_line(passage)
             metadata = {"format": "txt"}
         else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+            text, metadata = await extract_text(path, filename, kind)
+            stream = chunker.stream(metadata)
+            remaining = stream.feed(text)
+
+        remaining += stream.close()
+        total_chars = stream.length
+        if not chunked and not remaining:
+            # Blank document, same placeholder as the JSON response
+            stream = chunker.stream(metadata)
+            remaining = stream.feed("[No text found]") + stream.close()
+            total_chars = stream.length
+        for passage in keep(remaining):
+            emitted += 1
+            yield ndjson_line(passage)
+        summary = {
+            "done": True,
+            "filename": filename,
+            "content_type": content_type or "unknown",
+            "total_chars": total_chars,
+            "passages": emitted,
+            "metadata": metadata
+        }
+        if session is not None:
+            summary["dedup"] = session.report()
+        yield ndjson_line(summary)
+    except Exception as e:
+        # Headers are already sent: report the failure in-band
+        if session is not None:
+            deduplicator.abort(session.tenant, session.document_id)
+        error = extraction_error(e, filename)
+        yield ndjson_line({"error": error.detail, "status_code": error.status_code})
+
+@app.post(
+    "/extract",
+    response_model=ExtractionResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}}}}}
+)
+async def extract_document(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None)
+):
+    """
+    Extract text from an uploaded document and chunk it into passages.
+
+    With a user_id, passages that near-duplicate that user's earlier
+    passages are linked or dropped (see DEDUP_MODE); document_id is what
+    later duplicates of this document's passages link back to (generated
+    and returned in the dedup report if not given). The document's own
+    fingerprints only count once POST /dedup/commit confirms it was
+    indexed.
+
+    With "Accept: application/x-ndjson" passages stream back one JSON
+    line each as they are produced, followed by a {"done": true, ...}
+    summary line (or an {"error": ...} line if extraction fails midway),
+    so consumers can start embedding before extraction finishes.
+    """
+    path = None
+    session = None
+    try:
+        path = await spool_upload(file)
+        kind = document_kind(file)
+        session = await dedup_session(user_id, document_id, file.filename)
+
+        if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+            # The spooled file is deleted once the stream ends (or the client goes away)
+            response = StreamingResponse(
+                stream_passages(path, file.filename, file.content_type, kind, session),
+                media_type=NDJSON_MEDIA_TYPE,
+                background=BackgroundTask(path.unlink, missing_ok=True)
+            )
+            path = None
+            return response
+
+        text, metadata = await extract_text(path, file.filename, kind)
         
         if not text or not text.strip(): text = "[No text found]"
 
         passages_data = chunker.chunk(text, metadata)
+        if session is not None:
+            passages_data = session.filter(passages_data)
         passages = [Passage(passage_id=p["passage_id"], text=p["text"], page=p.get("page"), char_start=p["char_start"], char_end=p["char_end"], metadata=p.get("metadata", {})) for p in passages_data]
         
-        return ExtractionResponse(filename=file.filename, content_type=file.content_type or "unknown", total_chars=len(text), passages=passages)
+        return ExtractionResponse(
+            filename=file.filename, content_type=file.content_type or "unknown", total_chars=len(text), passages=passages,
+            dedup=session.report() if session is not None else None
+        )
         
     except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
+        if session is not None:
+            deduplicator.abort(session.tenant, session.document_id)
+        raise extraction_error(e, file.filename)
+    finally:
+        if path is not None:
+            path.unlink(missing_ok=True)
 
 if __name__ == "__main__":
     import uvicorn
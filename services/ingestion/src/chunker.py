@@ -1,66 +1,331 @@
 """
 Passage chunking with overlap
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+import bisect
 import logging
+import os
+import re
 
 logger = logging.getLogger(__name__)
 
+# PDFExtractor joins page texts with this
+PAGE_SEPARATOR = "\n\n"
+
+# Candidate cut points: whitespace after sentence punctuation, and line
+# breaks (two or more newlines = paragraph break)
+BOUNDARY = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+
+
+def page_offsets(pages: List[Dict[str, Any]], separator: str = PAGE_SEPARATOR) -> List[int]:
+    """Start offset of each page in the joined text: prefix sums of char_count"""
+    starts = []
+    offset = 0
+    for page in pages:
+        starts.append(offset)
+        offset += page["char_count"] + len(separator)
+    return starts
+
+
+def load_tokenizer(name: str):
+    """Fast (Rust) tokenizer from a tokenizer.json path or a Hugging Face model id"""
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(name) if os.path.isfile(name) else Tokenizer.from_pretrained(name)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
 class PassageChunker:
-    def __init__(self, chunk_size: int = 512, overlap: int = 50):
+    def __init__(self, chunk_size: int = 512, overlap: int = 50, tokenizer=None):
         """
         chunk_size: target number of characters per chunk
         overlap: number of characters to overlap between chunks
+
+        With a tokenizer (see load_tokenizer), chunk_size and overlap count
+        model tokens instead, special tokens included, and passages end on
+        sentence or paragraph boundaries.
         """
         self.chunk_size = chunk_size
         self.overlap = overlap
-    
+        self.tokenizer = tokenizer
+
     def chunk(self, text: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Chunk text into overlapping passages
         """
-        passages = []
         text_length = len(text)
-        
-        if text_length == 0:
-            return passages
-        
-        passage_id = 0
-        char_start = 0
-        
-        while char_start < text_length:
+
+        # Pages from the extractor's per-page char counts; each passage's
+        # page range is then a binary search away
+        page_starts = None
+        if metadata.get("pages") and all("char_count" in page for page in metadata["pages"]):
+            page_starts = page_offsets(metadata["pages"])
+            if page_starts[-1] > text_length:
+                logger.warning("Page char counts do not match the text, passages get no page")
+                page_starts = None
+
+        stream = self.stream(metadata, page_starts=page_starts)
+        passages = stream.feed(text) + stream.close(log=False)
+
+        logger.info(f"Chunked {text_length} chars into {len(passages)} passages")
+        return passages
+
+    def stream(self, metadata: Dict[str, Any], page_starts: Optional[List[int]] = None) -> "PassageStream":
+        """
+        Incremental chunker for text that arrives in pieces; page_starts
+        (see page_offsets) if the page layout is known up front, otherwise
+        pages come from add_page()
+        """
+        if self.tokenizer is not None:
+            return TokenPassageStream(self, metadata, page_starts)
+        return PassageStream(self, metadata, page_starts)
+
+    def chunk_pages(self, pages: Iterable[str], metadata: Dict[str, Any], separator: str = PAGE_SEPARATOR) -> Iterator[Dict[str, Any]]:
+        """
+        Chunk a document given page by page (joined with separator, as
+        PDFExtractor joins them), yielding each passage as soon as its text
+        has arrived
+        """
+        stream = self.stream(metadata)
+        for page in pages:
+            yield from stream.add_page(page, separator)
+        yield from stream.close()
+
+
+class PassageStream:
+    """
+    Produces the same passages as PassageChunker.chunk on the concatenated
+    text, but only holds the text from the current passage start onwards:
+    feed() returns the passages whose window is complete, close() the
+    rest.
+    """
+
+    def __init__(self, chunker: PassageChunker, metadata: Dict[str, Any], page_starts: Optional[List[int]] = None):
+        self.chunk_size = chunker.chunk_size
+        self.step = chunker.chunk_size - chunker.overlap
+        self.format = metadata.get("format", "unknown")
+        self.length = 0
+        self.count = 0
+        self._buffer = ""
+        self._buffer_start = 0
+        self._char_start = 0
+        self._page_starts: List[int] = list(page_starts or ())
+
+    def add_page(self, text: str, separator: str = PAGE_SEPARATOR) -> List[Dict[str, Any]]:
+        """Feed the next page; pages after the first are preceded by separator"""
+        if self._page_starts:
+            text = separator + text
+        self._page_starts.append(self.length + (len(separator) if self._page_starts else 0))
+        return self.feed(text)
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        # Drop text before the next passage start
+        self._buffer = self._buffer[self._char_start - self._buffer_start:] + text
+        self._buffer_start = self._char_start
+        self.length += len(text)
+        return self._drain(final=False)
+
+    def close(self, log: bool = True) -> List[Dict[str, Any]]:
+        passages = self._drain(final=True)
+        if log:
+            logger.info(f"Chunked {self.length} chars into {self.count} passages")
+        return passages
+
+    def _pages(self, char_start: int, char_end: int) -> Tuple[Optional[int], Optional[int]]:
+        """First and last page (1-based) of [char_start, char_end)"""
+        if not self._page_starts:
+            return None, None
+        return (bisect.bisect_right(self._page_starts, char_start),
+                bisect.bisect_right(self._page_starts, max(char_start, char_end - 1)))
+
+    def _passage(self, char_start: int, char_end: int, passage_text: str, **extra) -> Dict[str, Any]:
+        page, page_end = self._pages(char_start, char_end)
+        passage = {
+            "passage_id": self.count,
+            "text": passage_text,
+            "char_start": char_start,
+            "char_end": char_end,
+            "page": page,
+            "metadata": {
+                "length": len(passage_text),
+                "format": self.format,
+                **extra
+            }
+        }
+        if page is not None:
+            passage["metadata"]["page_end"] = page_end
+        self.count += 1
+        return passage
+
+    def _drain(self, final: bool) -> List[Dict[str, Any]]:
+        passages = []
+        text_length = self.length
+
+        while self._char_start < text_length:
+            char_start = self._char_start
+            if not final and char_start + self.chunk_size > text_length:
+                break
             char_end = min(char_start + self.chunk_size, text_length)
-            
+
             # Extract passage text
-            passage_text = text[char_start:char_end].strip()
-            
+            passage_text = self._buffer[char_start - self._buffer_start:char_end - self._buffer_start].strip()
+
             # Skip empty passages
             if not passage_text:
-                char_start = char_end
+                self._char_start = char_end
                 continue
-            
-            # Estimate page number based on char position (rough approximation)
-            # Assuming ~3000 chars per page
-            estimated_page = None
-            if "total_pages" in metadata and metadata["total_pages"] > 0:
-                estimated_page = int((char_start / text_length) * metadata["total_pages"]) + 1
-            
-            passages.append({
-                "passage_id": passage_id,
-                "text": passage_text,
-                "char_start": char_start,
-                "char_end": char_end,
-                "page": estimated_page,
-                "metadata": {
-                    "length": len(passage_text),
-                    "format": metadata.get("format", "unknown")
-                }
-            })
-            
-            passage_id += 1
-            
+
+            passages.append(self._passage(char_start, char_end, passage_text))
+
             # Move start position forward by (chunk_size - overlap)
-            char_start += self.chunk_size - self.overlap
-        
-        logger.info(f"Chunked {text_length} chars into {len(passages)} passages")
+            self._char_start += self.step
+
         return passages
+
+
+class TokenPassageStream(PassageStream):
+    """
+    Token-budgeted passages cut at sentence and paragraph boundaries.
+
+    Text is split into units at BOUNDARY (a unit longer than the budget
+    is split at word starts by token offsets), the units are tokenized in
+    one batch per feed, and packed greedily until the next one would
+    overflow the budget. A paragraph break also ends a passage that is at
+    least half full. Within a paragraph the next passage starts with the
+    trailing sentences of the previous one, up to overlap tokens.
+    """
+
+    def __init__(self, chunker: PassageChunker, metadata: Dict[str, Any], page_starts: Optional[List[int]] = None):
+        super().__init__(chunker, metadata, page_starts)
+        self.tokenizer = chunker.tokenizer
+        self.budget = chunker.chunk_size - len(self.tokenizer.encode("").ids)
+        if self.budget <= 0:
+            raise ValueError(f"chunk_size of {chunker.chunk_size} tokens leaves no room for text")
+        self.overlap = chunker.overlap
+        # Start of the text not yet split into units, and whether the next
+        # unit opens a paragraph
+        self._pending = 0
+        self._paragraph = True
+        # (start, end, tokens) units of the passage being packed
+        self._current: List[Tuple[int, int, int]] = []
+        self._current_tokens = 0
+        self._fresh = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self._buffer += text
+        self.length += len(text)
+        return self._drain(final=False)
+
+    def _drain(self, final: bool) -> List[Dict[str, Any]]:
+        passages = []
+        for start, end, tokens, paragraph in self._units(final):
+            passages.extend(self._push(start, end, tokens, paragraph))
+        if final and self._fresh:
+            passages.append(self._emit())
+
+        # Keep only the text still needed: the passage being packed and
+        # the unsplit tail
+        keep = min(self._current[0][0], self._pending) if self._current else self._pending
+        self._buffer = self._buffer[keep - self._buffer_start:]
+        self._buffer_start = keep
+        return passages
+
+    def _units(self, final: bool) -> List[Tuple[int, int, int, bool]]:
+        tail = self._buffer[self._pending - self._buffer_start:]
+        spans = []
+        position = 0
+        for match in BOUNDARY.finditer(tail):
+            # A boundary at the very end may continue in the next feed
+            if not final and match.end() == len(tail):
+                break
+            spans.append((position, match.start(), self._paragraph))
+            self._paragraph = match.group().count("\n") >= 2
+            position = match.end()
+        if final:
+            spans.append((position, len(tail), self._paragraph))
+            position = len(tail)
+
+        base = self._pending
+        self._pending += position
+        trimmed = []
+        for start, end, paragraph in spans:
+            piece = tail[start:end]
+            if piece.strip():
+                trimmed.append((base + start + len(piece) - len(piece.lstrip()),
+                                base + end - (len(piece) - len(piece.rstrip())), paragraph))
+        spans = trimmed
+        if not spans:
+            return []
+
+        encodings = self.tokenizer.encode_batch(
+            [self._text(start, end) for start, end, _ in spans], add_special_tokens=False
+        )
+        units = []
+        for (start, end, paragraph), encoding in zip(spans, encodings):
+            if len(encoding.ids) <= self.budget:
+                units.append((start, end, len(encoding.ids), paragraph))
+            else:
+                units.extend(self._split(start, encoding.offsets, paragraph))
+        return units
+
+    def _split(self, start: int, offsets: List[Tuple[int, int]], paragraph: bool) -> List[Tuple[int, int, int, bool]]:
+        """Cut an oversized unit into budget-sized pieces, preferring word starts"""
+        pieces = []
+        first = 0
+        while first < len(offsets):
+            last = min(first + self.budget, len(offsets))
+            if last < len(offsets):
+                cut = last
+                while cut > first + self.budget // 2 and offsets[cut][0] == offsets[cut - 1][1]:
+                    cut -= 1
+                if cut > first + self.budget // 2:
+                    last = cut
+            tokens = last - first
+            if first and offsets[first][0] == offsets[first - 1][1]:
+                # Starts mid-word: re-tokenized on its own it can come out longer
+                while True:
+                    tokens = len(self.tokenizer.encode(
+                        self._text(start + offsets[first][0], start + offsets[last - 1][1]), add_special_tokens=False
+                    ).ids)
+                    if tokens <= self.budget or last - first == 1:
+                        break
+                    last = max(first + 1, last - (tokens - self.budget))
+            pieces.append((start + offsets[first][0], start + offsets[last - 1][1], tokens, paragraph and first == 0))
+            first = last
+        return pieces
+
+    def _push(self, start: int, end: int, tokens: int, paragraph: bool) -> List[Dict[str, Any]]:
+        passages = []
+        if self._fresh and (self._current_tokens + tokens > self.budget
+                            or (paragraph and self._current_tokens >= self.budget // 2)):
+            passages.append(self._emit())
+            carry = [] if paragraph else self._carry()
+            self._current = carry
+            self._current_tokens = sum(unit[2] for unit in carry)
+            self._fresh = 0
+        # Overlap gives way to new text
+        while self._current and self._current_tokens + tokens > self.budget:
+            self._current_tokens -= self._current.pop(0)[2]
+        self._current.append((start, end, tokens))
+        self._current_tokens += tokens
+        self._fresh += 1
+        return passages
+
+    def _carry(self) -> List[Tuple[int, int, int]]:
+        carry = []
+        total = 0
+        for unit in reversed(self._current):
+            if total + unit[2] > self.overlap:
+                break
+            carry.insert(0, unit)
+            total += unit[2]
+        return carry
+
+    def _text(self, start: int, end: int) -> str:
+        return self._buffer[start - self._buffer_start:end - self._buffer_start]
+
+    def _emit(self) -> Dict[str, Any]:
+        char_start, char_end = self._current[0][0], self._current[-1][1]
+        return self._passage(char_start, char_end, self._text(char_start, char_end), tokens=self._current_tokens)
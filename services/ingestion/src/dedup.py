@@ -0,0 +1,314 @@
+"""
+Near-duplicate passage detection with SimHash fingerprints
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+
+FINGERPRINT_BITS = 64
+
+
+def simhash(text: str, shingle_size: int = 3, min_features: int = 8) -> Optional[int]:
+    """
+    64-bit SimHash over lowercased word shingles: each bit is the majority
+    vote of that bit across the shingle hashes, so texts sharing most of
+    their shingles differ in only a few bits. None for texts with fewer
+    than min_features shingles, which are too short to compare reliably.
+    """
+    words = WORD.findall(text.lower())
+    count = len(words) - shingle_size + 1
+    if count < min_features:
+        return None
+    digests = b"".join(
+        hashlib.blake2b(" ".join(words[i:i + shingle_size]).encode("utf-8"), digest_size=8).digest()
+        for i in range(count)
+    )
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(count, 8), axis=1, bitorder="little")
+    majority = (bits.sum(axis=0, dtype=np.int64) * 2 > count).astype(np.uint8)
+    return int.from_bytes(np.packbits(majority, bitorder="little").tobytes(), "little")
+
+
+class TenantIndex:
+    """
+    Fingerprints of one tenant's passages, banded for lookup: the 64 bits
+    are split into max_distance + 1 bands, and by pigeonhole any two
+    fingerprints within max_distance bits agree exactly on at least one
+    band. A lookup only compares against fingerprints sharing a band.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        self._bands = [(i * width, FINGERPRINT_BITS - i * width if i == bands - 1 else width) for i in range(bands)]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        self.fingerprints: List[int] = []
+        # (document_id, filename, passage_id) of each fingerprint
+        self.refs: List[Tuple[Optional[str], Optional[str], int]] = []
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def _keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> shift) & ((1 << width) - 1) for shift, width in self._bands]
+
+    def find(self, fingerprint: int) -> Optional[Tuple[int, int]]:
+        """(position, distance) of the closest fingerprint within max_distance bits"""
+        best = None
+        seen = set()
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            for position in table.get(key, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                distance = (self.fingerprints[position] ^ fingerprint).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (position, distance)
+                    if distance == 0:
+                        return best
+        return best
+
+    def add(self, fingerprint: int, ref: Tuple[Optional[str], Optional[str], int]):
+        position = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        self.refs.append(ref)
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            table.setdefault(key, []).append(position)
+
+
+class Deduplicator:
+    """
+    Per-tenant near-duplicate detection between chunking and embedding.
+
+    Every checked passage is fingerprinted (see simhash) and looked up in
+    its tenant's TenantIndex. A passage within max_distance bits of an
+    earlier one is linked to it with metadata["duplicate_of"] ("link"
+    mode, the caller skips embedding it) or dropped ("skip" mode). Each
+    duplicate saves one embedding and one vector index slot.
+
+    The other passages' fingerprints are staged with their document and
+    only enter the tenant's index on commit(), once the caller has
+    embedded and indexed the document, so nothing links to passages that
+    never made it into the vector index; abort() or pending_ttl seconds
+    without a commit discards them. With state_dir each commit is
+    appended to the tenant's log there, read back on the tenant's first
+    lookup (load() it on a worker thread and adopt() it to keep a large
+    log off the event loop).
+    """
+
+    MODES = ("link", "skip")
+
+    def __init__(self, mode: str = "link", max_distance: int = 3, shingle_size: int = 3,
+                 min_features: int = 8, state_dir: Optional[str] = None, pending_ttl: float = 3600):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown dedup mode {mode!r}, expected one of {self.MODES}")
+        if not 0 <= max_distance < FINGERPRINT_BITS // 2:
+            raise ValueError(f"max_distance must be between 0 and {FINGERPRINT_BITS // 2 - 1}")
+        self.mode = mode
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.min_features = min_features
+        self.state_dir = Path(state_dir) if state_dir else None
+        self.pending_ttl = pending_ttl
+        self._tenants: Dict[str, TenantIndex] = {}
+        # (tenant, document_id) -> session awaiting commit or abort
+        self._pending: "OrderedDict[Tuple[str, str], DedupSession]" = OrderedDict()
+        self._write_lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.committed = 0
+        self.aborted = 0
+
+    def session(self, tenant: str, document_id: Optional[str] = None, filename: Optional[str] = None) -> "DedupSession":
+        """Checks the passages of one document, in order; document_id is generated if not given"""
+        self._expire()
+        document_id = document_id or uuid.uuid4().hex
+        session = DedupSession(self, tenant, self._tenant(tenant), document_id, filename)
+        self._pending.pop((tenant, document_id), None)
+        self._pending[(tenant, document_id)] = session
+        return session
+
+    def _expire(self):
+        deadline = time.monotonic() - self.pending_ttl
+        while self._pending:
+            key, session = next(iter(self._pending.items()))
+            if session.created > deadline:
+                break
+            del self._pending[key]
+            self.aborted += 1
+            logger.warning(f"Dedup fingerprints of document {key[1]} expired without a commit")
+
+    def claim(self, tenant: str, document_id: str) -> Optional["DedupSession"]:
+        """Remove and return the pending session of a document (None if unknown or expired)"""
+        self._expire()
+        return self._pending.pop((tenant, document_id), None)
+
+    def persist(self, session: "DedupSession"):
+        """Append the session's staged fingerprints to its tenant's log (no-op without state_dir)"""
+        if self.state_dir is None or not len(session.staged):
+            return
+        lines = "".join(
+            json.dumps({"fingerprint": fingerprint, "ref": ref}) + "\n"
+            for fingerprint, ref in zip(session.staged.fingerprints, session.staged.refs)
+        )
+        with self._write_lock:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._path(session.tenant), "a+b") as f:
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    f.seek(end - 1)
+                    if f.read(1) != b"\n":
+                        # Start on a fresh line after a torn append
+                        lines = "\n" + lines
+                f.write(lines.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def install(self, session: "DedupSession") -> int:
+        """Make a claimed (and persisted) session's fingerprints visible to later lookups"""
+        index = self._tenant(session.tenant)
+        for fingerprint, ref in zip(session.staged.fingerprints, session.staged.refs):
+            index.add(fingerprint, ref)
+        self.committed += 1
+        return len(session.staged)
+
+    def abort(self, tenant: str, document_id: str) -> bool:
+        """Discard a document's staged fingerprints"""
+        if self.claim(tenant, document_id) is None:
+            return False
+        self.aborted += 1
+        return True
+
+    def loaded(self, tenant: str) -> bool:
+        return tenant in self._tenants
+
+    def adopt(self, tenant: str, index: TenantIndex) -> TenantIndex:
+        """Install a load()ed index unless the tenant was loaded meanwhile"""
+        return self._tenants.setdefault(tenant, index)
+
+    def _tenant(self, tenant: str) -> TenantIndex:
+        index = self._tenants.get(tenant)
+        if index is None:
+            index = self._tenants[tenant] = self.load(tenant)
+        return index
+
+    def _path(self, tenant: str) -> Path:
+        return self.state_dir / f"{hashlib.sha256(tenant.encode('utf-8')).hexdigest()[:32]}.jsonl"
+
+    def load(self, tenant: str) -> TenantIndex:
+        """A tenant's committed fingerprints from state_dir; only reads files, so safe on any thread"""
+        index = TenantIndex(self.max_distance)
+        if self.state_dir is None:
+            return index
+        path = self._path(tenant)
+        if not path.exists():
+            return index
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for number, line in enumerate(f, start=1):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn final append from a crash mid-write
+                        logger.warning(f"Skipping unreadable line {number} of dedup state {path}")
+                        continue
+                    index.add(entry["fingerprint"], tuple(entry["ref"]))
+            logger.info(f"Loaded {len(index)} passage fingerprints for tenant {tenant}")
+        except Exception as e:
+            logger.error(f"Could not load dedup state {path} ({e}), starting empty")
+            index = TenantIndex(self.max_distance)
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "max_distance": self.max_distance,
+            "tenants": len(self._tenants),
+            "fingerprints": sum(len(index) for index in self._tenants.values()),
+            "pending_documents": len(self._pending),
+            "committed_documents": self.committed,
+            "aborted_documents": self.aborted,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "embeddings_saved": self.duplicates,
+            "index_slots_saved": self.duplicates
+        }
+
+
+class DedupSession:
+    def __init__(self, deduplicator: Deduplicator, tenant: str, index: TenantIndex,
+                 document_id: str, filename: Optional[str]):
+        self.deduplicator = deduplicator
+        self.tenant = tenant
+        self.index = index
+        # Fingerprints of this document's kept passages, until commit
+        self.staged = TenantIndex(deduplicator.max_distance)
+        self.document_id = document_id
+        self.filename = filename
+        self.created = time.monotonic()
+        self.checked = 0
+        self.duplicates = 0
+
+    def _find(self, fingerprint: int) -> Optional[Tuple[Tuple[Optional[str], Optional[str], int], int]]:
+        """(ref, distance) of the closest committed or staged fingerprint"""
+        best = None
+        for index in (self.index, self.staged):
+            match = index.find(fingerprint)
+            if match is not None and (best is None or match[1] < best[1]):
+                best = (index.refs[match[0]], match[1])
+        return best
+
+    def filter(self, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Link or drop the near-duplicates among passages, stage the rest"""
+        dedup = self.deduplicator
+        kept = []
+        for passage in passages:
+            fingerprint = simhash(passage["text"], dedup.shingle_size, dedup.min_features)
+            if fingerprint is None:
+                kept.append(passage)
+                continue
+            self.checked += 1
+            dedup.checked += 1
+            match = self._find(fingerprint)
+            if match is None:
+                self.staged.add(fingerprint, (self.document_id, self.filename, passage["passage_id"]))
+                kept.append(passage)
+                continue
+
+            self.duplicates += 1
+            dedup.duplicates += 1
+            if dedup.mode == "link":
+                (document_id, filename, passage_id), distance = match
+                passage.setdefault("metadata", {})["duplicate_of"] = {
+                    "document_id": document_id,
+                    "filename": filename,
+                    "passage_id": passage_id,
+                    "distance": distance
+                }
+                kept.append(passage)
+        return kept
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "mode": self.deduplicator.mode,
+            "document_id": self.document_id,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "staged": len(self.staged),
+            "embeddings_saved": self.duplicates,
+            "index_slots_saved": self.duplicates
+        }
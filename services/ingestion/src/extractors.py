@@ -2,51 +2,86 @@
 Document extractors for various formats
 """
 import io
-from typing import Tuple, Dict, Any
+import os
+from typing import Tuple, Dict, Any, List, Union
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Extractors read from a file path (uploads are spooled to disk) or bytes
+Source = Union[str, os.PathLike, bytes]
+
+
+def _open(source: Source):
+    """Path or in-memory file object for the parsing libraries"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return str(source)
+
+
+def _size(source: Source) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    return os.path.getsize(source)
+
+
 class PDFExtractor:
-    def extract(self, content: bytes) -> Tuple[str, Dict[str, Any]]:
+    def extract(self, source: Source) -> Tuple[str, Dict[str, Any]]:
         """Extract text from PDF"""
         try:
             import pdfplumber
             
-            pdf_file = io.BytesIO(content)
-            text_parts = []
-            metadata = {"format": "pdf", "pages": []}
+            with pdfplumber.open(_open(source)) as pdf:
+                text_parts = [page.extract_text() or "" for page in pdf.pages]
             
-            with pdfplumber.open(pdf_file) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    page_text = page.extract_text() or ""
-                    text_parts.append(page_text)
-                    metadata["pages"].append({
-                        "page_num": page_num,
-                        "char_count": len(page_text)
-                    })
-            
-            full_text = "\n\n".join(text_parts)
-            metadata["total_pages"] = len(metadata["pages"])
-            
-            return full_text, metadata
+            return self.assemble(text_parts)
         
         except ImportError:
             logger.warning("pdfplumber not available, using fallback")
             # Fallback: basic text extraction
-            return f"[PDF content placeholder - {len(content)} bytes]", {"format": "pdf", "fallback": True}
+            return f"[PDF content placeholder - {_size(source)} bytes]", {"format": "pdf", "fallback": True}
         except Exception as e:
             logger.error(f"PDF extraction error: {e}")
             raise
 
+    def page_count(self, source: Source) -> int:
+        """Number of pages, 0 if pdfplumber is unavailable"""
+        try:
+            import pdfplumber
+        except ImportError:
+            return 0
+        with pdfplumber.open(_open(source)) as pdf:
+            return len(pdf.pages)
+
+    def extract_pages(self, source: Source, start: int, end: int) -> List[str]:
+        """Text of pages [start, end) (0-based), one string per page"""
+        import pdfplumber
+
+        with pdfplumber.open(_open(source)) as pdf:
+            return [page.extract_text() or "" for page in pdf.pages[start:end]]
+
+    @staticmethod
+    def assemble(text_parts: List[str]) -> Tuple[str, Dict[str, Any]]:
+        """Join per-page text in page order into (text, metadata)"""
+        metadata = {"format": "pdf", "pages": []}
+        for page_num, page_text in enumerate(text_parts, 1):
+            metadata["pages"].append({
+                "page_num": page_num,
+                "char_count": len(page_text)
+            })
+        
+        full_text = "\n\n".join(text_parts)
+        metadata["total_pages"] = len(metadata["pages"])
+        
+        return full_text, metadata
+
 class DOCXExtractor:
-    def extract(self, content: bytes) -> Tuple[str, Dict[str, Any]]:
+    def extract(self, source: Source) -> Tuple[str, Dict[str, Any]]:
         """Extract text from DOCX"""
         try:
             from docx import Document
             
-            doc_file = io.BytesIO(content)
-            doc = Document(doc_file)
+            doc = Document(_open(source))
             
             paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
             full_text = "\n\n".join(paragraphs)
@@ -61,19 +96,18 @@ class DOCXExtractor:
         
         except ImportError:
             logger.warning("python-docx not available, using fallback")
-            return f"[DOCX content placeholder - {len(content)} bytes]", {"format": "docx", "fallback": True}
+            return f"[DOCX content placeholder - {_size(source)} bytes]", {"format": "docx", "fallback": True}
         except Exception as e:
             logger.error(f"DOCX extraction error: {e}")
             raise
 
 class PPTXExtractor:
-    def extract(self, content: bytes) -> Tuple[str, Dict[str, Any]]:
+    def extract(self, source: Source) -> Tuple[str, Dict[str, Any]]:
         """Extract text from PPTX"""
         try:
             from pptx import Presentation
             
-            pptx_file = io.BytesIO(content)
-            prs = Presentation(pptx_file)
+            prs = Presentation(_open(source))
             
             slides_text = []
             metadata = {"format": "pptx", "slides": []}
@@ -98,19 +132,18 @@ class PPTXExtractor:
         
         except ImportError:
             logger.warning("python-pptx not available, using fallback")
-            return f"[PPTX content placeholder - {len(content)} bytes]", {"format": "pptx", "fallback": True}
+            return f"[PPTX content placeholder - {_size(source)} bytes]", {"format": "pptx", "fallback": True}
         except Exception as e:
             logger.error(f"PPTX extraction error: {e}")
             raise
 
 class CSVExtractor:
-    def extract(self, content: bytes) -> Tuple[str, Dict[str, Any]]:
+    def extract(self, source: Source) -> Tuple[str, Dict[str, Any]]:
         """Extract text from CSV"""
         try:
             import pandas as pd
             
-            csv_file = io.BytesIO(content)
-            df = pd.read_csv(csv_file)
+            df = pd.read_csv(_open(source))
             
             # Convert to formatted text
             text_parts = [f"CSV Data ({len(df)} rows, {len(df.columns)} columns)\n"]
@@ -130,8 +163,47 @@ class CSVExtractor:
         
         except ImportError:
             logger.warning("pandas not available, using fallback")
-            text = content.decode("utf-8", errors="ignore")
+            if isinstance(source, (bytes, bytearray)):
+                text = source.decode("utf-8", errors="ignore")
+            else:
+                with open(source, "r", encoding="utf-8", errors="ignore") as f:
+                    text = f.read()
             return text, {"format": "csv", "fallback": True}
         except Exception as e:
             logger.error(f"CSV extraction error: {e}")
             raise
+
+class OCRExtractor:
+    def extract(self, source: Source) -> str:
+        """Raw Tesseract OCR text of an image"""
+        import pytesseract
+        from PIL import Image
+        
+        with Image.open(_open(source)) as image:
+            return pytesseract.image_to_string(image)
+
+class PDFTableExtractor:
+    def extract_tables_to_text(self, source: Source) -> str:
+        """Camelot (lattice) tables as markdown; camelot needs a file path"""
+        temp_path = None
+        try:
+            import camelot
+            import tempfile
+            
+            if isinstance(source, (bytes, bytearray)):
+                fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+                with os.fdopen(fd, "wb") as f: f.write(source)
+                source = temp_path
+            tables = camelot.read_pdf(str(source), flavor='lattice', pages='all')
+            structured_text = []
+            if tables.n > 0:
+                for i, table in enumerate(tables):
+                    table_markdown = table.df.to_markdown(index=False)
+                    structured_text.append(f"\n--- TABLE {i+1} START ---\n{table_markdown}\n--- TABLE {i+1} END ---\n")
+                return "\n".join(structured_text)
+            return ""
+        except Exception as e:
+            logger.error(f"Camelot Table Extraction Failed: {e}")
+            return ""
+        finally:
+            if temp_path is not None: os.remove(temp_path)
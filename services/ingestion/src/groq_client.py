@@ -0,0 +1,146 @@
+"""
+Shared async client for the Groq API (chat completions and Whisper)
+"""
+from typing import Dict, Any, Optional, Union
+import asyncio
+import logging
+import os
+import random
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GroqError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GroqClient:
+    """
+    One pooled httpx.AsyncClient (keep-alive connections reused across
+    requests) with per-phase timeouts, a semaphore bounding concurrent
+    calls, and retries with exponential backoff plus jitter on transport
+    errors, 429 and 5xx. A Retry-After header, when present, overrides
+    the computed delay (capped at max_backoff).
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: str = "https://api.groq.com/openai/v1",
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self._timeout,
+                limits=self._limits,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def chat(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self._post("/chat/completions", json=payload)
+        return response.json()
+
+    async def transcribe(self, filename: str, source: Union[str, os.PathLike, bytes],
+                         model: str = "whisper-large-v3") -> Dict[str, Any]:
+        """
+        Whisper transcription of bytes or a file. httpx reads file
+        uploads synchronously while sending, so a file is read on a worker
+        thread first rather than on the event loop (Whisper caps uploads
+        at 25 MB).
+        """
+        if not isinstance(source, (bytes, bytearray)):
+            source = await asyncio.to_thread(Path(source).read_bytes)
+        # Filename is required for Groq to know file type
+        response = await self._post("/audio/transcriptions", files={"file": (filename, source)}, data={"model": model})
+        return response.json()
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _post(self, path: str, **kwargs) -> httpx.Response:
+        if not self.configured:
+            raise GroqError("GROQ_API_KEY not found in environment")
+        client = self._get_client()
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                for attempt in range(self.max_retries + 1):
+                    self.requests += 1
+                    response = None
+                    try:
+                        response = await client.post(path, **kwargs)
+                    except httpx.TransportError as e:
+                        error = GroqError(f"Groq request failed: {type(e).__name__}: {e}")
+                    else:
+                        if response.status_code == 200:
+                            return response
+                        error = GroqError(f"Groq API Error: {response.status_code} - {response.text}", response.status_code)
+                        if response.status_code not in RETRYABLE_STATUS:
+                            break
+                    if attempt == self.max_retries:
+                        break
+                    delay = self._delay(attempt, response)
+                    self.retries += 1
+                    logger.warning(f"{error}; retrying {path} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                self.failures += 1
+                raise error
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
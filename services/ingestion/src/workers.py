@@ -0,0 +1,262 @@
+"""
+Process-pool execution layer for CPU-heavy extraction
+"""
+from typing import Dict, Any, Optional, Callable, Tuple, List, AsyncIterator, Deque
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import logging
+import multiprocessing
+import time
+
+import extractors
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionTimeout(Exception):
+    """A job ran past its deadline; its worker was killed"""
+
+
+# --- worker side (runs in the pool processes) ---
+
+_extractors: Dict[str, Any] = {}
+
+
+def _init_worker(memory_limit_bytes: int):
+    if memory_limit_bytes > 0:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+
+EXTRACTORS: Dict[str, Callable[[], Any]] = {
+    "pdf": extractors.PDFExtractor,
+    "docx": extractors.DOCXExtractor,
+    "pptx": extractors.PPTXExtractor,
+    "csv": extractors.CSVExtractor,
+    "ocr": extractors.OCRExtractor,
+    "tables": extractors.PDFTableExtractor,
+}
+
+# job kind -> (extractor, method)
+JOBS = {
+    "pdf": ("pdf", "extract"),
+    "pdf_page_count": ("pdf", "page_count"),
+    "pdf_pages": ("pdf", "extract_pages"),
+    "docx": ("docx", "extract"),
+    "pptx": ("pptx", "extract"),
+    "csv": ("csv", "extract"),
+    "ocr": ("ocr", "extract"),
+    "tables": ("tables", "extract_tables_to_text"),
+}
+
+
+def run_job(kind: str, *args):
+    """Entry point executed in a worker process"""
+    name, method = JOBS[kind]
+    extractor = _extractors.get(name)
+    if extractor is None:
+        extractor = _extractors[name] = EXTRACTORS[name]()
+    return getattr(extractor, method)(*args)
+
+
+# --- parent side ---
+
+class ExtractionPool:
+    """
+    Runs extractor jobs in worker processes so parsing never blocks the
+    event loop (or the GIL).
+
+    At most max_workers jobs are handed to the pool at a time; the rest
+    wait in an asyncio queue, so job_timeout measures run time, not time
+    spent queued, and queue_depth is visible in metrics(). Each worker
+    caps its address space at memory_limit_mb (RLIMIT_AS), so an
+    oversized document fails with MemoryError instead of taking the host
+    down. To shed memory leaked by the parsers, the pool is retired once
+    it has run max_workers * max_tasks_per_child jobs and new jobs go to
+    a fresh one while the old one drains (the executor's own
+    max_tasks_per_child can deadlock on Python 3.11).
+
+    A process pool can't cancel a single job, so on timeout the pool's
+    workers are killed and the job raises ExtractionTimeout; jobs that
+    were running beside it fail with BrokenProcessPool and are retried
+    once on a fresh pool.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_tasks_per_child: int = 50,
+        job_timeout: float = 300.0,
+        memory_limit_mb: int = 4096,
+    ):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.job_timeout = job_timeout
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_jobs = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.pool_restarts = 0
+        self.recycles = 0
+        self.run_seconds = 0.0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.memory_limit_bytes,),
+        )
+
+    def _submit(self, loop: asyncio.AbstractEventLoop, kind: str, args: tuple):
+        executor = self._executor
+        if executor is None:
+            executor = self._executor = self._new_executor()
+            self._executor_jobs = 0
+        future = loop.run_in_executor(executor, run_job, kind, *args)
+        self._executor_jobs += 1
+        if self.max_tasks_per_child and self._executor_jobs >= self.max_workers * self.max_tasks_per_child:
+            # Retire: jobs already submitted finish, then its workers exit
+            self._executor = None
+            self.recycles += 1
+            executor.shutdown(wait=False)
+        return executor, future
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        """Kill executor's workers; the next job starts a fresh pool"""
+        if executor is self._executor:
+            self._executor = None
+            self.pool_restarts += 1
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run_once(self, kind: str, args: tuple, timeout: float):
+        loop = asyncio.get_running_loop()
+        executor, future = self._submit(loop, kind, args)
+        # asyncio.wait rather than wait_for: cancelling an executor future
+        # the pool later marks broken raises InvalidStateError in its
+        # manager thread on Python 3.11
+        done, _ = await asyncio.wait({future}, timeout=timeout)
+        if not done:
+            self.timeouts += 1
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._restart(executor)
+            raise ExtractionTimeout(f"{kind} extraction exceeded {timeout:g}s")
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    async def run(self, kind: str, *args, timeout: Optional[float] = None):
+        if kind not in JOBS:
+            raise ValueError(f"Unknown extraction job '{kind}'")
+        timeout = timeout or self.job_timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        self.submitted += 1
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        started = time.monotonic()
+        try:
+            try:
+                result = await self._run_once(kind, args, timeout)
+            except BrokenProcessPool:
+                self.retried += 1
+                logger.warning(f"Extraction pool broke during a {kind} job, retrying")
+                result = await self._run_once(kind, args, timeout)
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.run_seconds += time.monotonic() - started
+            self._slots.release()
+        self.completed += 1
+        return result
+
+    async def extract_pdf(self, source: extractors.Source, shard_pages: int = 0) -> Tuple[str, Dict[str, Any]]:
+        """
+        PDFExtractor.extract; documents longer than shard_pages pages are
+        split into page ranges extracted in parallel (each worker opens the
+        document and walks only its range), then reassembled in page order
+        """
+        if shard_pages > 0:
+            pages = await self.run("pdf_page_count", source)
+            if pages > shard_pages:
+                ranges = [(start, min(start + shard_pages, pages)) for start in range(0, pages, shard_pages)]
+                parts = await asyncio.gather(*(self.run("pdf_pages", source, start, end) for start, end in ranges))
+                return extractors.PDFExtractor.assemble([text for part in parts for text in part])
+        return await self.run("pdf", source)
+
+    async def iter_pdf_pages(self, source: extractors.Source, shard_pages: int = 0) -> AsyncIterator[List[str]]:
+        """
+        Page texts in page order, one list per range of shard_pages pages
+        (all pages if 0). Up to max_workers ranges are extracted ahead of
+        the consumer; the next one is submitted as the consumer takes one,
+        so a slow consumer holds back extraction instead of piling up
+        page text. Yields nothing if pdfplumber is unavailable.
+        """
+        pages = await self.run("pdf_page_count", source)
+        size = shard_pages if shard_pages > 0 else max(pages, 1)
+        starts = iter(range(0, pages, size))
+        jobs: Deque[asyncio.Future] = deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                jobs.append(asyncio.ensure_future(self.run("pdf_pages", source, start, min(start + size, pages))))
+
+        try:
+            for _ in range(self.max_workers):
+                submit_next()
+            while jobs:
+                pages_text = await jobs.popleft()
+                submit_next()
+                yield pages_text
+        finally:
+            # The consumer stopped early: drop ranges it will never read
+            for job in jobs:
+                if not job.done():
+                    job.cancel()
+                elif not job.cancelled():
+                    job.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queue_depth": self.queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "pool_restarts": self.pool_restarts,
+            "recycles": self.recycles,
+            "avg_job_seconds": self.run_seconds / finished if finished else 0.0,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "job_timeout_seconds": self.job_timeout,
+            "memory_limit_mb": self.memory_limit_bytes // (1024 * 1024),
+        }
@@ -0,0 +1,162 @@
+"""
+Chunking: the streaming path (PassageStream.feed, as used for NDJSON
+responses) must produce exactly the passages of the batch path
+(PassageChunker.chunk, as used for JSON responses), whatever the feed
+sizes; passage page ranges must match a linear scan of the page layout
+"""
+import json
+import random
+
+import pytest
+
+from chunker import PAGE_SEPARATOR, PassageChunker, page_offsets
+
+WORDS = ["alpha", "beta", "gamma", "delta", "retrieval", "passage", "vector", "index", "a", "of"]
+BREAKS = [" ", " ", " ", " ", ". ", "! ", "? ", "\n", "\n\n", ".\n\n", "  \n \n"]
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    parts = []
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.02:
+            # Longer than a token-mode budget, so it is cut mid-unit
+            word = "".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        parts.append(word + rng.choice(BREAKS))
+    return "".join(parts)
+
+
+def random_pieces(rng: random.Random, text: str, max_size: int):
+    pieces = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, max_size)
+        pieces.append(text[position:position + size])
+        position += size
+    return pieces
+
+
+def streamed(chunker: PassageChunker, pieces, metadata):
+    stream = chunker.stream(metadata)
+    passages = []
+    for piece in pieces:
+        passages += stream.feed(piece)
+    return passages + stream.close(log=False)
+
+
+def word_tokenizer():
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.models import WordPiece
+    from tokenizers.pre_tokenizers import Whitespace
+    from tokenizers.processors import TemplateProcessing
+
+    vocab = {"[UNK]": 0, "[CLS]": 1, "[SEP]": 2}
+    for token in WORDS + [".", "!", "?"]:
+        vocab.setdefault(token, len(vocab))
+        vocab.setdefault("##" + token, len(vocab))
+    tokenizer = tokenizers.Tokenizer(WordPiece(vocab, unk_token="[UNK]", max_input_chars_per_word=1000))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.post_processor = TemplateProcessing(
+        single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 1), ("[SEP]", 2)]
+    )
+    return tokenizer
+
+
+CHAR_CHUNKERS = [(64, 8), (100, 0), (37, 36)]
+TOKEN_CHUNKERS = [(16, 4), (24, 0), (40, 12)]
+
+
+@pytest.mark.parametrize("chunk_size,overlap", CHAR_CHUNKERS)
+def test_char_stream_matches_chunk(chunk_size, overlap):
+    rng = random.Random(chunk_size * 1000 + overlap)
+    chunker = PassageChunker(chunk_size=chunk_size, overlap=overlap)
+    for _ in range(50):
+        text = random_text(rng, rng.randint(0, 200))
+        expected = chunker.chunk(text, {"format": "txt"})
+        for max_size in (1, 7, chunk_size, 500):
+            assert streamed(chunker, random_pieces(rng, text, max_size), {"format": "txt"}) == expected
+
+
+@pytest.mark.parametrize("chunk_size,overlap", TOKEN_CHUNKERS)
+def test_token_stream_matches_chunk(chunk_size, overlap):
+    rng = random.Random(chunk_size * 1000 + overlap)
+    chunker = PassageChunker(chunk_size=chunk_size, overlap=overlap, tokenizer=word_tokenizer())
+    for _ in range(30):
+        text = random_text(rng, rng.randint(0, 200))
+        expected = chunker.chunk(text, {"format": "txt"})
+        assert all(p["metadata"]["tokens"] <= chunk_size - 2 for p in expected)
+        for max_size in (1, 5, 60, 2000):
+            assert streamed(chunker, random_pieces(rng, text, max_size), {"format": "txt"}) == expected
+
+
+@pytest.mark.parametrize("mode", ["chars", "tokens"])
+def test_extract_json_and_ndjson_return_the_same_passages(monkeypatch, mode):
+    from fastapi.testclient import TestClient
+    import main
+
+    if mode == "tokens":
+        monkeypatch.setattr(main, "chunker", PassageChunker(chunk_size=24, overlap=6, tokenizer=word_tokenizer()))
+    else:
+        monkeypatch.setattr(main, "chunker", PassageChunker(chunk_size=80, overlap=10))
+    client = TestClient(main.app)
+    rng = random.Random(7)
+    for block in (1, 13, 4096):
+        monkeypatch.setattr(main, "SPOOL_CHUNK_BYTES", block)
+        text = random_text(rng, rng.randint(1, 300)) + "end"
+        upload = {"file": ("doc.txt", text.encode("utf-8"), "text/plain")}
+
+        batch = client.post("/extract", files=upload)
+        assert batch.status_code == 200
+        streamed_lines = client.post("/extract", files=upload, headers={"Accept": "application/x-ndjson"})
+        lines = [json.loads(line) for line in streamed_lines.text.splitlines()]
+
+        assert lines[-1]["done"] and lines[-1]["passages"] == len(lines) - 1
+        assert lines[-1]["total_chars"] == batch.json()["total_chars"]
+        assert lines[:-1] == batch.json()["passages"]
+
+
+def random_pages(rng: random.Random, count: int):
+    # Empty pages (blank scans) included, sometimes several in a row
+    return ["" if rng.random() < 0.25 else random_text(rng, rng.randint(1, 40)) for _ in range(count)]
+
+
+def page_owners(pages, separator: str = PAGE_SEPARATOR):
+    """Page (1-based) of every character of the joined text, by walking it: a separator belongs to the page before it"""
+    owners = []
+    for number, page in enumerate(pages, start=1):
+        owners += [number] * (len(page) + (len(separator) if number < len(pages) else 0))
+    return owners
+
+
+def assert_pages_match_scan(passages, pages):
+    owners = page_owners(pages)
+    for passage in passages:
+        assert passage["page"] == owners[passage["char_start"]]
+        assert passage["metadata"]["page_end"] == owners[max(passage["char_start"], passage["char_end"] - 1)]
+
+
+@pytest.mark.parametrize("mode", ["chars", "tokens"])
+def test_page_attribution_matches_linear_scan(mode):
+    if mode == "tokens":
+        chunker = PassageChunker(chunk_size=20, overlap=5, tokenizer=word_tokenizer())
+    else:
+        chunker = PassageChunker(chunk_size=90, overlap=15)
+    rng = random.Random(24)
+    spanning = 0
+    for _ in range(40):
+        pages = random_pages(rng, rng.randint(1, 12))
+        text = PAGE_SEPARATOR.join(pages)
+        if not text.strip():
+            continue
+        metadata = {"format": "pdf", "pages": [{"page_number": i + 1, "char_count": len(page)} for i, page in enumerate(pages)]}
+        assert page_offsets(metadata["pages"]) == [len(PAGE_SEPARATOR.join(pages[:i])) + (len(PAGE_SEPARATOR) if i else 0)
+                                                   for i in range(len(pages))]
+
+        batch = chunker.chunk(text, metadata)
+        assert_pages_match_scan(batch, pages)
+        spanning += sum(p["page"] != p["metadata"]["page_end"] for p in batch)
+
+        stream = chunker.stream({"format": "pdf"})
+        paged = [passage for page in pages for passage in stream.add_page(page)] + stream.close(log=False)
+        assert paged == batch
+    assert spanning
@@ -0,0 +1,73 @@
+"""
+Deduplication: fingerprints are staged per document and only committed
+ones are matched or persisted
+"""
+from dedup import Deduplicator
+
+TEXT = "the quarterly revenue grew strongly across every region this year while operating margins improved"
+
+
+def passages(text: str = TEXT):
+    return [{"passage_id": 0, "text": text}]
+
+
+def test_only_committed_documents_are_matched(tmp_path):
+    dedup = Deduplicator(state_dir=str(tmp_path))
+    first = dedup.session("tenant", "doc-1", "a.txt")
+    assert first.filter(passages())[0].get("metadata") is None
+
+    # doc-1 is not committed yet, and an aborted document never is
+    second = dedup.session("tenant", "doc-2", "b.txt")
+    assert second.filter(passages())[0].get("metadata") is None
+    assert dedup.abort("tenant", "doc-2")
+    assert not dedup.abort("tenant", "doc-2")
+
+    session = dedup.claim("tenant", "doc-1")
+    dedup.persist(session)
+    assert dedup.install(session) == 1
+
+    third = dedup.session("tenant", "doc-3", "c.txt")
+    linked = third.filter(passages())[0]["metadata"]["duplicate_of"]
+    assert (linked["document_id"], linked["filename"], linked["passage_id"]) == ("doc-1", "a.txt", 0)
+    assert dedup.session("other", "doc-4").filter(passages())[0].get("metadata") is None
+
+
+def test_duplicates_within_a_document_are_linked_before_commit():
+    dedup = Deduplicator(mode="skip")
+    session = dedup.session("tenant")
+    kept = session.filter([{"passage_id": 0, "text": TEXT}, {"passage_id": 1, "text": TEXT}])
+    assert [p["passage_id"] for p in kept] == [0]
+    assert session.report()["document_id"] == session.document_id
+
+
+def test_commits_are_appended_and_reloaded(tmp_path):
+    dedup = Deduplicator(state_dir=str(tmp_path))
+    for number, text in enumerate([TEXT, "an entirely unrelated passage about shipping schedules and port congestion in winter"]):
+        dedup.session("tenant", f"doc-{number}").filter(passages(text))
+        session = dedup.claim("tenant", f"doc-{number}")
+        dedup.persist(session)
+        dedup.install(session)
+    # A crash mid-append leaves a torn last line
+    with open(next(tmp_path.iterdir()), "a", encoding="utf-8") as f:
+        f.write('{"fingerpr')
+
+    reloaded = Deduplicator(state_dir=str(tmp_path))
+    session = reloaded.session("tenant", "doc-9")
+    assert len(session.index) == 2
+    assert session.filter(passages())[0]["metadata"]["duplicate_of"]["document_id"] == "doc-0"
+
+
+def test_pending_documents_expire():
+    dedup = Deduplicator(pending_ttl=0)
+    dedup.session("tenant", "doc-1").filter(passages())
+    assert dedup.claim("tenant", "doc-1") is None
+    assert dedup.stats()["aborted_documents"] == 1
+
+
+def test_adopt_keeps_a_tenant_loaded_meanwhile(tmp_path):
+    dedup = Deduplicator(state_dir=str(tmp_path))
+    stale = dedup.load("tenant")
+    assert not dedup.loaded("tenant")
+    current = dedup.adopt("tenant", dedup.load("tenant"))
+    assert dedup.loaded("tenant")
+    assert dedup.adopt("tenant", stale) is current
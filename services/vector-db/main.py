@@ -1,11 +1,31 @@
 """
 Vector Database Service (FAISS wrapper with User ID Filtering)
 """
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 from typing import List, Dict, Any, Optional
+import asyncio
+import json
 import logging
+import os
+import sys
 import numpy as np
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from snapshot import SnapshotStore
+from wal import WriteAheadLog
+from tenants import TenantPartitions
+from lexical import BM25Index
+from fusion import FUSION_STRATEGIES, fuse
+from wire import VECTOR_BATCH_MEDIA_TYPE, decode_vector_batch, dequantize_int8
+from index_factory import (
+    INDEX_TYPES, IndexConfig, build_index, configure_index, index_type_of,
+    search_params, training_sample, enable_reconstruct
+)
 
 # Setup logging
 logging.basicConfig(
@@ -20,23 +40,363 @@ app = FastAPI(title="Vector Database Service", version="1.1.0")
 _index = None
 _documents = []  # Store document metadata
 _id_to_idx = {}  # Map vector_db_id to index position
+# Dimension of a fresh index; an empty index adopts the dimension of the
+# first vectors added, so any embedding model works without reconfiguring
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", "384"))
+
+# Per-user_id partitions for scoped search (replaces post-filtering),
+# at most TENANT_CACHE_MAX_MB of them cached (float16 partitions when the
+# main index is compressed)
+_tenants = TenantPartitions(
+    VECTOR_DIM,
+    max_cached_bytes=int(os.getenv("TENANT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+)
+
+# Inverted index for BM25 lexical scoring, same positions as the FAISS index
+_lexical = BM25Index()
+
+# Snapshot persistence (DATA_DIR is the vector_db_data volume)
+DATA_DIR = os.getenv("VECTOR_DB_DATA_DIR", "/app/data")
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+
+# Write-ahead log for adds between snapshots
+WAL_SEGMENT_BYTES = int(os.getenv("WAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+WAL_FLUSH_INTERVAL_MS = float(os.getenv("WAL_FLUSH_INTERVAL_MS", "5"))
+WAL_REPLAY_BATCH_ROWS = 65536
+
+# Index type; IVF types start as flat and migrate once enough vectors exist
+INDEX_CONFIG = IndexConfig(
+    index_type=os.getenv("INDEX_TYPE", "flat"),
+    nlist=int(os.getenv("IVF_NLIST", "1024")),
+    nprobe=int(os.getenv("IVF_NPROBE", "16")),
+    pq_m=int(os.getenv("PQ_M", "48")),
+    pq_nbits=int(os.getenv("PQ_NBITS", "8")),
+    hnsw_m=int(os.getenv("HNSW_M", "32")),
+    ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+    ef_search=int(os.getenv("HNSW_EF_SEARCH", "64")),
+    min_train_vectors=int(os.getenv("ANN_MIN_TRAIN_VECTORS", "0")) or None,
+)
+MIGRATION_CHUNK_ROWS = 65536
+
+_snapshot_store: Optional[SnapshotStore] = None
+_migration_task: Optional[asyncio.Task] = None
+_wal: Optional[WriteAheadLog] = None
+_snapshot_task: Optional[asyncio.Task] = None
+_snapshot_ntotal = 0  # ntotal covered by the last snapshot
+# Set when vectors of a failed add could not be removed from the index:
+# it is then ahead of _documents / BM25, so writes and snapshots stop
+# until a restart rebuilds a consistent state from snapshot + WAL
+_write_fault: Optional[str] = None
+# Serializes index mutations against taking a snapshot copy
+_index_lock = asyncio.Lock()
+# One snapshot write at a time (periodic, forced, migration, shutdown)
+_snapshot_lock = asyncio.Lock()
+
+def new_index(dim: int):
+    import faiss
+    if INDEX_CONFIG.requires_training():
+        return faiss.IndexFlatIP(dim)
+    return build_index(INDEX_CONFIG, dim)
 
 def get_faiss_index():
     global _index
     if _index is None:
         try:
-            import faiss
-            # Initialize with 384 dimensions (all-MiniLM-L6-v2)
-            _index = faiss.IndexFlatIP(384)
-            logger.info("FAISS index initialized")
+            _index = new_index(VECTOR_DIM)
+            logger.info(f"FAISS index initialized ({index_type_of(_index)}, {VECTOR_DIM} dimensions)")
         except ImportError:
             logger.error("faiss-cpu not installed")
             raise HTTPException(status_code=500, detail="FAISS not available")
     return _index
 
+def ensure_dimension(dim: int):
+    """
+    Return the index, re-created with dim dimensions if it is still empty
+    and was built for another dimension (e.g. a different embedding model)
+    """
+    global _index
+    index = get_faiss_index()
+    if index.ntotal == 0 and index.d != dim:
+        logger.info(f"Empty index switched from {index.d} to {dim} dimensions")
+        _index = index = new_index(dim)
+        _tenants.dim = dim
+    return index
+
+def get_snapshot_store() -> SnapshotStore:
+    global _snapshot_store
+    if _snapshot_store is None:
+        _snapshot_store = SnapshotStore(os.path.join(DATA_DIR, "snapshots"), keep=SNAPSHOT_KEEP)
+    return _snapshot_store
+
+def get_wal() -> WriteAheadLog:
+    global _wal
+    if _wal is None:
+        _wal = WriteAheadLog(
+            os.path.join(DATA_DIR, "wal"),
+            segment_bytes=WAL_SEGMENT_BYTES,
+            flush_interval_ms=WAL_FLUSH_INTERVAL_MS
+        )
+    return _wal
+
+def validate_metadata(metadata: Any) -> Optional[str]:
+    """
+    Why a metadata list cannot be applied, or None. Checked before a batch
+    is logged or indexed, so nothing is half-applied and the WAL only
+    holds records that replay cleanly.
+    """
+    if not isinstance(metadata, list):
+        return "metadata must be a list"
+    for i, entry in enumerate(metadata):
+        if not isinstance(entry, dict):
+            return f"metadata[{i}] must be an object"
+        for field in ("text", "user_id"):
+            if entry.get(field) is not None and not isinstance(entry[field], str):
+                return f"metadata[{i}].{field} must be a string"
+    return None
+
+def apply_vectors(index, vectors: np.ndarray, metadata_list: List[Dict[str, Any]]) -> int:
+    """
+    Add vectors to the index and record their metadata; returns start
+    position. All or nothing: input is checked and tokenized before the
+    first mutation, _documents, the tenant partitions and BM25 (which can
+    be trimmed back) are updated first and the FAISS add, which not every
+    index type can undo, comes last.
+    """
+    error = validate_metadata(metadata_list)
+    if error is None and (vectors.ndim != 2 or len(vectors) != len(metadata_list)):
+        error = "vectors and metadata length mismatch"
+    if error is None and vectors.shape[1] != index.d:
+        error = f"vectors have {vectors.shape[1]} dimensions, the index {index.d}"
+    if error is not None:
+        raise ValueError(error)
+    user_ids = [m.get("user_id") for m in metadata_list]
+    lexical_documents = _lexical.prepare([m.get("text") for m in metadata_list])
+
+    start_id = index.ntotal
+    try:
+        for i, metadata in enumerate(metadata_list):
+            vector_db_id = f"vec_{start_id + i}"
+            _documents.append({
+                "vector_db_id": vector_db_id,
+                "metadata": metadata
+            })
+            _id_to_idx[vector_db_id] = start_id + i
+        _tenants.add(start_id, vectors, user_ids)
+        _lexical.add_prepared(start_id, lexical_documents)
+        index.add(vectors)
+    except Exception:
+        rollback_vectors(index, start_id)
+        raise
+    return start_id
+
+def rollback_vectors(index, start_id: int):
+    """
+    Remove everything from position start_id on (after a failed
+    apply_vectors, or a WAL append failing after it). If the index holds
+    vectors past start_id that it cannot remove (HNSW, IVF with an array
+    direct map), writes stop: see _write_fault.
+    """
+    global _write_fault
+    import faiss
+    for doc in _documents[start_id:]:
+        _id_to_idx.pop(doc["vector_db_id"], None)
+    del _documents[start_id:]
+    _tenants.truncate(start_id)
+    _lexical.truncate(start_id)
+    if index.ntotal <= start_id:
+        return
+    try:
+        index.remove_ids(faiss.IDSelectorRange(start_id, index.ntotal))
+    except RuntimeError as e:
+        _write_fault = (f"{index.ntotal - start_id} vectors of a failed add could not be removed from the "
+                        f"{index_type_of(index)} index ({str(e) or type(e).__name__}); restart to recover")
+        logger.error(f"Writes disabled: {_write_fault}")
+
+def restore_snapshot() -> int:
+    """
+    Load the latest snapshot into the global index and return the last
+    WAL LSN it contains
+    """
+    global _index, _documents, _id_to_idx, _lexical, _snapshot_ntotal
+    store = get_snapshot_store()
+    restored = store.load()
+    if restored is None:
+        logger.info("No snapshot found, starting with an empty index")
+        return 0
+    index, documents, manifest = restored
+    configure_index(INDEX_CONFIG, index)
+    _index = index
+    _documents = documents
+    _id_to_idx = {doc["vector_db_id"]: i for i, doc in enumerate(documents)}
+    _tenants.dim = index.d
+    _tenants.rebuild(documents)
+    lexical_arrays = store.load_extra(manifest, "lexical")
+    if lexical_arrays is not None:
+        _lexical = BM25Index.from_arrays(lexical_arrays)
+    else:
+        # Snapshot predates the inverted index: rebuild it from document text
+        _lexical = BM25Index()
+        texts = [doc["metadata"].get("text") for doc in documents]
+        _lexical.add(0, [text if isinstance(text, str) else None for text in texts])
+    _snapshot_ntotal = index.ntotal
+    return manifest.get("wal_lsn", 0)
+
+def replay_wal(after_lsn: int):
+    """
+    Re-apply WAL records newer than the snapshot, batching index adds.
+    A record that cannot be applied is quarantined (see
+    WriteAheadLog.quarantine) and skipped rather than failing startup.
+    """
+    wal = get_wal()
+    pending = []
+    pending_rows = 0
+    replayed = 0
+    skipped = 0
+
+    def apply_record(lsn, vectors, metadata) -> bool:
+        try:
+            apply_vectors(ensure_dimension(vectors.shape[1]), vectors, metadata)
+            return True
+        except Exception as e:
+            wal.quarantine(lsn, vectors, metadata, str(e) or type(e).__name__)
+            return False
+
+    def apply_pending() -> int:
+        try:
+            vectors = np.concatenate([record[1] for record in pending])
+            metadata = [entry for record in pending for entry in record[2]]
+            apply_vectors(ensure_dimension(vectors.shape[1]), vectors, metadata)
+            return 0
+        except Exception as e:
+            logger.error(f"Batched WAL replay failed ({str(e)}), applying records one at a time")
+        return sum(not apply_record(*record) for record in pending)
+
+    for lsn, vectors, metadata in wal.replay(after_lsn):
+        replayed += 1
+        error = validate_metadata(metadata)
+        if error is None and len(metadata) != len(vectors):
+            error = "vectors and metadata length mismatch"
+        if error is not None:
+            wal.quarantine(lsn, vectors, metadata, error)
+            skipped += 1
+            continue
+        pending.append((lsn, vectors, metadata))
+        pending_rows += len(vectors)
+        if pending_rows >= WAL_REPLAY_BATCH_ROWS:
+            skipped += apply_pending()
+            pending, pending_rows = [], 0
+    if pending:
+        skipped += apply_pending()
+
+    if replayed:
+        logger.info(
+            f"Replayed {replayed - skipped} WAL records ({skipped} quarantined), "
+            f"index now has {get_faiss_index().ntotal} vectors"
+        )
+
+def snapshot_copy(index):
+    """
+    In-memory copy of everything a snapshot holds. Runs in a worker
+    thread while _index_lock holds back adds; searches keep running.
+    """
+    import faiss
+    return faiss.serialize_index(index), list(_documents), {"lexical": _lexical.to_arrays()}
+
+async def write_snapshot(force: bool = False) -> bool:
+    """Snapshot the index if it changed since the last snapshot"""
+    global _snapshot_ntotal
+    wal = get_wal()
+    async with _snapshot_lock:
+        async with _index_lock:
+            if _write_fault is not None:
+                # Would persist an index ahead of its documents
+                raise RuntimeError(f"Snapshots disabled: {_write_fault}")
+            index = get_faiss_index()
+            if not force and index.ntotal == _snapshot_ntotal:
+                return False
+            # Every appended record has been applied while we hold the lock
+            lsn = wal.last_lsn
+            ntotal = index.ntotal
+            wal.rotate()
+            index_bytes, documents, extras = await asyncio.to_thread(snapshot_copy, index)
+        # Adds resume while the copy is written and fsynced
+        await asyncio.to_thread(get_snapshot_store().save, index_bytes, ntotal, documents, lsn, extras)
+        _snapshot_ntotal = ntotal
+        wal.truncate(lsn)
+    return True
+
+def maybe_start_migration(index_type: Optional[str] = None) -> bool:
+    """
+    Start a background migration if the index isn't index_type (default:
+    the target type) yet; a started migration makes index_type the target
+    """
+    global _migration_task
+    index_type = index_type or INDEX_CONFIG.index_type
+    if _write_fault is not None or (_migration_task is not None and not _migration_task.done()):
+        return False
+    index = get_faiss_index()
+    if index_type_of(index) == index_type:
+        return False
+    if INDEX_CONFIG.requires_training(index_type) and index.ntotal < INDEX_CONFIG.train_minimum(index_type):
+        return False
+    INDEX_CONFIG.index_type = index_type
+    _migration_task = asyncio.create_task(migrate_index(index_type))
+    return True
+
+async def migrate_index(index_type: str):
+    """
+    Build an index of index_type from the live one without blocking
+    searches or adds: vectors are copied in chunks (copy under the lock,
+    add to the new index off the event loop), then the last few vectors
+    added meanwhile are caught up and the index is swapped under the lock.
+    Positions are preserved, so vector_db_ids stay valid.
+    """
+    global _index
+    source = get_faiss_index()
+    logger.info(f"Migrating {source.ntotal} vectors from {index_type_of(source)} to {index_type}")
+    try:
+        target = build_index(INDEX_CONFIG, source.d, index_type)
+        if INDEX_CONFIG.requires_training(index_type):
+            async with _index_lock:
+                sample = training_sample(INDEX_CONFIG, source)
+            await asyncio.to_thread(target.train, sample)
+        enable_reconstruct(target)
+
+        copied = 0
+        while True:
+            async with _index_lock:
+                remaining = source.ntotal - copied
+                if remaining <= MIGRATION_CHUNK_ROWS:
+                    if remaining:
+                        target.add(source.reconstruct_n(copied, remaining))
+                    _index = target
+                    # Rebuilt from the new index (and its storage type) on next use
+                    _tenants.reset()
+                    break
+                chunk = source.reconstruct_n(copied, MIGRATION_CHUNK_ROWS)
+            await asyncio.to_thread(target.add, chunk)
+            copied += len(chunk)
+
+        logger.info(f"Index migrated to {index_type} ({target.ntotal} vectors)")
+    except Exception as e:
+        logger.error(f"Index migration failed: {str(e)}")
+        return
+    # Persist the new index so a restart doesn't repeat the migration
+    await write_snapshot(force=True)
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await write_snapshot()
+        except Exception as e:
+            logger.error(f"Periodic snapshot failed: {str(e)}")
+
 class AddVectorsRequest(BaseModel):
     vectors: List[List[float]]
     metadata: List[Dict[str, Any]]
+    dtype: str = "float32"  # or "int8": codes from /embed's int8 output
 
 class SearchRequest(BaseModel):
     query_vector: List[float]
@@ -44,6 +404,35 @@ class SearchRequest(BaseModel):
     top_k: int = 10
     hybrid: bool = True
     user_id: Optional[str] = None  # <--- NEW FIELD FOR FILTERING
+    # ANN breadth for unscoped searches; user_id searches are exact
+    nprobe: Optional[int] = None  # IVF lists to probe (IVF index types)
+    ef_search: Optional[int] = None  # HNSW search breadth (hnsw index type)
+    fusion: str = "linear"  # linear | rrf | minmax | zscore
+    vector_weight: float = 0.7
+    lexical_weight: float = 0.3
+    rrf_k: int = 60
+    fetch_k: Optional[int] = None  # candidates per retriever (default 4 * top_k)
+
+class BatchQuery(BaseModel):
+    query_text: Optional[str] = None
+    top_k: int = 10
+    user_id: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    query_vectors: List[List[float]]  # (n, dimensions) matrix
+    queries: Optional[List[BatchQuery]] = None  # per-row text/top_k/user_id
+    top_k: int = 10  # used when queries is omitted
+    hybrid: bool = True
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    fusion: str = "linear"
+    vector_weight: float = 0.7
+    lexical_weight: float = 0.3
+    rrf_k: int = 60
+    fetch_k: Optional[int] = None
+
+class MigrateRequest(BaseModel):
+    index_type: Optional[str] = None
 
 class SearchResult(BaseModel):
     vector_db_id: str
@@ -54,103 +443,406 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
     search_type: str
 
+class BatchSearchResponse(BaseModel):
+    results: List[List[SearchResult]]
+
+@app.on_event("startup")
+async def startup():
+    global _snapshot_task
+    try:
+        snapshot_lsn = restore_snapshot()
+        replay_wal(snapshot_lsn)
+    except Exception as e:
+        logger.error(f"Snapshot restore failed: {str(e)}")
+        raise
+    get_wal().start()
+    maybe_start_migration()
+    if SNAPSHOT_INTERVAL_SECONDS > 0:
+        _snapshot_task = asyncio.create_task(snapshot_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+    if _migration_task is not None:
+        _migration_task.cancel()
+    try:
+        await write_snapshot()
+    except Exception as e:
+        logger.error(f"Shutdown snapshot failed: {str(e)}")
+    await get_wal().stop()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "vector-db"}
 
-@app.post("/index/add")
-async def add_vectors(request: AddVectorsRequest):
-    """Add vectors to the index"""
-    if len(request.vectors) != len(request.metadata):
+@app.post("/snapshot")
+async def create_snapshot():
+    """Force a snapshot of the current index"""
+    try:
+        await write_snapshot(force=True)
+        manifest = get_snapshot_store().read_manifest()
+        return {"generation": manifest["generation"], "total_vectors": manifest["ntotal"]}
+    except Exception as e:
+        logger.error(f"Snapshot error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Snapshot failed: {str(e)}")
+
+@app.get("/index/info")
+async def index_info():
+    """Current index type, size and migration state"""
+    index = get_faiss_index()
+    return {
+        "index_type": index_type_of(index),
+        "target_index_type": INDEX_CONFIG.index_type,
+        "total_vectors": index.ntotal,
+        "dimensions": index.d,
+        "migrating": _migration_task is not None and not _migration_task.done(),
+        "write_fault": _write_fault,
+        "wal_failure": get_wal().failure,
+        "tenants": _tenants.stats()
+    }
+
+@app.post("/index/migrate")
+async def start_migration(request: MigrateRequest):
+    """
+    Rebuild the index as another type in the background. Once the
+    migration starts, the new type is the target until restart
+    (INDEX_TYPE sets it permanently).
+    """
+    index_type = request.index_type or INDEX_CONFIG.index_type
+    if index_type not in INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"index_type must be one of {list(INDEX_TYPES)}")
+    minimum = INDEX_CONFIG.train_minimum(index_type)
+    if INDEX_CONFIG.requires_training(index_type) and get_faiss_index().ntotal < minimum:
+        raise HTTPException(status_code=400, detail=f"{index_type} needs at least {minimum} vectors to train")
+    started = maybe_start_migration(index_type)
+    return {"started": started, "index_type": index_type}
+
+@app.post(
+    "/index/add",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": AddVectorsRequest.model_json_schema()},
+                VECTOR_BATCH_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}
+            },
+            "required": True
+        }
+    }
+)
+async def add_vectors(http_request: Request):
+    """
+    Add vectors to the index.
+
+    Accepts either JSON (AddVectorsRequest) or, with Content-Type
+    application/x-vector-batch, a binary batch whose JSON trailer is the
+    metadata list; the binary form is decoded straight into NumPy. float16
+    and int8 payloads (JSON: "dtype": "int8") are widened to float32 on
+    the way in; with INDEX_TYPE sq_fp16 / sq8 the index stores them
+    compactly again.
+    """
+    body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "")
+    if content_type.startswith(VECTOR_BATCH_MEDIA_TYPE):
+        try:
+            vectors_np, metadata = decode_vector_batch(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid vector batch: {str(e)}")
+        # Same rules as AddVectorsRequest.metadata
+        error = validate_metadata(metadata)
+        if error is not None:
+            raise HTTPException(status_code=422, detail=f"Vector batch trailer: {error}")
+    else:
+        try:
+            request = AddVectorsRequest.model_validate(json.loads(body))
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        if request.dtype not in ("float32", "int8"):
+            raise HTTPException(status_code=400, detail="dtype must be float32 or int8")
+        vectors_np = np.array(request.vectors, dtype=np.float32)
+        if request.dtype == "int8":
+            vectors_np = dequantize_int8(vectors_np)
+        metadata = request.metadata
+    
+    if len(vectors_np) != len(metadata):
         raise HTTPException(status_code=400, detail="Vectors and metadata length mismatch")
     
-    if not request.vectors:
+    if len(vectors_np) == 0:
         raise HTTPException(status_code=400, detail="No vectors provided")
     
+    if vectors_np.ndim != 2:
+        raise HTTPException(status_code=400, detail="Vectors must be a (n, dimensions) matrix")
+    
+    error = validate_metadata(metadata)
+    if error is not None:
+        raise HTTPException(status_code=422, detail=error)
+    
     try:
-        index = get_faiss_index()
-        vectors_np = np.array(request.vectors, dtype=np.float32)
+        wal = get_wal()
+        async with _index_lock:
+            if _write_fault is not None:
+                raise HTTPException(status_code=503, detail=f"Writes disabled: {_write_fault}")
+            index = ensure_dimension(vectors_np.shape[1])
+            if vectors_np.shape[1] != index.d:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Vectors must have {index.d} dimensions (the index already holds vectors of that size)"
+                )
+            # Apply, then log only what was applied; both happen without
+            # yielding so WAL order always matches index positions.
+            start_id = apply_vectors(index, vectors_np, metadata)
+            try:
+                lsn = wal.append(vectors_np, metadata)
+            except Exception:
+                rollback_vectors(index, start_id)
+                raise
         
-        start_id = index.ntotal
-        index.add(vectors_np)
+        # Acknowledge only once the record is durable (group commit)
+        await wal.commit(lsn)
+        maybe_start_migration()
         
-        for i, metadata in enumerate(request.metadata):
-            vector_db_id = f"vec_{start_id + i}"
-            _documents.append({
-                "vector_db_id": vector_db_id,
-                "metadata": metadata
-            })
-            _id_to_idx[vector_db_id] = start_id + i
-        
-        logger.info(f"Added {len(request.vectors)} vectors to index")
-        return {"added": len(request.vectors), "total_vectors": index.ntotal}
+        logger.info(f"Added {len(vectors_np)} vectors to index")
+        return {"added": len(vectors_np), "total_vectors": index.ntotal}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding vectors: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to add vectors: {str(e)}")
 
+async def prepare_partitions(user_ids) -> Any:
+    """
+    Materialize the tenant partitions these user_ids' searches need on a
+    worker thread, holding back adds (which would race the copy) but not
+    searches; returns the current index
+    """
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not any(_tenants.pending(user_id) for user_id in user_ids):
+        return get_faiss_index()
+    async with _index_lock:
+        index = get_faiss_index()
+        for key in {key for user_id in user_ids for key in _tenants.pending(user_id)}:
+            _tenants.install(key, await asyncio.to_thread(_tenants.build, index, key))
+        return index
+
+def vector_candidates(index, queries: np.ndarray, fetch_k: int, user_id: Optional[str],
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Top fetch_k positions per query row. With a user_id only the caller's
+    partition (plus shared documents) is searched exhaustively, so every
+    candidate is visible and top-k is exact; nprobe / ef_search only apply
+    to unscoped searches.
+    """
+    if user_id:
+        return _tenants.search(index, queries, fetch_k, user_id)
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index.search(queries, fetch_k, params=params)
+
+def fill_vector_scores(index, query_vector: np.ndarray, positions: np.ndarray, floor: float) -> np.ndarray:
+    """Inner products for lexical-only hits the vector retriever didn't return"""
+    try:
+        return index.reconstruct_batch(positions) @ query_vector
+    except RuntimeError:
+        # Index type without reconstruct support: tie them with the worst
+        # vector hit (finite, so minmax / zscore normalization still works)
+        return np.full(len(positions), floor, dtype=np.float32)
+
+def rank_candidates(index, query_vector: np.ndarray, distances: np.ndarray, indices: np.ndarray,
+                    lexical, query_text: Optional[str], fusion: str,
+                    vector_weight: float, lexical_weight: float, rrf_k: int):
+    """
+    Turn one query's vector hits (a faiss result row) and optional lexical
+    hits (positions, scores) into fused (positions, scores), best first.
+    """
+    valid = (indices >= 0) & (indices < len(_documents))
+    vector_positions = indices[valid]
+    vector_scores = distances[valid]
+    if lexical is None:
+        return vector_positions, vector_scores
+    
+    lexical_positions, lexical_scores = lexical
+    # Score every candidate on both signals
+    lexical_only = np.setdiff1d(lexical_positions, vector_positions, assume_unique=True)
+    positions = np.concatenate([vector_positions, lexical_only])
+    all_vector_scores = np.concatenate([
+        vector_scores,
+        fill_vector_scores(index, query_vector, lexical_only, float(vector_scores.min()) if len(vector_scores) else 0.0)
+    ])
+    lexical_by_position = dict(zip(lexical_positions.tolist(), lexical_scores.tolist()))
+    all_lexical_scores = np.zeros(len(positions), dtype=np.float32)
+    unscored = []
+    for i, position in enumerate(positions.tolist()):
+        if position in lexical_by_position:
+            all_lexical_scores[i] = lexical_by_position[position]
+        else:
+            unscored.append(i)
+    if unscored:
+        all_lexical_scores[unscored] = _lexical.score(query_text, positions[unscored])
+    
+    return fuse(
+        fusion, positions, all_vector_scores, all_lexical_scores,
+        vector_positions, lexical_positions,
+        vector_weight=vector_weight, lexical_weight=lexical_weight, rrf_k=rrf_k
+    )
+
+async def settle(futures):
+    """
+    Cancel lexical searches that were never awaited (the request failed
+    first) and retrieve every outcome, so none is left running unowned or
+    logs "Future exception was never retrieved"
+    """
+    futures = [future for future in futures if future is not None]
+    for future in futures:
+        future.cancel()
+    await asyncio.gather(*futures, return_exceptions=True)
+
+def build_results(positions: np.ndarray, scores: np.ndarray, top_k: int) -> List[SearchResult]:
+    results = []
+    for position, score in zip(positions[:top_k], scores[:top_k]):
+        doc = _documents[position]
+        results.append(SearchResult(
+            vector_db_id=doc["vector_db_id"],
+            score=float(score),
+            metadata=doc["metadata"]
+        ))
+    return results
+
 @app.post("/search/hybrid", response_model=SearchResponse)
 async def hybrid_search(request: SearchRequest):
     """
-    Hybrid search with User ID Filtering
+    Hybrid search, scoped to the caller's partition when user_id is set
+    (scoped vector search is exact, so nprobe / ef_search don't apply).
+
+    The vector and BM25 retrievers run independently and in parallel over
+    everything the caller can see; their candidates are merged with the
+    requested fusion strategy, so lexical-only hits can surface too.
     """
+    if request.fusion not in FUSION_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"fusion must be one of {list(FUSION_STRATEGIES)}")
+    dimensions = get_faiss_index().d
+    if len(request.query_vector) != dimensions:
+        raise HTTPException(status_code=400, detail=f"query_vector must have {dimensions} dimensions")
+    
+    lexical_future = None
     try:
-        index = get_faiss_index()
+        index = await prepare_partitions([request.user_id])
         
         if index.ntotal == 0:
             return SearchResponse(results=[], search_type="hybrid")
         
         query_vector_np = np.array([request.query_vector], dtype=np.float32)
+        use_lexical = request.hybrid and bool(request.query_text)
         
-        # 1. Fetch MORE candidates than needed (e.g. 5x) to allow for filtering
-        # If user wants top 3, we fetch top 15, then filter out other users' docs
-        fetch_k = min(request.top_k * 10, index.ntotal)
-        distances, indices = index.search(query_vector_np, fetch_k)
+        visible = _tenants.visible_count(request.user_id) if request.user_id else index.ntotal
+        fetch_k = request.fetch_k or (request.top_k * 4 if use_lexical else request.top_k)
+        fetch_k = min(max(fetch_k, request.top_k), visible)
+        if fetch_k == 0:
+            return SearchResponse(results=[], search_type="hybrid")
         
-        results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(_documents):
-                doc = _documents[idx]
-                
-                # --- FILTERING LOGIC ---
-                # If the search request has a user_id, ensure the doc matches it
-                doc_user_id = doc["metadata"].get("user_id")
-                if request.user_id and doc_user_id:
-                    if doc_user_id != request.user_id:
-                        continue # Skip this document, it belongs to someone else
-                # -----------------------
-
-                # Calculate Scores (Hybrid)
-                lexical_score = 0.0
-                if request.hybrid and request.query_text:
-                    text = doc["metadata"].get("text", "").lower()
-                    query_words = set(request.query_text.lower().split())
-                    text_words = set(text.split())
-                    if text_words and query_words:
-                        lexical_score = len(query_words & text_words) / len(query_words)
-                
-                vector_score = float(dist)
-                final_score = vector_score
-                if request.hybrid and request.query_text:
-                    final_score = 0.7 * vector_score + 0.3 * lexical_score
-                
-                results.append({
-                    "vector_db_id": doc["vector_db_id"],
-                    "score": final_score,
-                    "metadata": doc["metadata"]
-                })
+        # BM25 runs on a worker thread while FAISS searches on this one (it
+        # releases the GIL); all FAISS access stays on the event loop thread.
+        if use_lexical:
+            allowed = _tenants.visible_positions(request.user_id) if request.user_id else None
+            lexical_future = asyncio.get_running_loop().run_in_executor(
+                None, _lexical.search, request.query_text, fetch_k, allowed
+            )
         
-        # Sort and limit
-        results.sort(key=lambda x: x["score"], reverse=True)
-        results = results[:request.top_k]
+        distances, indices = vector_candidates(
+            index, query_vector_np, fetch_k, request.user_id,
+            nprobe=request.nprobe, ef_search=request.ef_search
+        )
+        lexical = await lexical_future if lexical_future is not None else None
+        positions, scores = rank_candidates(
+            index, query_vector_np[0], distances[0], indices[0], lexical, request.query_text,
+            request.fusion, request.vector_weight, request.lexical_weight, request.rrf_k
+        )
+        results = build_results(positions, scores, request.top_k)
         
         logger.info(f"Search returned {len(results)} valid results for user {request.user_id}")
         
-        return SearchResponse(results=[SearchResult(**r) for r in results], search_type="hybrid")
+        return SearchResponse(results=results, search_type="hybrid")
     
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    finally:
+        await settle([lexical_future])
+
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def batch_search(request: BatchSearchRequest):
+    """
+    Search many query vectors at once. Queries sharing a user_id scope go
+    through a single vectorized FAISS search; lexical retrieval for queries
+    with text runs on worker threads meanwhile. Results are returned in
+    query order.
+    """
+    if request.fusion not in FUSION_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"fusion must be one of {list(FUSION_STRATEGIES)}")
+    
+    n = len(request.query_vectors)
+    queries = request.queries or [BatchQuery(top_k=request.top_k) for _ in range(n)]
+    if len(queries) != n:
+        raise HTTPException(status_code=400, detail="query_vectors and queries length mismatch")
+    if n == 0:
+        return BatchSearchResponse(results=[])
+    
+    index = get_faiss_index()
+    query_matrix = np.array(request.query_vectors, dtype=np.float32)
+    if query_matrix.ndim != 2 or query_matrix.shape[1] != index.d:
+        raise HTTPException(status_code=400, detail=f"query_vectors must be an (n, {index.d}) matrix")
+    
+    lexical_futures = {}
+    try:
+        results: List[List[SearchResult]] = [[] for _ in range(n)]
+        if index.ntotal == 0:
+            return BatchSearchResponse(results=results)
+        
+        index = await prepare_partitions(query.user_id for query in queries)
+        loop = asyncio.get_running_loop()
+        fetch_ks = []
+        for i, query in enumerate(queries):
+            use_lexical = request.hybrid and bool(query.query_text)
+            visible = _tenants.visible_count(query.user_id) if query.user_id else index.ntotal
+            fetch_k = request.fetch_k or (query.top_k * 4 if use_lexical else query.top_k)
+            fetch_ks.append(min(max(fetch_k, query.top_k), visible))
+            if use_lexical and fetch_ks[i] > 0:
+                allowed = _tenants.visible_positions(query.user_id) if query.user_id else None
+                lexical_futures[i] = loop.run_in_executor(
+                    None, _lexical.search, query.query_text, fetch_ks[i], allowed
+                )
+        
+        # One FAISS call per user_id scope, sized for the largest fetch_k in it
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, query in enumerate(queries):
+            if fetch_ks[i] > 0:
+                groups.setdefault(query.user_id or None, []).append(i)
+        
+        for user_id, rows in groups.items():
+            group_k = max(fetch_ks[i] for i in rows)
+            distances, indices = vector_candidates(
+                index, query_matrix[rows], group_k, user_id,
+                nprobe=request.nprobe, ef_search=request.ef_search
+            )
+            for row, i in enumerate(rows):
+                k = fetch_ks[i]
+                lexical = await lexical_futures[i] if i in lexical_futures else None
+                positions, scores = rank_candidates(
+                    index, query_matrix[i], distances[row][:k], indices[row][:k], lexical,
+                    queries[i].query_text, request.fusion,
+                    request.vector_weight, request.lexical_weight, request.rrf_k
+                )
+                results[i] = build_results(positions, scores, queries[i].top_k)
+        
+        logger.info(f"Batch search ran {n} queries in {len(groups)} scopes")
+        return BatchSearchResponse(results=results)
+    
+    except Exception as e:
+        logger.error(f"Batch search error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+    finally:
+        await settle(lexical_futures.values())
 
 if __name__ == "__main__":
     import uvicorn
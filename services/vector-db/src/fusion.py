@@ -0,0 +1,77 @@
+"""
+Rank fusion strategies for combining vector and lexical retrieval
+"""
+from typing import Dict, Tuple
+import numpy as np
+
+FUSION_STRATEGIES = ("linear", "rrf", "minmax", "zscore")
+
+
+def minmax(scores: np.ndarray) -> np.ndarray:
+    if len(scores) == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low <= 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def zscore(scores: np.ndarray) -> np.ndarray:
+    if len(scores) == 0:
+        return scores
+    std = scores.std()
+    if std <= 1e-12:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def reciprocal_ranks(ranked: np.ndarray, rrf_k: int) -> Dict[int, float]:
+    return {int(position): 1.0 / (rrf_k + rank) for rank, position in enumerate(ranked, 1)}
+
+
+def fuse(
+    strategy: str,
+    positions: np.ndarray,
+    vector_scores: np.ndarray,
+    lexical_scores: np.ndarray,
+    vector_ranked: np.ndarray,
+    lexical_ranked: np.ndarray,
+    vector_weight: float = 0.7,
+    lexical_weight: float = 0.3,
+    rrf_k: int = 60,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Combine the two retrievers over the union of their candidates.
+
+    positions/vector_scores/lexical_scores are aligned arrays covering the
+    union (missing scores already filled in by the caller); *_ranked are
+    each retriever's own result lists in rank order, used by RRF.
+
+        linear  weighted sum of the raw inner product and BM25 scaled by
+                the best lexical score (the pre-fusion behaviour)
+        minmax  weighted sum of min-max normalized scores
+        zscore  weighted sum of z-score normalized scores
+        rrf     weighted reciprocal rank fusion, sum of w / (rrf_k + rank)
+
+    Returns (positions, fused scores) sorted best-first.
+    """
+    if strategy == "rrf":
+        vector_rr = reciprocal_ranks(vector_ranked, rrf_k)
+        lexical_rr = reciprocal_ranks(lexical_ranked, rrf_k)
+        fused = np.array([
+            vector_weight * vector_rr.get(int(p), 0.0) + lexical_weight * lexical_rr.get(int(p), 0.0)
+            for p in positions
+        ], dtype=np.float64)
+    elif strategy == "minmax":
+        fused = vector_weight * minmax(vector_scores) + lexical_weight * minmax(lexical_scores)
+    elif strategy == "zscore":
+        fused = vector_weight * zscore(vector_scores) + lexical_weight * zscore(lexical_scores)
+    elif strategy == "linear":
+        best = lexical_scores.max() if len(lexical_scores) else 0.0
+        scaled = lexical_scores / best if best > 0 else lexical_scores
+        fused = vector_weight * vector_scores + lexical_weight * scaled
+    else:
+        raise ValueError(f"Unknown fusion strategy '{strategy}'")
+
+    order = np.argsort(-fused, kind="stable")
+    return positions[order], fused[order]
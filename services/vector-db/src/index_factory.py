@@ -0,0 +1,135 @@
+"""
+FAISS index construction for the supported index types
+"""
+from typing import Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq8")
+
+# Scalar-quantized flat storage: half (fp16) or a quarter (8-bit) of the
+# float32 footprint, still scanned exhaustively
+COMPACT_INDEX_TYPES = ("sq_fp16", "sq8")
+
+
+class IndexConfig:
+    def __init__(
+        self,
+        index_type: str = "flat",
+        nlist: int = 1024,
+        nprobe: int = 16,
+        pq_m: int = 48,
+        pq_nbits: int = 8,
+        hnsw_m: int = 32,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        min_train_vectors: Optional[int] = None,
+        max_train_vectors: Optional[int] = None,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.min_train_vectors = min_train_vectors  # None: see train_minimum()
+        self.max_train_vectors = max_train_vectors or 256 * nlist
+
+    def factory_string(self, index_type: Optional[str] = None) -> str:
+        index_type = index_type or self.index_type
+        if index_type == "flat":
+            return "Flat"
+        if index_type == "ivf_flat":
+            return f"IVF{self.nlist},Flat"
+        if index_type == "ivf_pq":
+            return f"IVF{self.nlist},PQ{self.pq_m}x{self.pq_nbits}"
+        if index_type == "sq_fp16":
+            return "SQfp16"
+        if index_type == "sq8":
+            return "SQ8"
+        return f"HNSW{self.hnsw_m},Flat"
+
+    def requires_training(self, index_type: Optional[str] = None) -> bool:
+        return (index_type or self.index_type) in ("ivf_flat", "ivf_pq", "sq8")
+
+    def train_minimum(self, index_type: Optional[str] = None) -> int:
+        """Vectors needed before an index of index_type can be trained"""
+        if self.min_train_vectors:
+            return self.min_train_vectors
+        # FAISS k-means wants ~39 points per centroid at minimum; SQ8 only
+        # learns per-dimension value ranges
+        return 1000 if (index_type or self.index_type) == "sq8" else 39 * self.nlist
+
+
+def build_index(config: IndexConfig, dim: int, index_type: Optional[str] = None):
+    """Create an empty (untrained) index of the given type"""
+    import faiss
+
+    index_type = index_type or config.index_type
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.ef_construction
+    else:
+        index = faiss.index_factory(dim, config.factory_string(index_type), faiss.METRIC_INNER_PRODUCT)
+    configure_index(config, index)
+    return index
+
+
+def configure_index(config: IndexConfig, index):
+    """Apply search-time defaults; also used after restoring a snapshot"""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = config.nprobe
+    elif hasattr(index, "hnsw"):
+        index.hnsw.efSearch = config.ef_search
+
+
+def index_type_of(index) -> str:
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq_fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Per-request search parameters, or None to use the index defaults"""
+    import faiss
+
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search is not None and hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def training_sample(config: IndexConfig, source) -> np.ndarray:
+    """Random sample of source vectors used to train IVF/PQ codebooks"""
+    sample_size = min(source.ntotal, config.max_train_vectors)
+    rng = np.random.default_rng()
+    sample_ids = np.sort(rng.choice(source.ntotal, size=sample_size, replace=False)).astype(np.int64)
+    return source.reconstruct_batch(sample_ids)
+
+
+def enable_reconstruct(index):
+    """IVF indexes need a direct map for reconstruct(), used by migrations"""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
@@ -0,0 +1,224 @@
+"""
+Inverted index with BM25 scoring for the lexical half of hybrid search
+"""
+from typing import List, Dict, Optional, Tuple
+from array import array
+from collections import Counter
+import logging
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Postings are kept per term in compact typed arrays (int64 positions,
+    uint32 term frequencies) alongside a uint32 document-length array, so
+    the index is updated incrementally as vectors are added and scores use
+    statistics over the whole corpus. Positions are index positions, the
+    same numbering as the FAISS index and `_documents`.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocab: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tfs: List[array] = []
+        self._doc_lens = array("I")
+        self._total_len = 0
+        # Guards postings against resizing while a reader holds NumPy views
+        self._lock = threading.Lock()
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._doc_lens)
+
+    @staticmethod
+    def prepare(texts: List[Optional[str]]) -> List[Tuple[int, Counter]]:
+        """
+        Tokenize texts into (length, term counts) for add_prepared(), so
+        bad input fails before the index is touched
+        """
+        prepared = []
+        for text in texts:
+            if text is not None and not isinstance(text, str):
+                raise TypeError(f"document text must be a string, got {type(text).__name__}")
+            tokens = tokenize(text or "")
+            prepared.append((len(tokens), Counter(tokens)))
+        return prepared
+
+    def add(self, start_id: int, texts: List[Optional[str]]):
+        """Index documents at positions start_id, start_id + 1, ..."""
+        self.add_prepared(start_id, self.prepare(texts))
+
+    def add_prepared(self, start_id: int, documents: List[Tuple[int, Counter]]):
+        with self._lock:
+            if start_id != len(self._doc_lens):
+                raise ValueError(f"BM25 index out of sync: expected position {len(self._doc_lens)}, got {start_id}")
+            for offset, (length, counts) in enumerate(documents):
+                position = start_id + offset
+                self._doc_lens.append(length)
+                self._total_len += length
+                for term, tf in counts.items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = len(self._postings_docs)
+                        self._vocab[term] = term_id
+                        self._postings_docs.append(array("q"))
+                        self._postings_tfs.append(array("I"))
+                    self._postings_docs[term_id].append(position)
+                    self._postings_tfs[term_id].append(tf)
+
+    def truncate(self, num_docs: int):
+        """Drop documents at positions >= num_docs (undoes a failed batch)"""
+        with self._lock:
+            for docs, tfs in zip(self._postings_docs, self._postings_tfs):
+                while docs and docs[-1] >= num_docs:
+                    docs.pop()
+                    tfs.pop()
+            while len(self._doc_lens) > num_docs:
+                self._total_len -= self._doc_lens.pop()
+
+    def score(self, query: str, positions: np.ndarray) -> np.ndarray:
+        """BM25 scores of the given positions for query"""
+        with self._lock:
+            return self._score_locked(query, np.asarray(positions, dtype=np.int64))
+
+    def search(
+        self, query: str, top_k: int, allowed: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k positions by BM25 over the whole corpus, optionally limited to
+        the sorted `allowed` positions. Returns (positions, scores).
+        """
+        with self._lock:
+            return self._search_locked(query, top_k, allowed)
+
+    def _query_terms(self, query: str):
+        """(idf, postings docs, postings tfs) for each known query term"""
+        n = self.num_docs
+        terms = []
+        for term in set(tokenize(query)):
+            term_id = self._vocab.get(term)
+            if term_id is None:
+                continue
+            docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int64)
+            tfs = np.frombuffer(self._postings_tfs[term_id], dtype=np.uint32)
+            df = len(docs)
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            terms.append((idf, docs, tfs))
+        return terms
+
+    def _term_weights(self, idf: float, tfs: np.ndarray, doc_lens: np.ndarray) -> np.ndarray:
+        avg_len = self._total_len / max(self.num_docs, 1) or 1.0
+        tfs = tfs.astype(np.float32)
+        norm = self.k1 * (1.0 - self.b + self.b * doc_lens / avg_len)
+        return idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+    def _score_locked(self, query: str, positions: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(positions), dtype=np.float32)
+        if len(positions) == 0 or self.num_docs == 0:
+            return scores
+        doc_lens = np.frombuffer(self._doc_lens, dtype=np.uint32)
+        for idf, docs, tfs in self._query_terms(query):
+            if len(docs) == 0:
+                continue
+            # Postings are appended in position order, so they are sorted
+            slots = np.searchsorted(docs, positions)
+            slots_clipped = np.minimum(slots, len(docs) - 1)
+            hit = docs[slots_clipped] == positions
+            if not hit.any():
+                continue
+            hit_positions = positions[hit]
+            scores[hit] += self._term_weights(idf, tfs[slots_clipped[hit]], doc_lens[hit_positions])
+        return scores
+
+    def _search_locked(
+        self, query: str, top_k: int, allowed: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if self.num_docs == 0 or top_k <= 0:
+            return empty
+        doc_lens = np.frombuffer(self._doc_lens, dtype=np.uint32)
+
+        all_docs = []
+        all_weights = []
+        for idf, docs, tfs in self._query_terms(query):
+            if allowed is not None:
+                mask = np.isin(docs, allowed, assume_unique=True)
+                docs, tfs = docs[mask], tfs[mask]
+            if len(docs) == 0:
+                continue
+            all_docs.append(docs)
+            all_weights.append(self._term_weights(idf, tfs, doc_lens[docs]))
+        if not all_docs:
+            return empty
+
+        docs = np.concatenate(all_docs)
+        weights = np.concatenate(all_weights)
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        totals = np.bincount(inverse, weights=weights).astype(np.float32)
+
+        k = min(top_k, len(unique_docs))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return unique_docs[top], totals[top]
+
+    # --- Persistence ---
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Flatten into CSR-style arrays for snapshots. Callers must hold off
+        concurrent add() calls; concurrent searches are fine.
+        """
+        terms = [""] * len(self._vocab)
+        for term, term_id in self._vocab.items():
+            terms[term_id] = term
+        lengths = np.fromiter((len(p) for p in self._postings_docs), dtype=np.int64, count=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        doc_ids = np.empty(indptr[-1], dtype=np.int64)
+        tfs = np.empty(indptr[-1], dtype=np.uint32)
+        for term_id in range(len(terms)):
+            start, end = indptr[term_id], indptr[term_id + 1]
+            doc_ids[start:end] = np.frombuffer(self._postings_docs[term_id], dtype=np.int64)
+            tfs[start:end] = np.frombuffer(self._postings_tfs[term_id], dtype=np.uint32)
+        return {
+            # Tokens never contain newlines, so they can be joined with one
+            "terms": np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            "indptr": indptr,
+            "doc_ids": doc_ids,
+            "tfs": tfs,
+            "doc_lens": np.frombuffer(self._doc_lens, dtype=np.uint32).copy(),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+        terms_blob = arrays["terms"].tobytes().decode("utf-8")
+        terms = terms_blob.split("\n") if terms_blob else []
+        indptr = arrays["indptr"]
+        doc_ids = np.ascontiguousarray(arrays["doc_ids"], dtype=np.int64)
+        tfs = np.ascontiguousarray(arrays["tfs"], dtype=np.uint32)
+        for term_id, term in enumerate(terms):
+            start, end = indptr[term_id], indptr[term_id + 1]
+            index._vocab[term] = term_id
+            docs = array("q")
+            docs.frombytes(doc_ids[start:end].tobytes())
+            term_tfs = array("I")
+            term_tfs.frombytes(tfs[start:end].tobytes())
+            index._postings_docs.append(docs)
+            index._postings_tfs.append(term_tfs)
+        index._doc_lens.frombytes(np.ascontiguousarray(arrays["doc_lens"], dtype=np.uint32).tobytes())
+        index._total_len = int(np.sum(arrays["doc_lens"], dtype=np.int64))
+        return index
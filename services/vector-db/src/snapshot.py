@@ -0,0 +1,191 @@
+"""
+Snapshot persistence for the FAISS index and document metadata
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "MANIFEST.json"
+
+
+class SnapshotStore:
+    """
+    Writes generation-numbered snapshots into a directory:
+
+        index-<gen>.faiss      FAISS index (faiss.write_index)
+        documents-<gen>.jsonl  one document record per line, in index order
+        <extra>-<gen>.npz      optional named array bundles (e.g. lexical)
+        MANIFEST.json          points at the current generation
+
+    The manifest is replaced atomically after both data files are fully
+    written and fsynced, so a crash mid-snapshot leaves the previous
+    generation intact.
+
+    save() takes the index already serialized (faiss.serialize_index), so
+    callers can take a consistent in-memory copy under their lock and do
+    the slow part, writing and fsyncing, without holding it.
+    """
+
+    def __init__(self, directory: str, keep: int = 2):
+        self.directory = Path(directory)
+        self.keep = max(1, keep)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(
+        self,
+        index_bytes: np.ndarray,
+        ntotal: int,
+        documents: List[Dict[str, Any]],
+        wal_lsn: int = 0,
+        extras: Optional[Dict[str, Dict[str, np.ndarray]]] = None
+    ) -> int:
+        """
+        Write a new snapshot generation and return its number.
+        index_bytes is the serialized index holding ntotal vectors; wal_lsn
+        is the last write-ahead log record contained in the snapshot.
+        """
+        manifest = self.read_manifest()
+        generation = (manifest["generation"] + 1) if manifest else 1
+        index_name = f"index-{generation:08d}.faiss"
+        documents_name = f"documents-{generation:08d}.jsonl"
+
+        started = time.monotonic()
+
+        index_tmp = self.directory / f"{index_name}.tmp"
+        with open(index_tmp, "wb") as f:
+            f.write(memoryview(index_bytes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_tmp, self.directory / index_name)
+
+        documents_tmp = self.directory / f"{documents_name}.tmp"
+        with open(documents_tmp, "w", encoding="utf-8") as f:
+            for doc in documents:
+                f.write(json.dumps(doc, separators=(",", ":")))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(documents_tmp, self.directory / documents_name)
+
+        extra_names = {}
+        for name, arrays in (extras or {}).items():
+            extra_name = f"{name}-{generation:08d}.npz"
+            extra_tmp = self.directory / f"{extra_name}.tmp"
+            with open(extra_tmp, "wb") as f:
+                np.savez(f, **arrays)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(extra_tmp, self.directory / extra_name)
+            extra_names[name] = extra_name
+
+        new_manifest = {
+            "generation": generation,
+            "index": index_name,
+            "documents": documents_name,
+            "ntotal": int(ntotal),
+            "wal_lsn": wal_lsn,
+            "extras": extra_names,
+            "created_at": time.time()
+        }
+        manifest_tmp = self.directory / f"{MANIFEST_NAME}.tmp"
+        with open(manifest_tmp, "w", encoding="utf-8") as f:
+            json.dump(new_manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_tmp, self.manifest_path)
+        fsync_dir(self.directory)
+
+        self._prune(generation)
+
+        logger.info(
+            f"Snapshot generation {generation} written "
+            f"({ntotal} vectors) in {time.monotonic() - started:.2f}s"
+        )
+        return generation
+
+    def load(self) -> Optional[Tuple[Any, List[Dict[str, Any]], Dict[str, Any]]]:
+        """
+        Load the current snapshot, returning (index, documents, manifest),
+        or None when no snapshot exists yet. The index is read into memory
+        (it keeps taking adds, so it cannot stay memory-mapped read-only).
+        """
+        import faiss
+
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+
+        started = time.monotonic()
+        index = faiss.read_index(str(self.directory / manifest["index"]))
+
+        # One json.loads over the whole file instead of one per line
+        with open(self.directory / manifest["documents"], "r", encoding="utf-8") as f:
+            lines = [line for line in f.read().split("\n") if line.strip()]
+        documents = json.loads("[" + ",".join(lines) + "]")
+
+        if len(documents) != index.ntotal:
+            raise ValueError(
+                f"Snapshot generation {manifest['generation']} is inconsistent: "
+                f"{index.ntotal} vectors but {len(documents)} documents"
+            )
+
+        logger.info(
+            f"Restored snapshot generation {manifest['generation']} "
+            f"({index.ntotal} vectors) in {time.monotonic() - started:.2f}s"
+        )
+        return index, documents, manifest
+
+    def load_extra(self, manifest: Dict[str, Any], name: str) -> Optional[Dict[str, np.ndarray]]:
+        """Arrays saved under `name` with this snapshot, if any"""
+        extra_name = manifest.get("extras", {}).get(name)
+        if extra_name is None:
+            return None
+        with np.load(self.directory / extra_name) as data:
+            return {key: data[key] for key in data.files}
+
+    def _prune(self, current_generation: int):
+        """Remove generations older than the last `keep` ones"""
+        oldest_kept = current_generation - self.keep + 1
+        for path in self.directory.iterdir():
+            if path.name == MANIFEST_NAME or "-" not in path.name:
+                continue
+            try:
+                generation = int(path.name.rsplit("-", 1)[1].split(".", 1)[0])
+            except ValueError:
+                continue
+            if generation < oldest_kept:
+                try:
+                    path.unlink()
+                except OSError as e:
+                    logger.warning(f"Failed to remove old snapshot file {path}: {e}")
+
+
+def fsync_dir(path: Path):
+    """fsync a directory so renames and new files in it survive a crash"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,207 @@
+"""
+Per-tenant index partitions for user-scoped search
+"""
+from typing import List, Optional, Tuple, Dict, Any
+from array import array
+from collections import OrderedDict
+import logging
+
+import numpy as np
+
+from index_factory import COMPACT_INDEX_TYPES, index_type_of
+
+logger = logging.getLogger(__name__)
+
+# Partition key for documents without a user_id; they are visible to everyone
+SHARED = ""
+
+
+class TenantPartitions:
+    """
+    Tracks which index positions belong to each user_id and serves
+    user-scoped searches from small exact per-tenant indexes, so a
+    tenant's search costs O(tenant size) instead of O(corpus size) and
+    always returns a true top-k over the vectors that tenant can see.
+    Scoped searches are exhaustive, so nprobe / ef_search do not apply.
+
+    Position lists are always kept up to date; the per-tenant FAISS
+    indexes are materialized from the main index on first search
+    (keeping cold start fast; see pending() / build() / install() for
+    building them off the event loop) and evicted LRU-first once they
+    take more than `max_cached_bytes`. Partitions of a compressed main
+    index (scalar-quantized or IVF-PQ) store float16 vectors, others
+    float32; the choice follows the main index at build time, and
+    reset() drops partitions built for a replaced index. With IVF-PQ the
+    partition vectors are the PQ reconstructions.
+    """
+
+    def __init__(self, dim: int, max_cached_bytes: int = 1024 * 1024 * 1024):
+        self.dim = dim
+        self.max_cached_bytes = max_cached_bytes
+        self._ids: Dict[str, array] = {}
+        self._indexes: "OrderedDict[str, Any]" = OrderedDict()
+        self._cached_bytes = 0
+
+    @staticmethod
+    def key(user_id: Optional[str]) -> str:
+        return user_id or SHARED
+
+    def keys(self, user_id: Optional[str]) -> List[str]:
+        """Partitions a user_id's searches cover: its own plus shared"""
+        keys = [self.key(user_id)]
+        if keys[0] != SHARED:
+            keys.append(SHARED)
+        return keys
+
+    def size(self, user_id: Optional[str]) -> int:
+        ids = self._ids.get(self.key(user_id))
+        return len(ids) if ids is not None else 0
+
+    def visible_count(self, user_id: str) -> int:
+        return self.size(user_id) + (self.size(SHARED) if self.key(user_id) != SHARED else 0)
+
+    def visible_positions(self, user_id: str) -> np.ndarray:
+        """Sorted positions of the tenant's vectors plus shared vectors"""
+        parts = [
+            np.frombuffer(self._ids[key], dtype=np.int64)
+            for key in {self.key(user_id), SHARED}
+            if key in self._ids
+        ]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def rebuild(self, documents: List[Dict[str, Any]]):
+        """Recompute position lists from document metadata (after restore)"""
+        self._ids = {}
+        self.reset()
+        for position, doc in enumerate(documents):
+            key = self.key(doc["metadata"].get("user_id"))
+            self._ids.setdefault(key, array("q")).append(position)
+
+    def reset(self):
+        """Drop all materialized partitions (e.g. after the main index is replaced)"""
+        self._indexes.clear()
+        self._cached_bytes = 0
+
+    def add(self, start_id: int, vectors: np.ndarray, user_ids: List[Optional[str]]):
+        """Register vectors just added to the main index at start_id.."""
+        groups: Dict[str, List[int]] = {}
+        for offset, user_id in enumerate(user_ids):
+            groups.setdefault(self.key(user_id), []).append(offset)
+
+        for key, offsets in groups.items():
+            positions = np.asarray(offsets, dtype=np.int64) + start_id
+            self._ids.setdefault(key, array("q")).extend(positions.tolist())
+            index = self._indexes.get(key)
+            if index is not None:
+                index.add_with_ids(vectors[offsets], positions)
+                self._cached_bytes += len(offsets) * _bytes_per_vector(index)
+        self._evict()
+
+    def truncate(self, num_positions: int):
+        """Forget positions >= num_positions (undoes a failed add)"""
+        for key, ids in self._ids.items():
+            if ids and ids[-1] >= num_positions:
+                while ids and ids[-1] >= num_positions:
+                    ids.pop()
+                index = self._indexes.pop(key, None)
+                if index is not None:
+                    self._cached_bytes -= index.ntotal * _bytes_per_vector(index)
+
+    def pending(self, user_id: Optional[str]) -> List[str]:
+        """Partitions a search for user_id needs that are not materialized"""
+        return [key for key in self.keys(user_id) if self._ids.get(key) and key not in self._indexes]
+
+    def build(self, source_index, key: str):
+        """
+        Build (but don't install) the partition for key. Safe to run in a
+        worker thread as long as nothing is added to source_index meanwhile.
+        """
+        import faiss
+
+        positions = np.frombuffer(self._ids[key], dtype=np.int64).copy()
+        if index_type_of(source_index) in COMPACT_INDEX_TYPES + ("ivf_pq",):
+            base = faiss.IndexScalarQuantizer(self.dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIDMap(base)
+        index.add_with_ids(source_index.reconstruct_batch(positions), positions)
+        return index
+
+    def install(self, key: str, index):
+        """Cache a partition from build(), evicting others if over budget"""
+        if key in self._indexes:
+            return
+        self._indexes[key] = index
+        self._cached_bytes += index.ntotal * _bytes_per_vector(index)
+        logger.info(f"Materialized tenant partition with {index.ntotal} vectors")
+        self._evict(keep=key)
+
+    def search(
+        self, source_index, queries: np.ndarray, k: int, user_id: Optional[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact top-k over the tenant's vectors plus shared vectors. Returns
+        (distances, positions) shaped like faiss search output, with -1
+        positions when fewer than k vectors are visible. Partitions not
+        materialized yet are built inline (callers on the event loop should
+        build them first, see pending()).
+        """
+        all_distances = []
+        all_ids = []
+        for key in self.keys(user_id):
+            index = self._materialize(source_index, key)
+            if index is None or index.ntotal == 0:
+                continue
+            distances, ids = index.search(queries, min(k, index.ntotal))
+            all_distances.append(distances)
+            all_ids.append(ids)
+
+        n = len(queries)
+        result_distances = np.full((n, k), -np.inf, dtype=np.float32)
+        result_ids = np.full((n, k), -1, dtype=np.int64)
+        if not all_distances:
+            return result_distances, result_ids
+
+        distances = np.concatenate(all_distances, axis=1)
+        ids = np.concatenate(all_ids, axis=1)
+        order = np.argsort(-distances, axis=1)[:, :k]
+        take = order.shape[1]
+        result_distances[:, :take] = np.take_along_axis(distances, order, axis=1)
+        result_ids[:, :take] = np.take_along_axis(ids, order, axis=1)
+        return result_distances, result_ids
+
+    def _materialize(self, source_index, key: str):
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+            return index
+        if not self._ids.get(key):
+            return None
+        self.install(key, self.build(source_index, key))
+        return self._indexes.get(key)
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._cached_bytes > self.max_cached_bytes and len(self._indexes) > 1:
+            key, index = next(iter(self._indexes.items()))
+            if key == keep:
+                self._indexes.move_to_end(key)
+                continue
+            del self._indexes[key]
+            self._cached_bytes -= index.ntotal * _bytes_per_vector(index)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tenants": len(self._ids),
+            "materialized": len(self._indexes),
+            "cached_vectors": sum(index.ntotal for index in self._indexes.values()),
+            "cached_bytes": self._cached_bytes
+        }
+
+
+def _bytes_per_vector(index) -> int:
+    """Storage per vector of an IndexIDMap partition: codes plus the id"""
+    import faiss
+
+    return faiss.downcast_index(index.index).code_size + 8
@@ -0,0 +1,339 @@
+"""
+Append-only write-ahead log for vector additions
+"""
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from snapshot import fsync_dir
+
+logger = logging.getLogger(__name__)
+
+# Record header: magic, crc32, lsn, row count, dimensions, metadata length.
+# The CRC covers everything after the crc field (rest of header + payload).
+HEADER = struct.Struct("<IIQIII")
+MAGIC = 0x4C415756  # "VWAL"
+
+
+class WriteAheadLog:
+    """
+    Each record holds one `/index/add` batch:
+
+        header | float32 vectors (rows * dim, little-endian) | metadata JSON
+
+    Records are numbered by a monotonically increasing LSN and written to
+    segment files named after the first LSN they contain
+    (`wal-<lsn>.log`). Appends only buffer the record in memory; a single
+    flusher task writes and fsyncs everything buffered since the previous
+    flush (group commit), and `commit()` waits for that flush.
+
+    A failed write is cut off the segment and its records stay at the
+    head of the buffer, retried by the flusher with backoff while their
+    commits wait, so durable_lsn never passes an LSN that isn't on disk.
+    A failed fsync (the kernel may have dropped the pages, so a later
+    fsync proves nothing) or a partial write that cannot be removed sets
+    `failure`: commits then fail and append() refuses new records.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        flush_interval_ms: float = 5.0,
+    ):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.last_lsn = 0      # last LSN handed out by append()
+        self.durable_lsn = 0   # last LSN known to be on disk
+        self.failure: Optional[str] = None
+
+        self._buffer: List[Tuple[int, bytes]] = []
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Segment file state is only touched from the flush thread, but
+        # rotate()/truncate() may be called from the event loop.
+        self._file_lock = threading.Lock()
+        self._file = None
+        self._file_size = 0
+        self._rotate_requested = False
+
+    # --- Replay ---
+
+    def segments(self) -> List[Tuple[int, Path]]:
+        result = []
+        for path in self.directory.glob("wal-*.log"):
+            try:
+                result.append((int(path.stem.split("-", 1)[1]), path))
+            except ValueError:
+                continue
+        return sorted(result)
+
+    def replay(self, after_lsn: int = 0) -> Iterator[Tuple[int, np.ndarray, List[Dict[str, Any]]]]:
+        """
+        Yield (lsn, vectors, metadata) for every intact record with
+        lsn > after_lsn, in order. A torn or corrupt record ends the log:
+        its segment is truncated there and any later segments are set
+        aside, so the next append continues from the last good LSN.
+        """
+        last_lsn = after_lsn
+        segments = self.segments()
+        for seg_idx, (_, path) in enumerate(segments):
+            with open(path, "rb") as f:
+                data = f.read()
+            view = memoryview(data)
+            offset = 0
+            corrupt = False
+            while offset < len(data):
+                record = _decode_record(view, offset)
+                if record is None:
+                    corrupt = True
+                    break
+                lsn, vectors, metadata, size = record
+                offset += size
+                if lsn > last_lsn:
+                    last_lsn = lsn
+                    yield lsn, vectors, metadata
+
+            if corrupt:
+                logger.warning(f"WAL segment {path.name} is torn at offset {offset}, truncating")
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+                    os.fsync(f.fileno())
+                for _, later in segments[seg_idx + 1:]:
+                    logger.error(f"Setting aside WAL segment {later.name} after corruption")
+                    later.rename(later.with_suffix(".corrupt"))
+                break
+
+        self.last_lsn = max(self.last_lsn, last_lsn)
+        self.durable_lsn = self.last_lsn
+
+    def quarantine(self, lsn: int, vectors: np.ndarray, metadata: Any, reason: str) -> Path:
+        """
+        Set aside a record that decoded fine but could not be applied, so
+        replay can skip it instead of failing on every start
+        """
+        directory = self.directory / "quarantine"
+        directory.mkdir(exist_ok=True)
+        path = directory / f"record-{lsn:020d}.npz"
+        with open(path, "wb") as f:
+            np.savez(f, vectors=vectors, metadata=np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8))
+        logger.error(f"WAL record {lsn} could not be applied ({reason}), moved to {path}")
+        return path
+
+    # --- Appending ---
+
+    def append(self, vectors: np.ndarray, metadata: List[Dict[str, Any]]) -> int:
+        """Buffer a record and return its LSN; call commit() to make it durable"""
+        if self.failure is not None:
+            raise RuntimeError(f"WAL unavailable: {self.failure}")
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        rows, dim = vectors.shape
+        meta_bytes = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+        payload = vectors.tobytes() + meta_bytes
+
+        self.last_lsn += 1
+        lsn = self.last_lsn
+        rest = HEADER.pack(MAGIC, 0, lsn, rows, dim, len(meta_bytes))[8:] + payload
+        record = HEADER.pack(MAGIC, zlib.crc32(rest), lsn, rows, dim, len(meta_bytes)) + payload
+        self._buffer.append((lsn, record))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return lsn
+
+    async def commit(self, lsn: int):
+        """Wait until the record with this LSN has been fsynced"""
+        if lsn <= self.durable_lsn:
+            return
+        if self._flusher is None:
+            # No background flusher (e.g. during tests): flush inline
+            await self._flush()
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((lsn, future))
+        await future
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Flush everything buffered and close the current segment"""
+        if self._flusher is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+        else:
+            await self._flush()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    async def _flush_loop(self):
+        retry_delay = 0.0
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Group window: let concurrent requests join this flush
+            if self.flush_interval > 0 and not self._stopping:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+                retry_delay = 0.0
+            except Exception as e:
+                logger.error(f"WAL flush failed: {str(e)}")
+                if self.failure is None and not self._stopping:
+                    retry_delay = min(max(retry_delay * 2, 0.1), 5.0)
+                    await asyncio.sleep(retry_delay)
+                    self._wakeup.set()
+            if self._stopping:
+                return
+
+    async def _flush(self):
+        records, self._buffer = self._buffer, []
+        waiters, self._waiters = self._waiters, []
+        try:
+            if self.failure is not None:
+                raise RuntimeError(f"WAL unavailable: {self.failure}")
+            if records:
+                await asyncio.to_thread(self._write_records, records)
+                self.durable_lsn = records[-1][0]
+        except Exception as e:
+            # Unwritten records go back first, in LSN order
+            self._buffer = records + self._buffer
+            if self.failure is None:
+                self._waiters = waiters + self._waiters
+            else:
+                for _, future in waiters + self._waiters:
+                    if not future.done():
+                        future.set_exception(e)
+                self._waiters = []
+            raise
+
+        pending = []
+        for lsn, future in waiters:
+            if lsn <= self.durable_lsn:
+                if not future.done():
+                    future.set_result(None)
+            else:
+                pending.append((lsn, future))
+        self._waiters = pending + self._waiters
+
+    def _write_records(self, records: List[Tuple[int, bytes]]):
+        with self._file_lock:
+            # (path, size) of the segment being written before this call
+            start = None
+            try:
+                for lsn, record in records:
+                    if (
+                        self._file is None
+                        or self._rotate_requested
+                        or self._file_size >= self.segment_bytes
+                    ):
+                        self._open_segment(lsn)
+                        start = None
+                    if start is None:
+                        start = (self._file.name, self._file_size)
+                    self._file.write(record)
+                    self._file_size += len(record)
+                self._file.flush()
+            except OSError:
+                if self.failure is None:
+                    self._discard_unsynced(start)
+                raise
+            self._fsync(self._file)
+
+    def _fsync(self, file):
+        try:
+            os.fsync(file.fileno())
+        except OSError as e:
+            self.failure = f"fsync of {Path(file.name).name} failed: {str(e)}"
+            raise
+
+    def _discard_unsynced(self, start: Optional[Tuple[str, int]]):
+        """Cut a failed write off its segment so a retry appends whole records"""
+        file, self._file = self._file, None
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                pass
+        if start is None:
+            return
+        path, size = start
+        try:
+            os.truncate(path, size)
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.failure = f"could not remove a partial write from {Path(path).name}: {str(e)}"
+
+    def _open_segment(self, first_lsn: int):
+        if self._file is not None:
+            self._file.flush()
+            self._fsync(self._file)
+            self._file.close()
+        path = self.directory / f"wal-{first_lsn:020d}.log"
+        self._file = open(path, "ab")
+        self._file_size = self._file.tell()
+        self._rotate_requested = False
+        fsync_dir(self.directory)
+
+    # --- Housekeeping ---
+
+    def rotate(self):
+        """Start a new segment with the next flushed record"""
+        with self._file_lock:
+            self._rotate_requested = True
+
+    def truncate(self, upto_lsn: int) -> int:
+        """Delete segments whose records are all <= upto_lsn"""
+        removed = 0
+        with self._file_lock:
+            segments = self.segments()
+            current = Path(self._file.name) if self._file is not None else None
+            for (_, path), (next_first, _) in zip(segments, segments[1:]):
+                if next_first - 1 <= upto_lsn and path != current:
+                    path.unlink()
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} WAL segments covered by LSN {upto_lsn}")
+        return removed
+
+
+def _decode_record(view: memoryview, offset: int):
+    """Decode one record at offset, or return None if it is torn/corrupt"""
+    if offset + HEADER.size > len(view):
+        return None
+    magic, crc, lsn, rows, dim, meta_len = HEADER.unpack_from(view, offset)
+    if magic != MAGIC:
+        return None
+    vec_bytes = rows * dim * 4
+    end = offset + HEADER.size + vec_bytes + meta_len
+    if end > len(view):
+        return None
+    if zlib.crc32(view[offset + 8:end]) != crc:
+        return None
+    vec_start = offset + HEADER.size
+    vectors = np.frombuffer(view[vec_start:vec_start + vec_bytes], dtype="<f4").reshape(rows, dim)
+    metadata = json.loads(bytes(view[vec_start + vec_bytes:end]))
+    return lsn, vectors, metadata, end - offset
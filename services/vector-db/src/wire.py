@@ -0,0 +1,72 @@
+"""
+Binary vector transport (application/x-vector-batch)
+Must stay byte-compatible with services/embedding/src/wire.py
+"""
+from typing import Any, Optional, Tuple
+import json
+import struct
+
+import numpy as np
+
+VECTOR_BATCH_MEDIA_TYPE = "application/x-vector-batch"
+
+# magic, dtype code, 3 reserved bytes, rows, dimensions (little-endian)
+HEADER = struct.Struct("<4sB3xII")
+MAGIC = b"VEC1"
+
+DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2"), 3: np.dtype("i1")}
+DTYPE_CODES = {"float32": 1, "float16": 2, "int8": 3}
+
+# int8 is symmetric scalar quantization of unit-norm vectors, whose
+# components lie in [-1, 1]: code = round(x * 127)
+INT8_SCALE = 127.0
+
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    return np.round(np.clip(vectors, -1.0, 1.0) * INT8_SCALE).astype(np.int8)
+
+
+def dequantize_int8(codes: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) / INT8_SCALE
+
+
+def encode_vector_batch(vectors: np.ndarray, dtype: str = "float32", trailer: Optional[Any] = None) -> bytes:
+    """
+    header | rows * dim little-endian floats | optional UTF-8 JSON trailer
+    """
+    code = DTYPE_CODES[dtype]
+    if dtype == "int8" and vectors.dtype != np.int8:
+        vectors = quantize_int8(vectors)
+    vectors = np.ascontiguousarray(vectors, dtype=DTYPES[code])
+    rows, dim = vectors.shape
+    parts = [HEADER.pack(MAGIC, code, rows, dim), vectors.tobytes()]
+    if trailer is not None:
+        parts.append(json.dumps(trailer, separators=(",", ":")).encode("utf-8"))
+    return b"".join(parts)
+
+
+def decode_vector_batch(body: bytes) -> Tuple[np.ndarray, Optional[Any]]:
+    """
+    Decode into a float32 (rows, dim) array and the JSON trailer (or None).
+    float32 payloads are returned as a read-only view of body (no copy);
+    float16 and int8 payloads are widened (int8 divided by INT8_SCALE).
+    """
+    if len(body) < HEADER.size:
+        raise ValueError("Vector batch is shorter than its header")
+    magic, code, rows, dim = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError("Not a vector batch (bad magic)")
+    dtype = DTYPES.get(code)
+    if dtype is None:
+        raise ValueError(f"Unsupported vector dtype code {code}")
+    end = HEADER.size + rows * dim * dtype.itemsize
+    if end > len(body):
+        raise ValueError(f"Vector batch truncated: expected {end} bytes, got {len(body)}")
+
+    vectors = np.frombuffer(body, dtype=dtype, count=rows * dim, offset=HEADER.size).reshape(rows, dim)
+    if code == DTYPE_CODES["int8"]:
+        vectors = dequantize_int8(vectors)
+    elif dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    trailer = json.loads(body[end:]) if end < len(body) else None
+    return vectors, trailer
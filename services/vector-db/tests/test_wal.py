@@ -0,0 +1,175 @@
+"""
+Write-ahead log: crash recovery (torn tails, corrupt segments) and
+segment rotation / truncation, write and fsync failures
+"""
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from wal import WriteAheadLog
+
+
+def append_committed(wal: WriteAheadLog, count: int, dim: int = 4, start: int = 0):
+    """Append count one-row records and flush them (no background flusher)"""
+    lsns = []
+    for i in range(start, start + count):
+        lsn = wal.append(np.full((1, dim), i, dtype=np.float32), [{"text": f"record {i}"}])
+        asyncio.run(wal.commit(lsn))
+        lsns.append(lsn)
+    return lsns
+
+
+def close(wal: WriteAheadLog):
+    asyncio.run(wal.stop())
+
+
+def replayed(directory, after_lsn: int = 0):
+    wal = WriteAheadLog(str(directory))
+    records = [(lsn, vectors.copy(), metadata) for lsn, vectors, metadata in wal.replay(after_lsn)]
+    return wal, records
+
+
+def test_replay_returns_records_in_order(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    assert append_committed(wal, 3) == [1, 2, 3]
+    close(wal)
+
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [1, 2, 3]
+    assert [metadata[0]["text"] for _, _, metadata in records] == ["record 0", "record 1", "record 2"]
+    np.testing.assert_array_equal(records[2][1], np.full((1, 4), 2, dtype=np.float32))
+    assert wal.last_lsn == 3
+
+    _, records = replayed(tmp_path, after_lsn=2)
+    assert [lsn for lsn, _, _ in records] == [3]
+
+
+def test_torn_tail_recovers_intact_prefix(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    append_committed(wal, 5)
+    close(wal)
+
+    (_, segment), = wal.segments()
+    size = segment.stat().st_size
+    record_size = size // 5
+    # Crash in the middle of writing the last record
+    with open(segment, "r+b") as f:
+        f.truncate(size - record_size // 2)
+
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [1, 2, 3, 4]
+    assert wal.last_lsn == 4
+    # The torn bytes are cut off, so new records follow the intact prefix
+    assert segment.stat().st_size == 4 * record_size
+
+    append_committed(wal, 1, start=5)
+    close(wal)
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [1, 2, 3, 4, 5]
+    assert records[-1][2][0]["text"] == "record 5"
+
+
+def test_corrupt_record_sets_aside_later_segments(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    append_committed(wal, 2)
+    wal.rotate()
+    append_committed(wal, 2, start=2)
+    close(wal)
+
+    (_, first), (_, second) = wal.segments()
+    data = bytearray(first.read_bytes())
+    data[-1] ^= 0xFF  # flip a byte in the second record's payload
+    first.write_bytes(bytes(data))
+
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [1]
+    assert wal.last_lsn == 1
+    assert not second.exists()
+    assert second.with_suffix(".corrupt").exists()
+
+
+def test_last_lsn_and_truncate_across_rotate(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    append_committed(wal, 2)
+    wal.rotate()
+    append_committed(wal, 2, start=2)
+    wal.rotate()
+    append_committed(wal, 1, start=4)
+    assert wal.last_lsn == 5
+    assert [first for first, _ in wal.segments()] == [1, 3, 5]
+
+    # Segment 1-2 is only partly covered by LSN 1
+    assert wal.truncate(1) == 0
+    assert wal.truncate(2) == 1
+    assert [first for first, _ in wal.segments()] == [3, 5]
+    # The segment being written is never removed
+    assert wal.truncate(5) == 1
+    assert [first for first, _ in wal.segments()] == [5]
+    close(wal)
+
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [5]
+    assert wal.last_lsn == 5
+    # LSNs keep increasing after truncation and restart
+    assert append_committed(wal, 1, start=5) == [6]
+    close(wal)
+
+
+class FailingFile:
+    """Segment file whose next write stores half the record, then fails"""
+
+    def __init__(self, file):
+        self.file = file
+        self.name = file.name
+        self.armed = True
+
+    def write(self, data: bytes):
+        if self.armed:
+            self.armed = False
+            self.file.write(data[:len(data) // 2])
+            self.file.flush()
+            raise OSError(28, "No space left on device")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def test_failed_write_is_retried_without_skipping_lsns(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    append_committed(wal, 1)
+    wal._file = FailingFile(wal._file)
+
+    lsn = wal.append(np.full((1, 4), 1, dtype=np.float32), [{"text": "record 1"}])
+    with pytest.raises(OSError):
+        asyncio.run(wal.commit(lsn))
+    assert wal.durable_lsn == 1
+    assert wal.failure is None
+
+    # The next flush writes the failed record first, then the new one
+    assert append_committed(wal, 1, start=2) == [3]
+    assert wal.durable_lsn == 3
+    close(wal)
+
+    wal, records = replayed(tmp_path)
+    assert [lsn for lsn, _, _ in records] == [1, 2, 3]
+    assert [metadata[0]["text"] for _, _, metadata in records] == ["record 0", "record 1", "record 2"]
+
+
+def test_failed_fsync_stops_the_log(tmp_path, monkeypatch):
+    wal = WriteAheadLog(str(tmp_path))
+    append_committed(wal, 1)
+
+    def failing_fsync(fd):
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    lsn = wal.append(np.full((1, 4), 1, dtype=np.float32), [{"text": "record 1"}])
+    with pytest.raises(OSError):
+        asyncio.run(wal.commit(lsn))
+    assert wal.durable_lsn == 1
+    assert wal.failure is not None
+    with pytest.raises(RuntimeError):
+        wal.append(np.full((1, 4), 2, dtype=np.float32), [{"text": "record 2"}])